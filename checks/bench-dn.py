@@ -0,0 +1,157 @@
+#!/usr/bin/python2
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks of the ipapython.dn module.
+
+    ./checks/bench-dn.py [BENCHMARK...]
+
+Without arguments all of the benchmarks are run.
+
+cache
+    Construct, hash and compare 10000 DN's, as EditableDN which computes
+    its string and comparison key every time and as DN which caches them.
+
+parse
+    Parse and serialize 12000 member DN's, with str2dn and dn2str as DN
+    did before and with the parser of ipapython.dn.
+"""
+
+from os import path
+import sys
+import time
+parent = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, parent)
+
+from ldap.dn import str2dn, dn2str
+import ipapython.dn
+from ipapython.dn import AVA, RDN, DN, EditableDN
+
+base_dn = DN(('dc', 'example'), ('dc', 'com'))
+container_dn = DN(('cn', 'users'), ('cn', 'accounts'))
+
+
+def timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def bench_cache(n=10000):
+    names = ['user%d' % i for i in xrange(n)]
+
+    def create(DN_class):
+        return [DN_class(('uid', name), container_dn, base_dn)
+                for name in names]
+
+    def hash_uncached(dns):
+        for dn in dns:
+            hash(str(dn).lower())
+
+    def hash_cached(dns):
+        for dn in dns:
+            hash(dn)
+
+    def compare(dns1, dns2):
+        for (dn1, dn2) in zip(dns1, dns2):
+            dn1 == dn2
+
+    mutable_create, mutable_dns = timed(create, EditableDN)
+    immutable_create, immutable_dns = timed(create, DN)
+    other_dns = create(DN)
+    # The cached values are computed on first use
+    hash_cached(immutable_dns)
+    compare(immutable_dns, other_dns)
+
+    mutable_hash, _ = timed(hash_uncached, mutable_dns)
+    immutable_hash, _ = timed(hash_cached, immutable_dns)
+    mutable_compare, _ = timed(compare, mutable_dns, create(EditableDN))
+    immutable_compare, _ = timed(compare, immutable_dns, other_dns)
+
+    for (what, mutable, immutable) in (
+            ('construction', mutable_create, immutable_create),
+            ('hashing', mutable_hash, immutable_hash),
+            ('comparison', mutable_compare, immutable_compare)):
+        print '%d DN %s: %.3fs uncached, %.3fs cached' % (
+            n, what, mutable, immutable)
+
+
+def bench_parse(n=2000):
+    base = 'dc=idm,dc=lab,dc=bos,dc=redhat,dc=com'
+    corpus = []
+    for i in xrange(n):
+        corpus.extend([
+            'uid=user%d,cn=users,cn=accounts,%s' % (i, base),
+            'cn=group%d,cn=groups,cn=accounts,%s' % (i, base),
+            'fqdn=host%d.idm.lab.bos.redhat.com,cn=computers,'
+            'cn=accounts,%s' % (i, base),
+            'krbprincipalname=HTTP/host%d.idm.lab.bos.redhat.com@'
+            'IDM.LAB.BOS.REDHAT.COM,cn=services,cn=accounts,%s' % (i, base),
+            'ipaUniqueID=%08x-cafe-11e2-b3b9-001a4a0c2b%02x,cn=hbac,%s' % (
+                i, i % 256, base),
+            'cn=System: Read Users %d,cn=permissions,cn=pbac,%s' % (i, base),
+        ])
+    corpus = [dn_str.decode('utf-8') for dn_str in corpus]
+    idm_dn = DN(base)
+
+    def parse_str2dn():
+        # What DN(dn_str) used to do: str2dn, one AVA and one RDN per
+        # component and dn2str to serialize
+        for dn_str in corpus:
+            rdns = []
+            for rdn_list in str2dn(dn_str.encode('utf-8')):
+                avas = [AVA(attr, value)
+                        for (attr, value, flags) in rdn_list]
+                rdns.append(RDN(*avas))
+            dn2str([[(ava.attr.encode('utf-8'),
+                      ava.value.encode('utf-8'), 0) for ava in rdn]
+                    for rdn in rdns])
+
+    def parse_fast():
+        for dn_str in corpus:
+            dn = DN(dn_str)
+            str(dn)
+            dn.endswith(idm_dn)
+
+    ipapython.dn._parsed_dn_cache.clear()
+    str2dn_time, _ = timed(parse_str2dn)
+    ipapython.dn._parsed_dn_cache.clear()
+    fast_time, _ = timed(parse_fast)
+
+    print '%d member DN\'s: %.3fs with str2dn, %.3fs with the fast ' \
+        'parser' % (len(corpus), str2dn_time, fast_time)
+
+
+BENCHMARKS = (
+    ('cache', bench_cache),
+    ('parse', bench_parse),
+)
+
+
+def main():
+    names = sys.argv[1:] or [name for (name, func) in BENCHMARKS]
+    for name in names:
+        if name not in dict(BENCHMARKS):
+            raise SystemExit('unknown benchmark %r' % name)
+    for (name, func) in BENCHMARKS:
+        if name in names:
+            func()
+
+
+if __name__ == '__main__':
+    main()
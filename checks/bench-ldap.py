@@ -0,0 +1,184 @@
+#!/usr/bin/python2
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Benchmarks of the LDAP backend.
+
+    ./checks/bench-ldap.py [BENCHMARK...]
+
+Without arguments all of the benchmarks are run.
+
+decode
+    Convert and decode a recorded result set of 10000 entries, compared
+    to looking up the syntax of each attribute in the schema.
+
+indirect
+    Resolve the indirect membership of a tree of nested groups, once per
+    entry and once in batches. Needs a running server and the Directory
+    Manager password in ~/.ipa/.dmpw. The groups are removed afterwards.
+"""
+
+from os import path
+import sys
+import time
+import ldap.schema
+parent = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, parent)
+
+from ipalib import api, errors
+from ipapython import ipautil
+from ipapython.dn import DN
+
+api.bootstrap(in_server=True, in_tree=True, context='cli')
+api.finalize()
+
+from ipapython.ipaldap import IPASimpleLDAPObject
+from ipaserver.plugins.ldap2 import ldap2
+
+schema_entry = {
+    'attributeTypes': [
+        "( 2.5.4.3 NAME ( 'cn' 'commonName' ) "
+        "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )",
+        "( 2.5.4.31 NAME 'member' "
+        "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )",
+        "( 1.3.6.1.1.1.1.0 NAME 'uidNumber' "
+        "SYNTAX 1.3.6.1.4.1.1466.115.121.1.27 SINGLE-VALUE )",
+        "( 2.5.4.36 NAME 'userCertificate' "
+        "SYNTAX 1.3.6.1.4.1.1466.115.121.1.8 )",
+        "( 2.16.840.1.113730.3.1.217 NAME 'memberOf' "
+        "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )",
+    ],
+    'objectClasses': [
+        "( 2.5.6.0 NAME 'top' ABSTRACT MUST objectClass )"],
+}
+
+
+def bench_decode(count=10000):
+    conn = IPASimpleLDAPObject('ldap://example.com', False)
+    conn._schema = ldap.schema.SubSchema(schema_entry)
+    conn._has_schema = True
+
+    result = [
+        ('uid=user%d,cn=users,cn=accounts,dc=example,dc=com' % i, {
+            'cn': ['User %d' % i],
+            'uidNumber': [str(1000 + i)],
+            'memberOf': ['cn=ipausers,cn=groups,cn=accounts,'
+                         'dc=example,dc=com'],
+            'userCertificate': ['\x30\x82'],
+            'description': ['not in schema'],
+        })
+        for i in xrange(count)
+    ]
+
+    schema = conn.schema
+    start = time.time()
+    for (dn, attrs) in result:
+        for attr in attrs:
+            obj = schema.get_obj(ldap.schema.AttributeType, attr)
+            if obj is not None:
+                (obj.syntax, obj.single_value)
+    schema_time = time.time() - start
+
+    start = time.time()
+    for entry in conn.convert_result(result):
+        for attr in entry.raw:
+            entry[attr]
+    table_time = time.time() - start
+
+    print 'syntax lookups through the schema: %.3fs, ' \
+        'convert and decode through the table: %.3fs' % (
+            schema_time, table_time)
+
+
+def bench_indirect(depth=3, width=3):
+    pwfile = path.join(api.env.dot_ipa, '.dmpw')
+    if not ipautil.file_exists(pwfile):
+        print 'indirect: skipped, no Directory Manager password in %s' % (
+            pwfile)
+        return
+    dm_password = open(pwfile).read().rstrip()
+
+    conn = ldap2(shared_instance=False,
+                 ldap_uri='ldap://%s' % ipautil.format_netloc(api.env.host))
+    conn.connect(bind_dn=DN(('cn', 'directory manager')),
+                 bind_pw=dm_password)
+    container = DN(api.env.container_group, api.env.basedn)
+    dns = []
+
+    def add_tree(name, depth):
+        members = []
+        if depth > 0:
+            for i in range(width):
+                members.append(add_tree(u'%s-%d' % (name, i), depth - 1))
+        dn = DN(('cn', name), container)
+        entry = conn.make_entry(
+            dn,
+            objectclass=['top', 'groupofnames', 'nestedgroup'],
+            cn=[name])
+        if members:
+            entry['member'] = members
+        conn.add_entry(entry)
+        dns.append(dn)
+        return dn
+
+    def find(batch_size):
+        conn.indirect_batch_size = batch_size
+        start = time.time()
+        conn.find_entries(
+            filter='(cn=benchnest*)',
+            attrs_list=['member', 'memberof',
+                        'memberindirect', 'memberofindirect'],
+            base_dn=container,
+            scope=conn.SCOPE_ONELEVEL,
+            size_limit=0)
+        return time.time() - start
+
+    try:
+        add_tree(u'benchnest', depth)
+        per_entry_time = find(0)
+        batched_time = find(100)
+    finally:
+        for dn in reversed(dns):
+            try:
+                conn.delete_entry(dn)
+            except errors.NotFound:
+                pass
+        conn.disconnect()
+
+    print 'indirect membership of %d groups: %.3fs per entry, ' \
+        '%.3fs batched' % (len(dns), per_entry_time, batched_time)
+
+
+BENCHMARKS = (
+    ('decode', bench_decode),
+    ('indirect', bench_indirect),
+)
+
+
+def main():
+    names = sys.argv[1:] or [name for (name, func) in BENCHMARKS]
+    for name in names:
+        if name not in dict(BENCHMARKS):
+            raise SystemExit('unknown benchmark %r' % name)
+    for (name, func) in BENCHMARKS:
+        if name in names:
+            func()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/python2
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compare the size and speed of the compact and pretty JSON responses.
+
+    ./checks/bench-rpc.py [ENTRIES]
+
+The response is a user search returning ENTRIES users (default 2000).
+"""
+
+from os import path
+import sys
+import json
+import time
+parent = path.dirname(path.dirname(path.abspath(__file__)))
+sys.path.insert(0, parent)
+
+from ipalib import rpc
+from ipapython.dn import DN
+
+
+def main():
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    else:
+        count = 2000
+
+    entry = {
+        'dn': DN(('uid', 'tuser'), ('cn', 'users'), ('cn', 'accounts'),
+                 ('dc', 'example'), ('dc', 'com')),
+        'uid': (u'tuser',),
+        'cn': (u'Test User',),
+        'memberof_group': (u'ipausers', u'editors'),
+        'krbprincipalkey': (''.join(chr(i) for i in xrange(256)),),
+        'uidnumber': (u'1000',),
+    }
+    response = dict(
+        result=dict(result=[entry] * count, count=count, truncated=False,
+                    summary=u'%d users matched' % count),
+        error=None, id=0, principal=u'admin@EXAMPLE.COM', version=u'4.0',
+    )
+
+    start = time.time()
+    pretty = json.dumps(rpc.json_encode_binary(response), sort_keys=True,
+                        indent=4)
+    pretty_time = time.time() - start
+
+    start = time.time()
+    compact = rpc.json_dumps_binary(response)
+    compact_time = time.time() - start
+
+    print 'pretty: %d bytes, %.1f ms; compact: %d bytes, %.1f ms' % (
+        len(pretty), pretty_time * 1000, len(compact), compact_time * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/python2
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure how long the ipa command line tool takes to start a command.
+
+Every run is a new Python process which sets up the API like the ipa tool
+does and parses the command line, the server is not contacted. The first
+run builds the plugin index in ~/.ipa/plugin-index, the following ones use
+it.
+
+    ./checks/bench-startup.py [-n RUNS] [-e plugins_on_demand=False]
+"""
+
+from os import path
+import sys
+import optparse
+import subprocess
+
+parent = path.dirname(path.dirname(path.abspath(__file__)))
+
+COMMANDS = (
+    ['help', 'commands'],
+    ['ping'],
+    ['user-show', 'admin'],
+)
+
+CHILD = """
+import os, sys, time
+start = time.time()
+from ipalib import api, cli
+(options, argv) = api.bootstrap_with_global_options(context='cli')
+for klass in cli.cli_plugins:
+    api.register(klass)
+api.load_plugins()
+api.finalize()
+cmd = api.Backend.cli.get_command(argv)
+kw = api.Backend.cli.parse(cmd, argv[1:])
+if cmd.name == 'help':
+    cmd(kw.get('command'), outfile=open(os.devnull, 'w'))
+print time.time() - start
+"""
+
+
+def run(argv, env):
+    cmd = [sys.executable, '-c', CHILD]
+    for item in env:
+        cmd += ['-e', item]
+    cmd += argv
+    p = subprocess.Popen(cmd, cwd=parent, stdout=subprocess.PIPE)
+    (stdout, stderr) = p.communicate()
+    if p.returncode != 0:
+        raise SystemExit('%s failed' % ' '.join(argv))
+    return float(stdout.splitlines()[-1])
+
+
+def main():
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-n', dest='runs', type='int', default=5,
+        help='Number of runs of each command (default 5)')
+    parser.add_option('-e', dest='env', metavar='KEY=VAL', action='append',
+        default=[], help='Set environment variable KEY to VAL')
+    (options, args) = parser.parse_args()
+
+    for argv in COMMANDS:
+        times = sorted(run(argv, options.env) for i in xrange(options.runs))
+        print 'ipa %-20s min %.3fs  median %.3fs  max %.3fs' % (
+            ' '.join(argv), times[0], times[len(times) // 2], times[-1])
+
+
+if __name__ == '__main__':
+    main()
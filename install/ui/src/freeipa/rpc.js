@@ -360,7 +360,8 @@ rpc.command = function(spec) {
 
         that.data = {
             method: that.get_command(),
-            params: [that.args, that.options]
+            params: [that.args, that.options],
+            format: 'compact'
         };
 
         that.request = {
@@ -17,7 +17,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import shlex
 import re
 
 # The Python re module doesn't do nested parenthesis
@@ -31,6 +30,47 @@ PermPat = re.compile(r'(\w+)\s*\((.*)\)\s+(.*)', re.UNICODE)
 # Break the bind rule out
 BindPat = re.compile(r'([a-zA-Z0-9;\.]+)\s*(\!?=)\s*(.*)', re.UNICODE)
 
+# Split the target into tokens. The tokens are the same as those of a
+# non-POSIX shlex lexer with "." as an additional word character:
+#  - whitespace and # comments separate the tokens,
+#  - a word may contain quotes and comments (which are dropped),
+#  - a quoted string is a token including its quotes,
+#  - any other character is a token on its own.
+TokenPat = re.compile(r'''
+    (?:[ \t\r\n]+|\#[^\n]*\n?)*
+    (?:
+        (?P<word>[a-zA-Z0-9_.](?:[a-zA-Z0-9_."']+|\#[^\n]*\n?)*)
+      | (?P<quoted>"[^"]*"|'[^']*')
+      | (?P<unclosed>["'])
+      | (?P<char>.)
+    )?
+''', re.VERBOSE | re.DOTALL)
+
+CommentPat = re.compile(r'\#[^\n]*\n?')
+
+def _tokenize(s):
+    """
+    Yield the tokens of the byte string ``s``, see TokenPat.
+
+    Raises ValueError on an unclosed quoted string, when it is reached.
+    """
+    pos = 0
+    end = len(s)
+    while pos < end:
+        match = TokenPat.match(s, pos)
+        pos = match.end()
+        word = match.group('word')
+        if word is not None:
+            if '#' in word:
+                word = CommentPat.sub('', word)
+            yield word
+        elif match.group('quoted') is not None:
+            yield match.group('quoted')
+        elif match.group('unclosed') is not None:
+            raise ValueError("No closing quotation")
+        elif match.group('char') is not None:
+            yield match.group('char')
+
 ACTIONS = ["allow", "deny"]
 
 PERMISSIONS = ["read", "write", "add", "delete", "search", "compare",
@@ -94,10 +134,7 @@ class ACI:
         return s
 
     def _parse_target(self, aci):
-        lexer = shlex.shlex(aci.encode('utf-8'))
-        lexer.wordchars = lexer.wordchars + "."
-
-        l = []
+        lexer = _tokenize(aci.encode('utf-8'))
 
         var = False
         op = "="
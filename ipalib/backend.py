@@ -23,7 +23,6 @@ Base classes for all backed-end plugins.
 
 import threading
 import plugable
-import os
 from errors import PublicError, InternalError, CommandError
 from request import context, Connection, destroy_context
 
@@ -104,11 +103,13 @@ class Executioner(Backend):
 
     def create_context(self, ccache=None, client_ip=None):
         """
+        ccache: The Kerberos credential cache of the request, it is stored
+                as context.ccache_name for the code executing the request.
         client_ip: The IP address of the remote client.
         """
 
         if ccache is not None:
-            os.environ["KRB5CCNAME"] = ccache
+            setattr(context, 'ccache_name', ccache)
 
         if self.env.in_server:
             self.Backend.ldap2.connect(ccache=ccache)
@@ -118,6 +118,39 @@ DEFAULT_CONFIG = (
 
     ('rpc_protocol', 'jsonrpc'),
 
+    # Bound LDAP connections kept by the server for reuse across requests,
+    # 0 disables pooling. Idle connections are dropped after
+    # ldap_pool_idle_timeout seconds.
+    ('ldap_pool_size', 10),
+    ('ldap_pool_idle_timeout', 60),
+
+    # Maximum age in seconds of the IPA configuration entry cached by the
+    # server for all requests, 0 reads it again in every request.
+    ('config_cache_ttl', 10),
+
+    # Keep the entries read by get_entry for the rest of the request, until
+    # the connection writes to the directory
+    ('ldap_entry_cache', True),
+
+    # Maximum age in seconds of the HBAC rules compiled by hbactest and
+    # shared by all requests, 0 compiles them again in every request
+    ('hbac_cache_ttl', 30),
+
+    # Number of certificates whose subject, issuer, fingerprints etc. are
+    # kept for the results of show/find commands, 0 parses them every time
+    ('cert_attrs_cache_size', 10000),
+
+    # Directory where parsed LDAP schemas are stored for reuse by other
+    # processes
+    ('schema_cache_dir', '/var/cache/ipa/schema'),
+
+    # Directory where migrate_ds records the migrated objects, so that an
+    # interrupted migration can be resumed
+    ('migration_checkpoint_dir', '/var/lib/ipa/migration'),
+
+    # Maximum number of threads running the methods of a parallel batch
+    ('batch_max_workers', 4),
+
     # Time to wait for a service to start, in seconds
     ('startup_timeout', 300),
 
@@ -183,6 +183,8 @@ class Retrieve(PKQuery):
     Retrieve an entry by its primary key.
     """
 
+    read_only = True
+
     has_output = output.standard_entry
 
 
@@ -239,6 +241,8 @@ class Search(Method):
     Retrieve all entries that match a given search criteria.
     """
 
+    read_only = True
+
     has_output = output.standard_list_of_entries
 
     def get_args(self):
@@ -274,6 +278,70 @@ class Search(Method):
             for option in super(Search, self).get_options():
                 yield option
 
+    def stream(self, *args, **options):
+        """
+        Perform validation and then execute the search incrementally.
+
+        Returns a `ResultStream` which yields the matching entries as they
+        are found instead of collecting them all first. If not in a server
+        context, the call is forwarded to the nearest IPA server and the
+        entries are read from the response as they arrive.
+        """
+        (args, options) = self._prepare_call(*args, **options)
+        if self.api.env.in_server:
+            if 'version' in options:
+                self.verify_client_version(options['version'])
+            return ResultStream(
+                self.execute_paged(*args, **options), self.msg_summary)
+        return self.Backend.rpcclient.forward_stream(
+            self.name, *args, **options)
+
+    def execute_paged(self, *args, **options):
+        """
+        Generator version of `Command.execute`.
+
+        Yields ``(entries, truncated)`` tuples, one for every page of
+        results. This default implementation yields the whole result of
+        `Command.execute` as a single page; subclasses which can search
+        incrementally should override it.
+        """
+        result = self.execute(*args, **options)
+        yield (result['result'], result['truncated'])
+
+
+class ResultStream(object):
+    """
+    Iterator over the entries returned by `Search.stream`.
+
+    The ``count``, ``truncated`` and ``summary`` attributes are final only
+    after the stream has been exhausted.
+    """
+
+    def __init__(self, pages, msg_summary=None):
+        self.pages = pages
+        self.msg_summary = msg_summary
+        self.count = 0
+        self.truncated = False
+        self.summary = None
+
+    def __iter__(self):
+        for (entries, truncated) in self.pages:
+            for entry in entries:
+                self.count += 1
+                yield entry
+            self.truncated = self.truncated or truncated
+        if self.msg_summary:
+            self.summary = self.msg_summary % dict(
+                count=self.count, truncated=self.truncated)
+
+    def close(self):
+        """
+        Stop the search, discarding any entries not yet read.
+        """
+        close = getattr(self.pages, 'close', None)
+        if close is not None:
+            close()
+
 
 class CrudBackend(backend.Connectible):
     """
@@ -408,6 +408,10 @@ class Command(HasParam):
 
     internal_options = tuple()
 
+    # Commands which never write may run concurrently with other commands,
+    # see batch --parallel
+    read_only = False
+
     msg_summary = None
     msg_truncated = _('Results are truncated, try a more specific search')
 
@@ -418,6 +422,26 @@ class Command(HasParam):
         If not in a server context, the call will be forwarded over
         XML-RPC and the executed an the nearest IPA server.
         """
+        (args, options) = self._prepare_call(*args, **options)
+        ret = self.run(*args, **options)
+        if (
+            isinstance(ret, dict)
+            and 'summary' in self.output
+            and 'summary' not in ret
+        ):
+            if self.msg_summary:
+                ret['summary'] = self.msg_summary % ret
+            else:
+                ret['summary'] = None
+        if self.use_output_validation and (self.output or ret is not None):
+            self.validate_output(ret)
+        return ret
+
+    def _prepare_call(self, *args, **options):
+        """
+        Fill in defaults, normalize, convert and validate the arguments and
+        options of a call and return them as an ``(args, options)`` tuple.
+        """
         self.ensure_finalized()
         params = self.args_options_2_params(*args, **options)
         self.debug(
@@ -432,20 +456,7 @@ class Command(HasParam):
         if not self.api.env.in_server and 'version' not in params:
             params['version'] = API_VERSION
         self.validate(**params)
-        (args, options) = self.params_2_args_options(**params)
-        ret = self.run(*args, **options)
-        if (
-            isinstance(ret, dict)
-            and 'summary' in self.output
-            and 'summary' not in ret
-        ):
-            if self.msg_summary:
-                ret['summary'] = self.msg_summary % ret
-            else:
-                ret['summary'] = None
-        if self.use_output_validation and (self.output or ret is not None):
-            self.validate_output(ret)
-        return ret
+        return self.params_2_args_options(**params)
 
     def soft_validate(self, values):
         errors = dict()
@@ -1183,8 +1194,14 @@ class Object(HasParam):
         if name not in self.api:
             return
         namespace = self.api[name]
-        assert type(namespace) is NameSpace
-        for plugin in namespace(): # Equivalent to dict.itervalues()
+        assert isinstance(namespace, NameSpace)
+        # Match on the plugin names first so the attributes of the other
+        # objects are not instantiated
+        prefix = '%s_' % self.name
+        for attr_name in namespace:
+            if not attr_name.startswith(prefix):
+                continue
+            plugin = namespace[attr_name]
             if plugin.obj_name == self.name:
                 yield plugin
 
@@ -32,9 +32,11 @@ import threading
 import os
 from os import path
 import subprocess
+import tempfile
 import optparse
 import errors
 import textwrap
+import json
 
 from config import Env
 import util
@@ -43,6 +45,7 @@ from text import _
 from base import ReadOnly, NameSpace, lock, islocked, check_name
 from constants import DEFAULT_CONFIG
 from ipapython.ipa_log_manager import *
+from ipapython.version import VERSION
 
 # FIXME: Updated constants.TYPE_ERROR to use this clearer format from wehjit:
 TYPE_ERROR = '%s: need a %r; got a %r: %r'
@@ -196,6 +199,124 @@ class MagicDict(DictProxy):
             raise AttributeError('no magic attribute %r' % name)
 
 
+class PluginNameSpace(NameSpace):
+    """
+    A `NameSpace` of plugins which are instantiated when first accessed.
+
+    The plugin names are known up front, ``get_plugin`` is called with a name
+    the first time the member of that name is accessed and returns the plugin
+    instance. The members are always sorted by name.
+    """
+
+    def __init__(self, names, get_plugin):
+        """
+        :param names: An iterable providing the member names.
+        :param get_plugin: Callable returning the member for a name.
+        """
+        self.__names = tuple(sorted(check_name(name) for name in names))
+        self.__get_plugin = get_plugin
+        self.__map = dict()
+        lock(self)
+
+    def __len__(self):
+        """
+        Return the number of members.
+        """
+        return len(self.__names)
+
+    def __iter__(self):
+        """
+        Iterate through the member names in alphabetical order.
+        """
+        for name in self.__names:
+            yield name
+
+    def __call__(self):
+        """
+        Iterate through the members in alphabetical order by name.
+        """
+        for name in self.__names:
+            yield self[name]
+
+    def __contains__(self, name):
+        """
+        Return ``True`` if namespace has a member named ``name``.
+        """
+        name = getattr(name, '__name__', name)
+        return name in self.__names
+
+    def __getitem__(self, key):
+        """
+        Return a member by name or index, or return a slice of members.
+
+        :param key: The name or index of a member, or a slice object.
+        """
+        key = getattr(key, '__name__',  key)
+        if isinstance(key, basestring):
+            try:
+                return self.__map[key]
+            except KeyError:
+                if key not in self.__names:
+                    raise
+            member = self.__get_plugin(key)
+            self.__map[key] = member
+            return member
+        if type(key) is int:
+            return self[self.__names[key]]
+        if type(key) is slice:
+            return tuple(self[name] for name in self.__names[key])
+        raise TypeError(
+            TYPE_ERROR % ('key', (str, int, slice, 'object with __name__'),
+                          key, type(key))
+        )
+
+    def __getattr__(self, name):
+        """
+        Return the member named ``name``.
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(
+                '%r object has no attribute %r' % (
+                    self.__class__.__name__, name))
+
+    def __repr__(self):
+        """
+        Return a pseudo-valid expression that could create this instance.
+        """
+        cnt = len(self)
+        if cnt == 1:
+            m = 'member'
+        else:
+            m = 'members'
+        return '%s(<%d %s>, sort=True)' % (self.__class__.__name__, cnt, m)
+
+    def __todict__(self):
+        """
+        Return a dict mapping member name to member.
+
+        This instantiates all of the members.
+        """
+        return dict((name, self[name]) for name in self.__names)
+
+
+class PluginInfo(ReadOnly):
+    """
+    Information about a plugin instance, see `API.plugins`.
+    """
+    def __init__(self, created, instance, bases):
+        self.created = created
+        self.name = instance.__class__.__name__
+        self.module = str(instance.__class__.__module__)
+        self.plugin = '%s.%s' % (self.module, self.name)
+        self.bases = tuple(bases)
+        if not is_production_mode(self):
+            lock(self)
+
+
 class Plugin(ReadOnly):
     """
     Base class for all plugins.
@@ -462,9 +583,19 @@ class API(DictProxy):
     Dynamic API object through which `Plugin` instances are accessed.
     """
 
+    # Environment variables which do not change which plugins are registered,
+    # they are left out of the plugin index signature
+    _plugin_index_ignore = ('verbose', 'debug', 'interactive', 'prompt_all',
+                            'fallback', 'delegate')
+
     def __init__(self, *allowed):
         self.__d = dict()
         self.__done = set()
+        # plugin class -> (creation order, plugin instance)
+        self.__plugins = dict()
+        # base name -> {plugin name: [plugin modules to import]}
+        self.__deferred = dict()
+        self.__plugins_lock = threading.RLock()
         self.register = Registrar(*allowed)
         self.env = Env()
         super(API, self).__init__(self.__d)
@@ -678,25 +809,167 @@ class API(DictProxy):
             raise errors.PluginsPackageError(
                 name=subpackage, file=plugins.__file__
             )
-        self.log.debug('importing all plugin modules in %r...', plugins_dir)
-        for (name, pyfile) in util.find_modules_in_dir(plugins_dir):
-            fullname = '%s.%s' % (subpackage, name)
-            self.log.debug('importing plugin module %r', pyfile)
+        modules = [('%s.%s' % (subpackage, name), pyfile)
+                   for (name, pyfile) in util.find_modules_in_dir(plugins_dir)]
+        if not self.env.plugins_on_demand:
+            self.log.debug('importing all plugin modules in %r...', plugins_dir)
+            for (fullname, pyfile) in modules:
+                self.__import_plugin_module(fullname, pyfile)
+            return
+
+        # Import only the modules registering plugins which are finalized
+        # early, the others are imported when one of their plugins is used.
+        signature = self.__get_plugin_index_signature(modules)
+        index = self.__read_plugin_index().get(subpackage)
+        if index is None or index.get('signature') != signature:
+            self.log.debug('indexing all plugin modules in %r...', plugins_dir)
+            index = self.__index_plugin_modules(modules)
+            index['signature'] = signature
+            self.__write_plugin_index(subpackage, index)
+            return
+
+        self.log.debug('deferring plugin modules in %r...', plugins_dir)
+        for fullname in index['early']:
+            self.__import_plugin_module(str(fullname))
+        for (base_name, plugins) in index['plugins'].iteritems():
+            deferred = self.__deferred.setdefault(str(base_name), {})
+            for (name, fullnames) in plugins.iteritems():
+                deferred.setdefault(str(name), []).extend(
+                    str(fullname) for fullname in fullnames)
+
+    def __import_plugin_module(self, fullname, pyfile=None):
+        """
+        Import the plugin module ``fullname``.
+        """
+        if pyfile is None:
+            pyfile = fullname
+        self.log.debug('importing plugin module %r', pyfile)
+        try:
+            __import__(fullname)
+        except errors.SkipPluginModule, e:
+            self.log.debug(
+                'skipping plugin module %s: %s', fullname, e.reason
+            )
+        except StandardError, e:
+            if self.env.startup_traceback:
+                import traceback
+                self.log.error('could not load plugin module %r\n%s', pyfile, traceback.format_exc())
+            raise
+
+    def __get_registered(self):
+        registered = {}
+        for base_name in self.register:
+            magic = getattr(self.register, base_name)
+            for name in magic:
+                registered[(base_name, name)] = magic[name]
+        return registered
+
+    def __index_plugin_modules(self, modules):
+        """
+        Import all of the plugin ``modules`` and return which plugins each
+        of them registers.
+
+        The index maps base name -> plugin name -> list of the modules to
+        import to register the plugin. Its 'early' list has the modules
+        registering plugins which must be finalized early.
+        """
+        plugins = {}
+        early = []
+        for (fullname, pyfile) in modules:
+            before = self.__get_registered()
+            self.__import_plugin_module(fullname, pyfile)
+            for (key, klass) in self.__get_registered().iteritems():
+                if before.get(key) is klass:
+                    continue
+                (base_name, name) = key
+                plugins.setdefault(base_name, {}).setdefault(
+                    name, []).append(fullname)
+                if klass.finalize_early and fullname not in early:
+                    early.append(fullname)
+        return dict(plugins=plugins, early=early)
+
+    def __get_plugin_index_file(self):
+        dot_ipa = getattr(self.env, 'dot_ipa', None)
+        if dot_ipa is None:
+            return None
+        return path.join(dot_ipa, 'plugin-index')
+
+    def __get_plugin_index_signature(self, modules):
+        """
+        Return a string which changes when the plugin modules or the
+        environment they are loaded in change.
+        """
+        items = [VERSION]
+        for key in self.env:
+            if key not in self._plugin_index_ignore:
+                items.append('%s=%r' % (key, self.env[key]))
+        for (fullname, pyfile) in modules:
             try:
-                __import__(fullname)
-            except errors.SkipPluginModule, e:
-                self.log.debug(
-                    'skipping plugin module %s: %s', fullname, e.reason
-                )
-            except StandardError, e:
-                if self.env.startup_traceback:
-                    import traceback
-                    self.log.error('could not load plugin module %r\n%s', pyfile, traceback.format_exc())
-                raise
+                st = os.stat(pyfile)
+            except OSError:
+                continue
+            items.append('%s=%d:%d' % (pyfile, st.st_mtime, st.st_size))
+        return '\0'.join(items)
+
+    def __read_plugin_index(self):
+        filename = self.__get_plugin_index_file()
+        if filename is None:
+            return {}
+        try:
+            with open(filename) as f:
+                return json.load(f)
+        except (IOError, ValueError), e:
+            self.log.debug('cannot read plugin index %s: %s', filename, e)
+            return {}
+
+    def __write_plugin_index(self, subpackage, index):
+        filename = self.__get_plugin_index_file()
+        if filename is None:
+            return
+        indexes = self.__read_plugin_index()
+        indexes[subpackage] = index
+        try:
+            if not path.isdir(path.dirname(filename)):
+                os.makedirs(path.dirname(filename))
+            (fd, tmpname) = tempfile.mkstemp(dir=path.dirname(filename))
+            with os.fdopen(fd, 'w') as f:
+                json.dump(indexes, f)
+            os.rename(tmpname, filename)
+        except (IOError, OSError), e:
+            self.log.debug('cannot write plugin index %s: %s', filename, e)
+
+    def __get_plugin(self, base_name, name):
+        """
+        Return the instance of plugin ``name`` of the ``base_name`` base.
+
+        The plugin module is imported and the plugin is instantiated when
+        needed.
+        """
+        with self.__plugins_lock:
+            for fullname in self.__deferred.get(base_name, {}).get(name, ()):
+                if fullname not in sys.modules:
+                    self.__import_plugin_module(fullname)
+
+            klass = getattr(self.register, base_name)[name]
+            if klass in self.__plugins:
+                return self.__plugins[klass][1]
+
+            instance = klass()
+            self.__plugins[klass] = (len(self.__plugins) + 1, instance)
+            instance.set_api(self)
+            if not is_production_mode(self):
+                assert instance.api is self
+            return instance
 
     def finalize(self):
         """
-        Finalize the registration, instantiate the plugins.
+        Finalize the registration, create the plugin namespaces.
+
+        Unless ``env.plugins_on_demand`` is set, the plugins are instantiated
+        and finalized here. Otherwise only the plugins which must be
+        finalized early are, every other plugin module is imported and the
+        plugin instantiated when the plugin is first accessed in its
+        namespace.
 
         `API.bootstrap` will automatically be called if it hasn't been
         already.
@@ -704,56 +977,14 @@ class API(DictProxy):
         self.__doing('finalize')
         self.__do_if_not_done('load_plugins')
 
-        class PluginInstance(object):
-            """
-            Represents a plugin instance.
-            """
-
-            i = 0
-
-            def __init__(self, klass):
-                self.created = self.next()
-                self.klass = klass
-                self.instance = klass()
-                self.bases = []
-
-            @classmethod
-            def next(cls):
-                cls.i += 1
-                return cls.i
-
-        class PluginInfo(ReadOnly):
-            def __init__(self, p):
-                assert isinstance(p, PluginInstance)
-                self.created = p.created
-                self.name = p.klass.__name__
-                self.module = str(p.klass.__module__)
-                self.plugin = '%s.%s' % (self.module, self.name)
-                self.bases = tuple(b.__name__ for b in p.bases)
-                if not is_production_mode(self):
-                    lock(self)
-
-        plugins = {}
-        tofinalize = set()
-        def plugin_iter(base, subclasses):
-            for klass in subclasses:
-                assert issubclass(klass, base)
-                if klass not in plugins:
-                    plugins[klass] = PluginInstance(klass)
-                p = plugins[klass]
-                if not is_production_mode(self):
-                    assert base not in p.bases
-                p.bases.append(base)
-                if klass.finalize_early or not self.env.plugins_on_demand:
-                    tofinalize.add(p)
-                yield p.instance
-
         production_mode = is_production_mode(self)
         for name in self.register:
-            base = self.register[name]
-            magic = getattr(self.register, name)
-            namespace = NameSpace(
-                plugin_iter(base, (magic[k] for k in magic))
+            names = set(getattr(self.register, name))
+            names.update(self.__deferred.get(name, ()))
+            namespace = PluginNameSpace(
+                names,
+                lambda plugin_name, base_name=name:
+                    self.__get_plugin(base_name, plugin_name)
             )
             if not production_mode:
                 assert not (
@@ -762,19 +993,43 @@ class API(DictProxy):
             self.__d[name] = namespace
             object.__setattr__(self, name, namespace)
 
-        for p in plugins.itervalues():
-            p.instance.set_api(self)
-            if not production_mode:
-                assert p.instance.api is self
+        # All plugins are instantiated before any is finalized, finalizing
+        # a plugin may look up other plugins (e.g. an Object its Methods)
+        on_demand = self.env.plugins_on_demand
+        tofinalize = []
+        for name in self.register:
+            magic = getattr(self.register, name)
+            for plugin_name in magic:
+                if on_demand and not magic[plugin_name].finalize_early:
+                    continue
+                tofinalize.append(self.__d[name][plugin_name])
 
-        for p in tofinalize:
-            p.instance.ensure_finalized()
+        for instance in tofinalize:
+            instance.ensure_finalized()
             if not production_mode:
-                assert islocked(p.instance) is True
+                assert islocked(instance) is True
         object.__setattr__(self, '_API__finalized', True)
-        tuple(PluginInfo(p) for p in plugins.itervalues())
-        object.__setattr__(self, 'plugins',
-            tuple(PluginInfo(p) for p in plugins.itervalues())
+
+    @property
+    def plugins(self):
+        """
+        A `PluginInfo` for every plugin.
+
+        This instantiates all of the plugins.
+        """
+        if not self.isdone('finalize'):
+            raise AttributeError('plugins')
+        for name in self.register:
+            for plugin in self.__d[name]():
+                pass
+        bases = {}
+        for name in self.register:
+            magic = getattr(self.register, name)
+            for plugin_name in magic:
+                bases.setdefault(magic[plugin_name], []).append(name)
+        return tuple(
+            PluginInfo(created, instance, bases[klass])
+            for (klass, (created, instance)) in self.__plugins.iteritems()
         )
 
 
@@ -117,6 +117,8 @@ must include all existing attributes as well. When doing an aci-mod the
 targetattr REPLACES the current attributes, it does not add to them.
 
 """
+import collections
+import threading
 from copy import deepcopy
 
 from ipalib import api, crud, errors
@@ -384,20 +386,86 @@ def _aci_to_kw(ldap, a, test=False, pkey_only=False):
 
     return kw
 
-def _convert_strings_to_acis(acistrs):
-    acis = []
-    for a in acistrs:
-        try:
-            acis.append(ACI(a))
-        except SyntaxError, e:
-            root_logger.warning("Failed to parse: %s" % a)
-    return acis
+class ACIIndex(object):
+    """
+    The ACIs parsed from a list of ACI strings, indexed by name, name prefix,
+    target attribute and bind rule.
+
+    Indexes are shared by all requests, the ACIs must not be modified.
+    """
+
+    def __init__(self, acistrs, parsed=None):
+        """
+        :param acistrs: tuple of ACI strings
+        :param parsed: dict of already parsed ACIs by ACI string
+        """
+        if parsed is None:
+            parsed = {}
+        self.acistrs = acistrs
+        # parsed ACIs, in the order of acistrs
+        self.acis = []
+        self.by_string = {}
+        # lowercase ACI name -> list of ACIs
+        self.by_name = {}
+        # ACI name prefix -> list of ACIs
+        self.by_prefix = {}
+        # lowercase target attribute -> list of ACIs
+        self.by_targetattr = {}
+        # bind rule expression -> list of ACIs
+        self.by_bindrule = {}
+
+        for acistr in acistrs:
+            aci = parsed.get(acistr)
+            if aci is None:
+                try:
+                    aci = ACI(acistr)
+                except SyntaxError:
+                    root_logger.warning("Failed to parse: %s" % acistr)
+                    continue
+            self.acis.append(aci)
+            self.by_string[acistr] = aci
+            self.by_name.setdefault(aci.name.lower(), []).append(aci)
+            prefix = _parse_aci_name(aci.name)[0]
+            self.by_prefix.setdefault(prefix, []).append(aci)
+            if 'targetattr' in aci.target:
+                attrs = set(t.lower()
+                            for t in aci.target['targetattr']['expression'])
+                for attr in attrs:
+                    self.by_targetattr.setdefault(attr, []).append(aci)
+            expression = aci.bindrule.get('expression')
+            self.by_bindrule.setdefault(expression, []).append(aci)
+
+# Number of ACI lists whose index is kept by get_aci_index
+_ACI_INDEX_CACHE_SIZE = 8
+
+_aci_index_cache = collections.OrderedDict()
+_aci_index_cache_lock = threading.Lock()
+
+def get_aci_index(acistrs):
+    """
+    Return the `ACIIndex` of the ACI strings ``acistrs``.
 
-def _find_aci_by_name(acis, aciprefix, aciname):
+    Indexes are cached for the process by the list of ACI strings. The ACIs
+    which did not change are reused when a list is indexed.
+    """
+    key = tuple(acistrs)
+    with _aci_index_cache_lock:
+        index = _aci_index_cache.pop(key, None)
+        if index is None:
+            parsed = {}
+            for other in _aci_index_cache.itervalues():
+                parsed.update(other.by_string)
+            index = ACIIndex(key, parsed)
+        _aci_index_cache[key] = index
+        while len(_aci_index_cache) > _ACI_INDEX_CACHE_SIZE:
+            _aci_index_cache.popitem(last=False)
+    return index
+
+def _find_aci_by_name(index, aciprefix, aciname):
     name = _make_aci_name(aciprefix, aciname).lower()
-    for a in acis:
-        if a.name.lower() == name:
-            return a
+    acis = index.by_name.get(name)
+    if acis:
+        return acis[0]
     raise errors.NotFound(reason=_('ACI with name "%s" not found') % aciname)
 
 
@@ -539,7 +607,7 @@ class aci_add(crud.Create):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
+        acis = get_aci_index(entry.get('aci', [])).acis
         for a in acis:
             # FIXME: add check for permission_group = permission_group
             if a.isequal(newaci) or newaci.name == a.name:
@@ -584,13 +652,9 @@ class aci_del(crud.Delete):
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
         acistrs = entry.get('aci', [])
-        acis = _convert_strings_to_acis(acistrs)
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
-        for a in acistrs:
-            candidate = ACI(a)
-            if aci.isequal(candidate):
-                acistrs.remove(a)
-                break
+        index = get_aci_index(acistrs)
+        aci = _find_aci_by_name(index, aciprefix, aciname)
+        acistrs.remove(aci.orig_acistr)
 
         entry['aci'] = acistrs
 
@@ -626,8 +690,8 @@ class aci_mod(crud.Update):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, aciprefix, aciname)
+        index = get_aci_index(entry.get('aci', []))
+        aci = _find_aci_by_name(index, aciprefix, aciname)
 
         # The strategy here is to convert the ACI we're updating back into
         # a series of keywords. Then we replace any keywords that have been
@@ -702,44 +766,29 @@ class aci_find(crud.Search):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        results = []
+        index = get_aci_index(entry.get('aci', []))
+        results = index.acis
+
+        # Each option narrows down the results, either with an index or by
+        # checking every remaining ACI once
+        def select(acis):
+            wanted = set(acis)
+            return [a for a in results if a in wanted]
 
         if term:
             term = term.lower()
-            for a in acis:
-                if a.name.lower().find(term) != -1 and a not in results:
-                    results.append(a)
-            acis = list(results)
-        else:
-            results = list(acis)
+            results = [a for a in results if term in a.name.lower()]
 
         if kw.get('aciname'):
-            for a in acis:
-                prefix, name = _parse_aci_name(a.name)
-                if name != kw['aciname']:
-                    results.remove(a)
-            acis = list(results)
+            results = [a for a in results
+                       if _parse_aci_name(a.name)[1] == kw['aciname']]
 
         if kw.get('aciprefix'):
-            for a in acis:
-                prefix, name = _parse_aci_name(a.name)
-                if prefix != kw['aciprefix']:
-                    results.remove(a)
-            acis = list(results)
+            results = select(index.by_prefix.get(kw['aciprefix'], ()))
 
         if kw.get('attrs'):
-            for a in acis:
-                if not 'targetattr' in a.target:
-                    results.remove(a)
-                    continue
-                alist1 = sorted(
-                    [t.lower() for t in a.target['targetattr']['expression']]
-                )
-                alist2 = sorted([t.lower() for t in kw['attrs']])
-                if len(set(alist1) & set(alist2)) != len(alist2):
-                    results.remove(a)
-            acis = list(results)
+            for attr in set(t.lower() for t in kw['attrs']):
+                results = select(index.by_targetattr.get(attr, ()))
 
         if kw.get('permission'):
             try:
@@ -749,19 +798,13 @@ class aci_find(crud.Search):
             except errors.NotFound:
                 pass
             else:
-                for a in acis:
-                    uri = 'ldap:///%s' % entry.dn
-                    if a.bindrule['expression'] != uri:
-                        results.remove(a)
-                acis = list(results)
+                uri = 'ldap:///%s' % entry.dn
+                results = select(index.by_bindrule.get(uri, ()))
 
         if kw.get('permissions'):
-            for a in acis:
-                alist1 = sorted(a.permissions)
-                alist2 = sorted(kw['permissions'])
-                if len(set(alist1) & set(alist2)) != len(alist2):
-                    results.remove(a)
-            acis = list(results)
+            permissions = set(kw['permissions'])
+            results = [a for a in results
+                       if permissions.issubset(a.permissions)]
 
         if kw.get('memberof'):
             try:
@@ -770,95 +813,59 @@ class aci_find(crud.Search):
                 pass
             else:
                 memberof_filter = '(memberOf=%s)' % dn
-                for a in acis:
-                    if 'targetfilter' in a.target:
-                        targetfilter = a.target['targetfilter']['expression']
-                        if targetfilter != memberof_filter:
-                            results.remove(a)
-                    else:
-                        results.remove(a)
+                results = [a for a in results
+                           if 'targetfilter' in a.target and
+                           a.target['targetfilter']['expression'] ==
+                           memberof_filter]
 
         if kw.get('type'):
-            for a in acis:
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                else:
-                    results.remove(a)
-                    continue
-                found = False
-                for k in _type_map.keys():
-                    if _type_map[k] == target and kw['type'] == k:
-                        found = True
-                        break;
-                if not found:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            target = _type_map.get(kw['type'])
+            results = [a for a in results
+                       if 'target' in a.target and
+                       a.target['target']['expression'] == target]
 
         if kw.get('selfaci', False) is True:
-            for a in acis:
-                if a.bindrule['expression'] != u'ldap:///self':
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            results = select(index.by_bindrule.get(u'ldap:///self', ()))
 
         if kw.get('group'):
-            for a in acis:
+            def bindrule_group(a):
                 groupdn = a.bindrule['expression']
                 groupdn = DN(groupdn.replace('ldap:///',''))
                 try:
-                    cn = groupdn[0]['cn']
+                    return groupdn[0]['cn']
                 except (IndexError, KeyError):
-                    cn = None
-                if cn is None or cn != kw['group']:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+                    return None
+            results = [a for a in results
+                       if bindrule_group(a) == kw['group']]
 
         if kw.get('targetgroup'):
-            for a in acis:
-                found = False
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                    targetdn = DN(target.replace('ldap:///',''))
-                    group_container_dn = DN(api.env.container_group, api.env.basedn)
-                    if targetdn.endswith(group_container_dn):
-                        try:
-                            cn = targetdn[0]['cn']
-                        except (IndexError, KeyError):
-                            cn = None
-                        if cn == kw['targetgroup']:
-                            found = True
-                if not found:
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            group_container_dn = DN(api.env.container_group, api.env.basedn)
+            def target_group(a):
+                if 'target' not in a.target:
+                    return None
+                target = a.target['target']['expression']
+                targetdn = DN(target.replace('ldap:///',''))
+                if not targetdn.endswith(group_container_dn):
+                    return None
+                try:
+                    return targetdn[0]['cn']
+                except (IndexError, KeyError):
+                    return None
+            results = [a for a in results
+                       if target_group(a) == kw['targetgroup']]
 
         if kw.get('filter'):
             if not kw['filter'].startswith('('):
                 kw['filter'] = unicode('('+kw['filter']+')')
-            for a in acis:
-                if 'targetfilter' not in a.target or\
-                    not a.target['targetfilter']['expression'] or\
-                    a.target['targetfilter']['expression'] != kw['filter']:
-                    results.remove(a)
+            results = [a for a in results
+                       if 'targetfilter' in a.target and
+                       a.target['targetfilter']['expression'] == kw['filter']]
 
         if kw.get('subtree'):
-            for a in acis:
-                if 'target' in a.target:
-                    target = a.target['target']['expression']
-                else:
-                    results.remove(a)
-                    continue
-                if kw['subtree'].lower() != target.lower():
-                    try:
-                        results.remove(a)
-                    except ValueError:
-                        pass
+            subtree = kw['subtree'].lower()
+            results = [a for a in results
+                       if 'target' in a.target and
+                       a.target['target']['expression'].lower() == subtree]
 
         acis = []
         for result in results:
@@ -910,9 +917,9 @@ class aci_show(crud.Retrieve):
         dn = kw.get('location', self.api.env.basedn)
         entry = ldap.get_entry(dn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
+        index = get_aci_index(entry.get('aci', []))
 
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        aci = _find_aci_by_name(index, kw['aciprefix'], aciname)
         if kw.get('raw', False):
             result = dict(aci=unicode(aci))
         else:
@@ -949,10 +956,10 @@ class aci_rename(crud.Update):
 
         entry = ldap.get_entry(self.api.env.basedn, ['aci'])
 
-        acis = _convert_strings_to_acis(entry.get('aci', []))
-        aci = _find_aci_by_name(acis, kw['aciprefix'], aciname)
+        index = get_aci_index(entry.get('aci', []))
+        aci = _find_aci_by_name(index, kw['aciprefix'], aciname)
 
-        for a in acis:
+        for a in index.acis:
             prefix, name = _parse_aci_name(a.name)
             if _make_aci_name(prefix, kw['newname']) == a.name:
                 raise errors.DuplicateEntry()
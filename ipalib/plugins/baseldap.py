@@ -576,6 +576,18 @@ class LDAPObject(Object):
             except errors.NotFound:
                 entry_attrs[attr] = False
 
+    def get_entries_password_attributes(self, ldap, entries):
+        """
+        Same as get_password_attributes, but for all of ``entries`` at
+        once, with a search per password type instead of per entry.
+        """
+        dns = [entry_attrs.dn for entry_attrs in entries]
+        for (pwattr, attr) in self.password_attributes:
+            found = set(e.dn for e in ldap.find_entries_by_dn(
+                dns, '(%s=*)' % pwattr, [pwattr]))
+            for entry_attrs in entries:
+                entry_attrs[attr] = entry_attrs.dn in found
+
     def handle_not_found(self, *keys):
         pkey = ''
         if self.primary_key:
@@ -1178,6 +1190,8 @@ class LDAPRetrieve(LDAPQuery):
     """
     Retrieve an LDAP entry.
     """
+    read_only = True
+
     has_output = output.standard_entry
     has_output_params = global_output_params
 
@@ -1821,9 +1835,11 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
 
     has_output_params = global_output_params
 
-    def execute(self, *args, **options):
-        ldap = self.obj.backend
-
+    def _get_search_params(self, ldap, *args, **options):
+        """
+        Build the search filter, attribute list, base DN and scope and run
+        the pre callbacks on them.
+        """
         term = args[-1]
         if self.obj.parent_object:
             base_dn = self.api.Object[self.obj.parent_object].get_dn(*args[:-1])
@@ -1881,15 +1897,13 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
                 self, ldap, filter, attrs_list, base_dn, scope, *args, **options)
             assert isinstance(base_dn, DN)
 
-        try:
-            (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
-                filter, attrs_list, base_dn, scope,
-                time_limit=options.get('timelimit', None),
-                size_limit=options.get('sizelimit', None)
-            )
-        except errors.NotFound:
-            (entries, truncated) = ([], False)
+        return (filter, attrs_list, base_dn, scope)
 
+    def _process_entries(self, ldap, entries, truncated, *args, **options):
+        """
+        Run the post callbacks on the found entries, sort them and convert
+        them to dicts.
+        """
         for callback in self.get_callbacks('post'):
             truncated = callback(self, ldap, entries, truncated, *args, **options)
 
@@ -1907,12 +1921,62 @@ class LDAPSearch(BaseLDAPCommand, crud.Search):
             entries[i] = entry_to_dict(e, **options)
             entries[i]['dn'] = e.dn
 
+        return (entries, truncated)
+
+    def execute(self, *args, **options):
+        ldap = self.obj.backend
+
+        (filter, attrs_list, base_dn, scope) = self._get_search_params(
+            ldap, *args, **options)
+
+        try:
+            (entries, truncated) = self._exc_wrapper(args, options, ldap.find_entries)(
+                filter, attrs_list, base_dn, scope,
+                time_limit=options.get('timelimit', None),
+                size_limit=options.get('sizelimit', None)
+            )
+        except errors.NotFound:
+            (entries, truncated) = ([], False)
+
+        (entries, truncated) = self._process_entries(
+            ldap, entries, truncated, *args, **options)
+
         return dict(
             result=entries,
             count=len(entries),
             truncated=truncated,
         )
 
+    def execute_paged(self, *args, **options):
+        """
+        Search page by page, running the post callbacks on every page.
+
+        Entries are sorted within each page only. Subclasses which override
+        execute get their whole result as a single page.
+        """
+        if type(self).execute.im_func is not LDAPSearch.execute.im_func:
+            for page in super(LDAPSearch, self).execute_paged(
+                    *args, **options):
+                yield page
+            return
+
+        ldap = self.obj.backend
+
+        (filter, attrs_list, base_dn, scope) = self._get_search_params(
+            ldap, *args, **options)
+
+        pages = ldap.find_entries_paged(
+            filter, attrs_list, base_dn, scope,
+            time_limit=options.get('timelimit', None),
+            size_limit=options.get('sizelimit', None)
+        )
+        try:
+            for (entries, truncated) in pages:
+                yield self._process_entries(
+                    ldap, entries, truncated, *args, **options)
+        finally:
+            pages.close()
+
     def pre_callback(self, ldap, filters, attrs_list, base_dn, scope, *args, **options):
         assert isinstance(base_dn, DN)
         return (filters, base_dn, scope)
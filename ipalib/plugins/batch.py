@@ -43,15 +43,32 @@ The format of the response is nested the same way.  At the top you will see
 
 And then a nested response for each IPA command method sent in the request
 
+With the parallel option set, consecutive read-only methods (commands with
+read_only set, such as the show and find commands) are run concurrently by
+up to batch_max_workers threads, each with its own LDAP connection. Other
+methods still run one by one, in order, unless they are marked as safe to
+run concurrently:
+
+{"method":"batch","params":[[
+        {"method":"user_show","params":[["admin"],{}]},
+        {"method":"user_show","params":[["tuser"],{}]},
+        {"method":"ping","params":[[],{}],"parallel":true}
+        ],{"parallel":true}],"id":1}
+
+The results are always returned in the order of the methods.
+
 """
 
+import threading
+import Queue
+
 from ipalib import api, errors
 from ipalib import Command
-from ipalib.parameters import Str, Any
+from ipalib.parameters import Str, Any, Flag
 from ipalib.output import Output
 from ipalib import output
 from ipalib.text import _
-from ipalib.request import context
+from ipalib.request import context, Connection, destroy_context
 from ipapython.version import API_VERSION
 
 class batch(Command):
@@ -74,54 +91,147 @@ class batch(Command):
         ),
     )
 
+    takes_options = (
+        Flag('parallel?',
+            doc=_('Run independent read-only methods concurrently'),
+            flags=['no_output'],
+        ),
+    )
+
     has_output = (
         Output('count', int, doc=''),
         Output('results', (list, tuple), doc='')
     )
 
     def execute(self, *args, **options):
-        results = []
-        for arg in args[0]:
-            params = dict()
-            name = None
-            try:
-                if 'method' not in arg:
-                    raise errors.RequirementError(name='method')
-                if 'params' not in arg:
-                    raise errors.RequirementError(name='params')
-                name = arg['method']
-                if name not in self.Command:
-                    raise errors.CommandError(name=name)
-                a, kw = arg['params']
-                newkw = dict((str(k), v) for k, v in kw.iteritems())
-                params = api.Command[name].args_options_2_params(*a, **newkw)
-                newkw.setdefault('version', options['version'])
-
-                result = api.Command[name](*a, **newkw)
+        version = options['version']
+        if options.get('parallel') and self.api.env.batch_max_workers > 1:
+            results = self._execute_parallel(args[0], version)
+        else:
+            results = [self._execute_method(arg, version) for arg in args[0]]
+        return dict(count=len(results) , results=results)
+
+    def _execute_method(self, arg, version):
+        params = dict()
+        name = None
+        try:
+            if 'method' not in arg:
+                raise errors.RequirementError(name='method')
+            if 'params' not in arg:
+                raise errors.RequirementError(name='params')
+            name = arg['method']
+            if name not in self.Command:
+                raise errors.CommandError(name=name)
+            a, kw = arg['params']
+            newkw = dict((str(k), v) for k, v in kw.iteritems())
+            params = api.Command[name].args_options_2_params(*a, **newkw)
+            newkw.setdefault('version', version)
+
+            result = api.Command[name](*a, **newkw)
+            self.info(
+                '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+            )
+            result['error']=None
+        except Exception, e:
+            if isinstance(e, errors.RequirementError) or \
+                isinstance(e, errors.CommandError):
                 self.info(
-                    '%s: batch: %s(%s): SUCCESS', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params))
+                    '%s: batch: %s', context.principal, e.__class__.__name__
                 )
-                result['error']=None
-            except Exception, e:
-                if isinstance(e, errors.RequirementError) or \
-                    isinstance(e, errors.CommandError):
-                    self.info(
-                        '%s: batch: %s', context.principal, e.__class__.__name__
-                    )
-                else:
-                    self.info(
-                        '%s: batch: %s(%s): %s', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params)),  e.__class__.__name__
-                    )
-                if isinstance(e, errors.PublicError):
-                    reported_error = e
-                else:
-                    reported_error = errors.InternalError()
-                result = dict(
-                    error=reported_error.strerror,
-                    error_code=reported_error.errno,
-                    error_name=unicode(type(reported_error).__name__),
+            else:
+                self.info(
+                    '%s: batch: %s(%s): %s', context.principal, name, ', '.join(api.Command[name]._repr_iter(**params)),  e.__class__.__name__
                 )
-            results.append(result)
-        return dict(count=len(results) , results=results)
+            result = self._error_result(e)
+        return result
+
+    def _error_result(self, e):
+        if isinstance(e, errors.PublicError):
+            reported_error = e
+        else:
+            reported_error = errors.InternalError()
+        return dict(
+            error=reported_error.strerror,
+            error_code=reported_error.errno,
+            error_name=unicode(type(reported_error).__name__),
+        )
+
+    def _is_parallel(self, arg):
+        """
+        Return True if the method can run concurrently with its neighbours.
+        """
+        try:
+            name = arg['method']
+            if name not in self.Command:
+                return False
+        except (TypeError, KeyError):
+            return False
+        if arg.get('parallel'):
+            return True
+        return self.Command[name].read_only
+
+    def _execute_parallel(self, methods, version):
+        """
+        Run the methods, executing each run of consecutive parallel methods
+        concurrently. The other methods are executed in this thread and
+        separate the runs, so that they see the effects of the methods
+        before them.
+        """
+        results = [None] * len(methods)
+        group = []
+        for (i, arg) in enumerate(methods):
+            if self._is_parallel(arg):
+                group.append(i)
+                continue
+            self._execute_group(methods, group, results, version)
+            group = []
+            results[i] = self._execute_method(arg, version)
+        self._execute_group(methods, group, results, version)
+        return results
+
+    def _execute_group(self, methods, group, results, version):
+        if len(group) < 2:
+            for i in group:
+                results[i] = self._execute_method(methods[i], version)
+            return
+
+        # Workers get their own request context with their own connection,
+        # the other per-request values are shared with this thread
+        ccache = getattr(context, 'ccache_name', None)
+        shared = dict((k, v) for (k, v) in context.__dict__.iteritems()
+                      if not isinstance(v, Connection))
+
+        queue = Queue.Queue()
+        for i in group:
+            queue.put(i)
+
+        def worker():
+            error = None
+            try:
+                context.__dict__.update(shared)
+                self.Backend.ldap2.connect(ccache=ccache)
+            except Exception, e:
+                self.exception('batch: cannot connect worker: %s', e)
+                error = e
+            try:
+                while True:
+                    try:
+                        i = queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if error is not None:
+                        results[i] = self._error_result(error)
+                    else:
+                        results[i] = self._execute_method(methods[i], version)
+            finally:
+                destroy_context()
+
+        workers = []
+        for n in xrange(min(self.api.env.batch_max_workers, len(group))):
+            thread = threading.Thread(target=worker)
+            thread.start()
+            workers.append(thread)
+        for thread in workers:
+            thread.join()
 
 api.register(batch)
@@ -17,8 +17,11 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+
 from ipalib import api, errors, output, util
 from ipalib import Command, Str, Flag, Int, DeprecatedParam
+from ipalib.request import context
 from types import NoneType
 from ipalib.cli import to_cli
 from ipalib import _, ngettext
@@ -135,6 +138,19 @@ EXAMPLES:
       Not matched rules: new-rule
       Matched rules: allow_all
 
+ Many accesses can be tested against the same rules at once with
+ hbactest-bulk. It accepts the same rule options as hbactest.
+
+    8. Test several users, hosts and services with all enabled HBAC rules:
+    $ ipa hbactest-bulk --access=a1a,bar,sshd --access=a1a,baz,ftp \\
+          --access=b2b,bar,sshd --nodetail
+    a1a,bar,sshd: Access granted: True
+    a1a,baz,ftp: Access granted: False
+    b2b,bar,sshd: Access granted: True
+    -----------------------
+    2 of 3 accesses granted
+    -----------------------
+
 
 HBACTEST AND TRUSTED DOMAINS
 
@@ -237,6 +253,53 @@ def convert_to_ipa_rule(rule):
     return ipa_rule
 
 
+def _compile_rule(rule):
+    """
+    Convert a dict with a rule to (name, enabled, pyhbac rule).
+
+    The pyhbac rule is always enabled so that it can be shared by requests
+    testing enabled and disabled rules, enabled is the state of the rule.
+    """
+    ipa_rule = convert_to_ipa_rule(rule)
+    enabled = ipa_rule.enabled
+    ipa_rule.enabled = True
+    return (ipa_rule.name, enabled, ipa_rule)
+
+
+class _HBACCache(object):
+    """
+    Compiled HBAC rules and the groups of services and hosts, shared by
+    the hbactest commands run by a server process.
+
+    Everything is dropped as soon as this process writes an entry below
+    one of bases, and after hbac_cache_ttl seconds so that changes made
+    by other processes and replicas are picked up. Entries are keyed by
+    the principal of the request, as not everybody can read everything.
+    """
+
+    def __init__(self):
+        self.bases = None
+        self.invalidate()
+
+    def invalidate(self):
+        self.timestamp = time.time()
+        self.rules = {}
+        self.svcgroups = {}
+        self.hostgroups = {}
+
+    def expire(self, ttl):
+        if time.time() - self.timestamp > ttl:
+            self.invalidate()
+
+    def entry_written(self, dn):
+        for base in self.bases:
+            if dn.endswith(base):
+                self.invalidate()
+                break
+
+_hbac_cache = _HBACCache()
+
+
 class hbactest(Command):
     __doc__ = _('Simulate use of Host-based access controls')
 
@@ -298,11 +361,156 @@ class hbactest(Command):
             return u'%s.%s' % (host, self.env.domain)
         return host
 
-    def execute(self, *args, **options):
-        # First receive all needed information:
-        # 1. HBAC rules (whether enabled or disabled)
-        # 2. Required options are (user, target host, service)
-        # 3. Options: rules to test (--rules, --enabled, --disabled), request for detail output
+    def _get_cache(self):
+        """
+        Return the `_HBACCache` shared by the requests of this process, or
+        a new one used only by this command if it must not be shared.
+        """
+        ttl = getattr(self.env, 'hbac_cache_ttl', 0)
+        if (not ttl or not self.env.in_server or
+                self.env.context in ('installer', 'updates')):
+            return _HBACCache()
+
+        cache = _hbac_cache
+        if cache.bases is None:
+            cache.bases = (
+                DN(self.env.container_hbac, self.env.basedn),
+                DN(self.env.container_hostgroup, self.env.basedn),
+                DN(self.env.container_host, self.env.basedn),
+            )
+            self.api.Backend.ldap2.register_write_callback(
+                cache.entry_written)
+        cache.expire(ttl)
+        return cache
+
+    def _get_rules(self, cache, testrules, sizelimit):
+        """
+        Return (name, enabled, rule) for the HBAC rules to choose from:
+        all rules if testrules is empty, the rules in testrules otherwise.
+        """
+        # Not everybody can read every rule, group and member. Keep the
+        # dictionary, an invalidation while we search must not be undone.
+        principal = getattr(context, 'principal', None)
+        compiled = cache.rules
+        if not testrules:
+            key = (principal, None, sizelimit)
+            rules = compiled.get(key)
+            if rules is None:
+                rules = [_compile_rule(rule) for rule in
+                         self.api.Command.hbacrule_find(
+                             sizelimit=sizelimit)['result']]
+                compiled[key] = rules
+            return rules
+
+        rules = []
+        for name in testrules:
+            key = (principal, name, None)
+            rule = compiled.get(key)
+            if rule is None:
+                try:
+                    rule = _compile_rule(
+                        self.api.Command.hbacrule_show(name)['result'])
+                except:
+                    continue
+                compiled[key] = rule
+            rules.append(rule)
+        return rules
+
+    def _get_user_groups(self, user):
+        """
+        Return the name and groups of user as used in HBAC requests.
+        """
+        # check first if this is not a trusted domain user
+        if _dcerpc_bindings_installed:
+            is_valid_sid = ipaserver.dcerpc.is_sid_valid(user)
+        else:
+            is_valid_sid = False
+        components = util.normalize_name(user)
+        if is_valid_sid or 'domain' in components or 'flatname' in components:
+            # this is a trusted domain user
+            if not _dcerpc_bindings_installed:
+                raise errors.NotFound(reason=_(
+                    'Cannot perform external member validation without '
+                    'Samba 4 support installed. Make sure you have installed '
+                    'server-trust-ad sub-package of IPA on the server'))
+            domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
+            if not domain_validator.is_configured():
+                raise errors.NotFound(reason=_(
+                    'Cannot search in trusted domains without own domain configured. '
+                    'Make sure you have run ipa-adtrust-install on the IPA server first'))
+            user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(user)
+
+            # Now search for all external groups that have this user or
+            # any of its groups in its external members. Found entires
+            # memberOf links will be then used to gather all groups where
+            # this group is assigned, including the nested ones
+            filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
+                    % ")(ipaExternalMember=".join(group_sids + [user_sid])
+
+            ldap = self.api.Backend.ldap2
+            group_container = DN(api.env.container_group, api.env.basedn)
+            try:
+                entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
+            except errors.NotFound:
+                return (user_sid, [])
+            groups = []
+            for entry in entries:
+                memberof_dns = entry.get('memberof', [])
+                for memberof_dn in memberof_dns:
+                    if memberof_dn.endswith(group_container):
+                        groups.append(memberof_dn[0][0].value)
+            return (user_sid, sorted(set(groups)))
+
+        # try searching for a local user
+        try:
+            search_result = self.api.Command.user_show(user)['result']
+            groups = search_result['memberof_group']
+            if 'memberofindirect_group' in search_result:
+                groups += search_result['memberofindirect_group']
+            return (user, sorted(set(groups)))
+        except:
+            return (user, None)
+
+    def _get_service_groups(self, cache, service):
+        principal = getattr(context, 'principal', None)
+        key = (principal, service)
+        svcgroups = cache.svcgroups
+        groups = svcgroups.get(key)
+        if groups is None:
+            groups = ()
+            try:
+                service_result = self.api.Command.hbacsvc_show(service)['result']
+                if 'memberof_hbacsvcgroup' in service_result:
+                    groups = service_result['memberof_hbacsvcgroup']
+            except:
+                pass
+            svcgroups[key] = groups
+        return groups
+
+    def _get_host_groups(self, cache, host):
+        principal = getattr(context, 'principal', None)
+        key = (principal, host)
+        hostgroups = cache.hostgroups
+        groups = hostgroups.get(key)
+        if groups is None:
+            groups = ()
+            try:
+                tgthost_result = self.api.Command.host_show(host)['result']
+                groups = tgthost_result['memberof_hostgroup']
+                if 'memberofindirect_hostgroup' in tgthost_result:
+                    groups += tgthost_result['memberofindirect_hostgroup']
+                groups = sorted(set(groups))
+            except:
+                pass
+            hostgroups[key] = groups
+        return groups
+
+    def _select_rules(self, cache, **options):
+        """
+        Return the pyhbac rules selected by the rules, enabled, disabled
+        and sizelimit options and the names in --rules which were not
+        found.
+        """
         rules = []
 
         # Use all enabled IPA rules by default
@@ -330,126 +538,67 @@ class hbactest(Command):
         if options['enabled']:
             all_enabled = True
 
-        hbacset = []
-        if len(testrules) == 0:
-            hbacset = self.api.Command.hbacrule_find(sizelimit=sizelimit)['result']
-        else:
-            for rule in testrules:
-                try:
-                    hbacset.append(self.api.Command.hbacrule_show(rule)['result'])
-                except:
-                    pass
-
         # We have some rules, import them
         # --enabled will import all enabled rules (default)
         # --disabled will import all disabled rules
         # --rules will implicitly add the rules from a rule list
-        for rule in hbacset:
-            ipa_rule = convert_to_ipa_rule(rule)
-            if ipa_rule.name in testrules:
-                ipa_rule.enabled = True
+        # Compiled rules are always enabled, enabled is the state in IPA
+        for (name, enabled, ipa_rule) in self._get_rules(
+                cache, testrules, sizelimit):
+            if name in testrules:
                 rules.append(ipa_rule)
-                testrules.remove(ipa_rule.name)
-            elif all_enabled and ipa_rule.enabled:
+                testrules.remove(name)
+            elif all_enabled and enabled:
                 # Option --enabled forces to include all enabled IPA rules into test
                 rules.append(ipa_rule)
-            elif all_disabled and not ipa_rule.enabled:
+            elif all_disabled and not enabled:
                 # Option --disabled forces to include all disabled IPA rules into test
-                ipa_rule.enabled = True
                 rules.append(ipa_rule)
 
-        # Check if there are unresolved rules left
-        if len(testrules) > 0:
-            # Error, unresolved rules are left in --rules
-            return {'summary' : unicode(_(u'Unresolved rules in --rules')),
-                    'error': testrules, 'matched': None, 'notmatched': None,
-                    'warning' : None, 'value' : False}
+        return (rules, testrules)
 
-        # Rules are converted to pyhbac format, build request and then test it
+    def _build_request(self, cache, users, user, targethost, service):
+        """
+        Build the pyhbac request for user accessing service on targethost.
+
+        users maps user names to the results of _get_user_groups, for the
+        rest of the command only.
+        """
         request = pyhbac.HbacRequest()
 
-        if options['user'] != u'all':
-            # check first if this is not a trusted domain user
-            if _dcerpc_bindings_installed:
-                is_valid_sid = ipaserver.dcerpc.is_sid_valid(options['user'])
-            else:
-                is_valid_sid = False
-            components = util.normalize_name(options['user'])
-            if is_valid_sid or 'domain' in components or 'flatname' in components:
-                # this is a trusted domain user
-                if not _dcerpc_bindings_installed:
-                    raise errors.NotFound(reason=_(
-                        'Cannot perform external member validation without '
-                        'Samba 4 support installed. Make sure you have installed '
-                        'server-trust-ad sub-package of IPA on the server'))
-                domain_validator = ipaserver.dcerpc.DomainValidator(self.api)
-                if not domain_validator.is_configured():
-                    raise errors.NotFound(reason=_(
-                        'Cannot search in trusted domains without own domain configured. '
-                        'Make sure you have run ipa-adtrust-install on the IPA server first'))
-                user_sid, group_sids = domain_validator.get_trusted_domain_user_and_groups(options['user'])
-                request.user.name = user_sid
-
-                # Now search for all external groups that have this user or
-                # any of its groups in its external members. Found entires
-                # memberOf links will be then used to gather all groups where
-                # this group is assigned, including the nested ones
-                filter_sids = "(&(objectclass=ipaexternalgroup)(|(ipaExternalMember=%s)))" \
-                        % ")(ipaExternalMember=".join(group_sids + [user_sid])
-
-                ldap = self.api.Backend.ldap2
-                group_container = DN(api.env.container_group, api.env.basedn)
-                try:
-                    entries, truncated = ldap.find_entries(filter_sids, ['memberof'], group_container)
-                except errors.NotFound:
-                    request.user.groups = []
-                else:
-                    groups = []
-                    for entry in entries:
-                        memberof_dns = entry.get('memberof', [])
-                        for memberof_dn in memberof_dns:
-                            if memberof_dn.endswith(group_container):
-                                groups.append(memberof_dn[0][0].value)
-                    request.user.groups = sorted(set(groups))
-            else:
-                # try searching for a local user
-                try:
-                    request.user.name = options['user']
-                    search_result = self.api.Command.user_show(request.user.name)['result']
-                    groups = search_result['memberof_group']
-                    if 'memberofindirect_group' in search_result:
-                        groups += search_result['memberofindirect_group']
-                    request.user.groups = sorted(set(groups))
-                except:
-                    pass
+        if user != u'all':
+            if user not in users:
+                users[user] = self._get_user_groups(user)
+            (request.user.name, groups) = users[user]
+            if groups is not None:
+                request.user.groups = list(groups)
 
-        if options['service'] != u'all':
-            try:
-                request.service.name = options['service']
-                service_result = self.api.Command.hbacsvc_show(request.service.name)['result']
-                if 'memberof_hbacsvcgroup' in service_result:
-                    request.service.groups = service_result['memberof_hbacsvcgroup']
-            except:
-                pass
+        if service != u'all':
+            request.service.name = service
+            groups = self._get_service_groups(cache, service)
+            if groups:
+                request.service.groups = list(groups)
 
-        if options['targethost'] != u'all':
-            try:
-                request.targethost.name = self.canonicalize(options['targethost'])
-                tgthost_result = self.api.Command.host_show(request.targethost.name)['result']
-                groups = tgthost_result['memberof_hostgroup']
-                if 'memberofindirect_hostgroup' in tgthost_result:
-                    groups += tgthost_result['memberofindirect_hostgroup']
-                request.targethost.groups = sorted(set(groups))
-            except:
-                pass
+        if targethost != u'all':
+            request.targethost.name = self.canonicalize(targethost)
+            groups = self._get_host_groups(cache, request.targethost.name)
+            if groups:
+                request.targethost.groups = list(groups)
+
+        return request
+
+    def _evaluate(self, request, rules, nodetail):
+        """
+        Evaluate request against rules.
 
+        Returns (access_granted, matched, notmatched, error) where the
+        last three are lists of rule names, always empty with nodetail.
+        """
         matched_rules = []
         notmatched_rules = []
         error_rules = []
-        warning_rules = []
 
-        result = {'warning':None, 'matched':None, 'notmatched':None, 'error':None}
-        if not options['nodetail']:
+        if not nodetail:
             # Validate runs rules one-by-one and reports failed ones
             for ipa_rule in rules:
                 try:
@@ -471,6 +620,33 @@ class hbactest(Command):
             res = request.evaluate(rules)
             access_granted = (res == pyhbac.HBAC_EVAL_ALLOW)
 
+        return (access_granted, matched_rules, notmatched_rules, error_rules)
+
+    def execute(self, *args, **options):
+        # First receive all needed information:
+        # 1. HBAC rules (whether enabled or disabled)
+        # 2. Required options are (user, target host, service)
+        # 3. Options: rules to test (--rules, --enabled, --disabled), request for detail output
+        cache = self._get_cache()
+        (rules, testrules) = self._select_rules(cache, **options)
+
+        # Check if there are unresolved rules left
+        if len(testrules) > 0:
+            # Error, unresolved rules are left in --rules
+            return {'summary' : unicode(_(u'Unresolved rules in --rules')),
+                    'error': testrules, 'matched': None, 'notmatched': None,
+                    'warning' : None, 'value' : False}
+
+        # Rules are converted to pyhbac format, build request and then test it
+        request = self._build_request(cache, {}, options['user'],
+                                      options['targethost'],
+                                      options['service'])
+
+        (access_granted, matched_rules, notmatched_rules, error_rules) = \
+            self._evaluate(request, rules, options['nodetail'])
+        warning_rules = []
+
+        result = {'warning':None, 'matched':None, 'notmatched':None, 'error':None}
         result['summary'] = _('Access granted: %s') % (access_granted)
 
 
@@ -511,3 +687,86 @@ class hbactest(Command):
         return int(not output['value'])
 
 api.register(hbactest)
+
+
+class hbactest_bulk(hbactest):
+    __doc__ = _('Simulate use of Host-based access controls for many accesses')
+
+    has_output = (
+        output.summary,
+        output.Output('error', (list, tuple, NoneType), _('Non-existent or invalid rules')),
+        output.Output('result', (list, tuple), _('Results of simulation')),
+        output.Output('value',  bool, _('All accesses granted'), ['no_display']),
+    )
+
+    takes_options = (
+        Str('access+',
+            cli_name='access',
+            label=_('Access'),
+            doc=_('User, target host and service separated by commas'),
+            pattern='^[^,]+,[^,]+,[^,]+$',
+            pattern_errmsg='must be of the form USER,HOST,SERVICE',
+        ),
+    ) + tuple(option for option in hbactest.takes_options
+              if option.name in ('rules', 'nodetail', 'enabled', 'disabled',
+                                 'sizelimit'))
+
+    def execute(self, *args, **options):
+        cache = self._get_cache()
+        (rules, testrules) = self._select_rules(cache, **options)
+
+        # Check if there are unresolved rules left
+        if len(testrules) > 0:
+            return dict(summary=unicode(_(u'Unresolved rules in --rules')),
+                        error=testrules, result=(), value=False)
+
+        # Users, services and hosts are looked up once for all accesses
+        users = {}
+        result = []
+        for access in options['access']:
+            (user, targethost, service) = [s.strip() for s in access.split(',')]
+            request = self._build_request(cache, users, user, targethost,
+                                          service)
+            (access_granted, matched_rules, notmatched_rules, error_rules) = \
+                self._evaluate(request, rules, options['nodetail'])
+            result.append(dict(
+                user=user,
+                targethost=targethost,
+                service=service,
+                value=access_granted,
+                matched=matched_rules,
+                notmatched=notmatched_rules,
+                error=error_rules,
+            ))
+
+        granted = len([r for r in result if r['value']])
+        return dict(
+            summary=unicode(_('%(granted)d of %(count)d accesses granted') %
+                            dict(granted=granted, count=len(result))),
+            error=None,
+            result=result,
+            value=granted == len(result),
+        )
+
+    def output_for_cli(self, textui, output, *args, **options):
+        if output['error']:
+            textui.print_summary(output['summary'])
+            textui.print_attribute(unicode(self.output['error'].doc),
+                                   output['error'], '%s: %s', 1, True)
+            return 1
+
+        for r in output['result']:
+            textui.print_plain('%s,%s,%s: %s' % (
+                r['user'], r['targethost'], r['service'],
+                _('Access granted: %s') % r['value']))
+            textui.print_attribute(unicode(_('Matched rules')),
+                                   r['matched'], '%s: %s', 1, True)
+            textui.print_attribute(unicode(_('Not matched rules')),
+                                   r['notmatched'], '%s: %s', 1, True)
+            textui.print_attribute(unicode(_('Non-existent or invalid rules')),
+                                   r['error'], '%s: %s', 1, True)
+        textui.print_summary(output['summary'])
+
+        return int(not output['value'])
+
+api.register(hbactest_bulk)
@@ -40,7 +40,7 @@ from ipalib import _, ngettext
 from ipalib import x509
 from ipalib.request import context
 from ipalib.util import (normalize_sshpubkey, validate_sshpubkey_no_options,
-    convert_sshpubkey_post)
+    convert_sshpubkey_post, convert_sshpubkey_post_entries)
 from ipapython.ipautil import ipa_generate_password, CheckedIPAddress
 from ipapython.ssh import SSHPublicKey
 from ipapython.dn import DN
@@ -350,20 +350,32 @@ class host(LDAPObject):
         return dn
 
     def get_managed_hosts(self, dn):
-        host_filter = 'managedBy=%s' % dn
-        host_attrs = ['fqdn']
         ldap = self.api.Backend.ldap2
-        managed_hosts = []
+        return self.get_entries_managed_hosts(ldap, [dn])[dn]
 
-        try:
-            (hosts, truncated) = ldap.find_entries(
-                base_dn=DN(self.container_dn, api.env.basedn),
-                filter=host_filter, attrs_list=host_attrs)
+    def get_entries_managed_hosts(self, ldap, dns):
+        """
+        Return a dict which maps each of ``dns`` to the list of the hosts it
+        manages, with a search per ``find_entries_by_dn_chunk`` DNs.
+        """
+        base_dn = DN(self.container_dn, api.env.basedn)
+        managed_hosts = dict((dn, []) for dn in dns)
+        dns = managed_hosts.keys()
+        for i in xrange(0, len(dns), ldap.find_entries_by_dn_chunk):
+            host_filter = ldap.make_filter_from_attr(
+                'managedby', dns[i:i + ldap.find_entries_by_dn_chunk])
+            try:
+                (hosts, truncated) = ldap.find_entries(
+                    base_dn=base_dn, filter=host_filter,
+                    attrs_list=['fqdn', 'managedby'], size_limit=0)
+            except errors.NotFound:
+                continue
 
             for host in hosts:
-                managed_hosts.append(host.dn)
-        except errors.NotFound:
-            return []
+                for manager in host.get('managedby', []):
+                    manager = DN(manager)
+                    if manager in managed_hosts:
+                        managed_hosts[manager].append(host.dn)
 
         return managed_hosts
 
@@ -372,19 +384,30 @@ class host(LDAPObject):
         We don't want to show managed netgroups so remove them from the
         memberofindirect list.
         """
-        ng_container = DN(api.env.container_netgroup, api.env.basedn)
-        for member in list(entry_attrs.get('memberofindirect', [])):
-            memberdn = DN(member)
-            if not memberdn.endswith(ng_container):
-                continue
+        self.suppress_entries_netgroup_memberof(ldap, [entry_attrs])
 
-            filter = ldap.make_filter({'objectclass': 'mepmanagedentry'})
-            try:
-                ldap.get_entries(memberdn, ldap.SCOPE_BASE, filter, [''])
-            except errors.NotFound:
-                pass
-            else:
-                entry_attrs['memberofindirect'].remove(member)
+    def suppress_entries_netgroup_memberof(self, ldap, entries):
+        """
+        Same as suppress_netgroup_memberof, but for all of ``entries``
+        with the managed netgroups looked up together.
+        """
+        ng_container = DN(api.env.container_netgroup, api.env.basedn)
+        netgroups = set()
+        for entry_attrs in entries:
+            for member in entry_attrs.get('memberofindirect', []):
+                memberdn = DN(member)
+                if memberdn.endswith(ng_container):
+                    netgroups.add(memberdn)
+        if not netgroups:
+            return
+
+        filter = ldap.make_filter({'objectclass': 'mepmanagedentry'})
+        managed = set(e.dn for e in ldap.find_entries_by_dn(
+            list(netgroups), filter, ['']))
+        for entry_attrs in entries:
+            for member in list(entry_attrs.get('memberofindirect', [])):
+                if DN(member) in managed:
+                    entry_attrs['memberofindirect'].remove(member)
 
 api.register(host)
 
@@ -830,20 +853,25 @@ class host_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+        # Look up what is needed for all of the entries together rather than
+        # doing searches for every entry
+        self.obj.get_entries_password_attributes(ldap, entries)
+        self.obj.suppress_entries_netgroup_memberof(ldap, entries)
+        if options.get('all', False):
+            managed_hosts = self.obj.get_entries_managed_hosts(
+                ldap, [entry_attrs.dn for entry_attrs in entries])
+        convert_sshpubkey_post_entries(ldap, entries)
+
         for entry_attrs in entries:
             set_certificate_attrs(entry_attrs)
             set_kerberos_attrs(entry_attrs, options)
-            self.obj.get_password_attributes(ldap, entry_attrs.dn, entry_attrs)
-            self.obj.suppress_netgroup_memberof(ldap, entry_attrs)
             if entry_attrs['has_password']:
                 # If an OTP is set there is no keytab, at least not one
                 # fetched anywhere.
                 entry_attrs['has_keytab'] = False
 
             if options.get('all', False):
-                entry_attrs['managing'] = self.obj.get_managed_hosts(entry_attrs.dn)
-
-            convert_sshpubkey_post(ldap, entry_attrs.dn, entry_attrs)
+                entry_attrs['managing'] = managed_hosts[entry_attrs.dn]
 
         return truncated
 
@@ -18,6 +18,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
+import os
+import time
+import hashlib
 
 from ipalib import api, errors, output
 from ipalib import Command, Password, Str, Flag, StrEnum, DNParam, File
@@ -73,11 +76,17 @@ If a base DN is not provided with --basedn then IPA will use either
 the value of defaultNamingContext if it is set or the first value
 in namingContexts set in the root of the remote LDAP server.
 
-Users are added as members to the default user group. This can be a
-time-intensive task so during migration this is done in a batch
-mode for every 100 users. As a result there will be a window in which
-users will be added to IPA but will not be members of the default
-user group.
+Users and groups are read from the remote server one page at a time,
+so the whole directory does not need to fit in memory. Users are added
+as members to the default user group once per page. As a result there
+will be a window in which users will be added to IPA but will not be
+members of the default user group.
+
+Every migrated user and group is recorded in a checkpoint file on the
+IPA server. If a migration is interrupted, run it again with the
+"--resume" option to skip the objects already migrated. Objects which
+failed to migrate are tried again. The checkpoint is removed when a
+migration completes.
 
 EXAMPLES:
 
@@ -110,20 +119,25 @@ EXAMPLES:
        --user-ignore-attribute=radiusgroupname \\
        ldap://ds.example.com:389
 
+ Resume a migration which was interrupted, for example because the
+ connection to the IPA server timed out:
+   ipa migrate-ds --resume ldap://ds.example.com:389
+
 LOGGING
 
 Migration will log warnings and errors to the Apache error log. This
 file should be evaluated post-migration to correct or investigate any
 issues that were discovered.
 
-For every 100 users migrated an info-level message will be displayed to
-give the current progress and duration to make it possible to track
-the progress of migration.
+For every page of users or groups migrated an info-level message will
+be logged to give the current progress and duration to make it possible
+to track the progress of migration. The number of objects read, converted
+and written and the rate of each phase are returned at the end of the
+migration.
 
 If the log level is debug, either by setting debug = True in
-/etc/ipa/default.conf or /etc/ipa/server.conf, then an entry will be printed
-for each user added plus a summary when the default user group is
-updated.
+/etc/ipa/default.conf or /etc/ipa/server.conf, then a summary will be
+printed when the default user group is updated.
 """)
 
 # USER MIGRATION CALLBACKS AND VARS
@@ -136,6 +150,9 @@ _dn_err_msg = _('Malformed DN')
 
 _supported_schemas = (u'RFC2307bis', u'RFC2307')
 
+# Number of Kerberos principals looked up by one search
+_principal_batch_size = 100
+
 _compat_dn = DN(('cn', 'Schema Compatibility'), ('cn', 'plugins'), ('cn', 'config'))
 
 def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs):
@@ -206,17 +223,25 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
 
     # generate a principal name and check if it isn't already taken
     principal = u'%s@%s' % (pkey, api.env.realm)
-    try:
-        ldap.find_entry_by_attr(
-            'krbprincipalname', principal, 'krbprincipalaux', [''],
-            DN(api.env.container_user, api.env.basedn)
-        )
-    except errors.NotFound:
-        entry_attrs['krbprincipalname'] = principal
-    except errors.LimitsExceeded:
-        failed[pkey] = unicode(_krb_failed_msg % principal)
+    existing_principals = ctx.get('existing_principals')
+    if existing_principals is not None:
+        # looked up for the whole page by _pre_migrate_user_page
+        if principal.lower() in existing_principals:
+            failed[pkey] = unicode(_krb_err_msg % principal)
+        else:
+            entry_attrs['krbprincipalname'] = principal
     else:
-        failed[pkey] = unicode(_krb_err_msg % principal)
+        try:
+            ldap.find_entry_by_attr(
+                'krbprincipalname', principal, 'krbprincipalaux', [''],
+                DN(api.env.container_user, api.env.basedn)
+            )
+        except errors.NotFound:
+            entry_attrs['krbprincipalname'] = principal
+        except errors.LimitsExceeded:
+            failed[pkey] = unicode(_krb_failed_msg % principal)
+        else:
+            failed[pkey] = unicode(_krb_err_msg % principal)
 
     # Fix any attributes with DN syntax that point to entries in the old
     # tree
@@ -263,10 +288,42 @@ def _pre_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx, **kwargs
     return dn
 
 
+def _pre_migrate_user_page(ldap, pkeys, config, ctx):
+    """
+    Look up which of the Kerberos principals of a page of users are
+    already taken, so that _pre_migrate_user does not have to search for
+    each user.
+    """
+    principals = [u'%s@%s' % (pkey, api.env.realm) for pkey in pkeys]
+    existing_principals = set()
+    for i in xrange(0, len(principals), _principal_batch_size):
+        searchfilter = ldap.make_filter_from_attr(
+            'krbprincipalname', principals[i:i + _principal_batch_size])
+        try:
+            (entries, truncated) = ldap.find_entries(
+                searchfilter, ['krbprincipalname'],
+                DN(api.env.container_user, api.env.basedn),
+                time_limit=-1, size_limit=-1)
+        except errors.NotFound:
+            continue
+        except errors.LimitsExceeded:
+            # let _pre_migrate_user search for each user
+            ctx['existing_principals'] = None
+            return
+        if truncated:
+            ctx['existing_principals'] = None
+            return
+        for entry in entries:
+            existing_principals.update(
+                p.lower() for p in entry.get('krbprincipalname', []))
+    ctx['existing_principals'] = existing_principals
+
+
 def _post_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx):
     assert isinstance(dn, DN)
 
-    _update_default_group(ldap, pkey, config, ctx, False)
+    # added to the default group by _post_migrate_user_page
+    ctx['def_group_members'].append(dn)
 
     if 'description' in entry_attrs and NO_UPG_MAGIC in entry_attrs['description']:
         entry_attrs['description'].remove(NO_UPG_MAGIC)
@@ -277,6 +334,24 @@ def _post_migrate_user(ldap, pkey, dn, entry_attrs, failed, config, ctx):
         except (errors.EmptyModlist, errors.NotFound):
             pass
 
+def _post_migrate_user_page(ldap, pkeys, config, ctx):
+    """
+    Add the users migrated from a page to the default group at once.
+    """
+    members = ctx['def_group_members']
+    if not members:
+        return
+    s = datetime.datetime.now()
+    try:
+        ldap.add_entries_to_group(members, ctx['def_group_dn'])
+    except errors.ExecutionError, e:
+        # _update_default_group catches them at the end of the migration
+        api.log.warn('Unable to add %d users to the default group: %s',
+                     len(members), e)
+    api.log.debug('Adding %d users to group duration %s',
+                  len(members), datetime.datetime.now() - s)
+    ctx['def_group_members'] = []
+
 def _update_default_group(ldap, pkey, config, ctx, force):
     migrate_cnt = ctx['migrate_cnt']
     group_dn = ctx['def_group_dn']
@@ -465,6 +540,18 @@ class migrate_ds(Command):
         #
         # If pre_callback return value evaluates to False, migration
         # of the current object is aborted.
+        #
+        # Objects are read from DS one page at a time:
+        # pre_page_callback - is called with the primary keys of the objects
+        #                     of a page before their pre_callback
+        # post_page_callback - is called with the primary keys of the
+        #                      objects of a page after they were added
+        #
+        # {pre, post}_page_callback parameters:
+        #  ldap - ldap2 instance connected to IPA
+        #  pkeys - primary key values of the objects of the page
+        #  config - IPA config entry attributes
+        #  ctx - object context, used to pass data between callbacks
         'user': {
             'filter_template' : '(&(|%s)(uid=*))',
             'oc_option' : 'userobjectclass',
@@ -472,7 +559,9 @@ class migrate_ds(Command):
             'attr_blacklist_option' : 'userignoreattribute',
             'pre_callback' : _pre_migrate_user,
             'post_callback' : _post_migrate_user,
-            'exc_callback' : None
+            'exc_callback' : None,
+            'pre_page_callback' : _pre_migrate_user_page,
+            'post_page_callback' : _post_migrate_user_page,
         },
         'group': {
             'filter_template' : '(&(|%s)(cn=*))',
@@ -482,6 +571,8 @@ class migrate_ds(Command):
             'pre_callback' : _pre_migrate_group,
             'post_callback' : None,
             'exc_callback' : _group_exc_callback,
+            'pre_page_callback' : None,
+            'post_page_callback' : None,
         },
     }
     migrate_order = ('user', 'group')
@@ -605,6 +696,12 @@ class migrate_ds(Command):
             doc=_('Load CA certificate of LDAP server from FILE'),
             default=None
         ),
+        Flag('resume?',
+            cli_name='resume',
+            label=_('Resume'),
+            doc=_('Resume an interrupted migration, skipping the objects it already migrated'),
+            default=False,
+        ),
     )
 
     has_output = (
@@ -616,6 +713,10 @@ class migrate_ds(Command):
             type=dict,
             doc=_('Lists of objects that could not be migrated; categorized by type.'),
         ),
+        output.Output('stats',
+            type=dict,
+            doc=_('Number of objects read, converted, written and skipped and rates in objects per second; categorized by type.'),
+        ),
         output.Output('enabled',
             type=bool,
             doc=_('False if migration mode was disabled.'),
@@ -690,37 +791,256 @@ can use their Kerberos accounts.''')
             search_bases[ldap_obj_name] = search_base
         return search_bases
 
+    def _get_checkpoint_file(self, ldapuri, search_base, search_filter,
+                             ldap_obj_name):
+        """
+        Return the path of the file listing the objects already processed
+        by a migration from ldapuri, None if there is no place for it.
+        """
+        checkpoint_dir = getattr(self.env, 'migration_checkpoint_dir', None)
+        if not checkpoint_dir or not os.path.isdir(checkpoint_dir):
+            return None
+        key = hashlib.sha1(
+            '\0'.join((ldapuri, str(search_base), search_filter)))
+        return os.path.join(checkpoint_dir, '%s-%s' % (key.hexdigest(),
+                                                       ldap_obj_name))
+
+    def _read_checkpoint(self, path):
+        """
+        Return the set of primary keys listed in the checkpoint file path.
+        """
+        done = set()
+        if path is None:
+            return done
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.endswith('\n'):
+                        done.add(line[:-1].decode('utf-8'))
+        except IOError:
+            pass
+        return done
+
+    def _open_checkpoint(self, path, resume):
+        if path is None:
+            return None
+        try:
+            return open(path, 'a' if resume else 'w')
+        except IOError, e:
+            self.log.warning('Unable to write migration checkpoint %s: %s',
+                             path, e)
+            return None
+
     def migrate(self, ldap, config, ds_ldap, ds_base_dn, options):
         """
         Migrate objects from DS to LDAP.
+
+        Objects are read from DS and added to IPA one page at a time. The
+        primary keys of processed objects are appended to a checkpoint file
+        so that an interrupted migration can be resumed with --resume.
+
+        Returns (migrated, failed, stats) where stats holds the number of
+        objects read from DS, converted, written to IPA and skipped, and
+        the rate of each phase in objects per second.
         """
         assert isinstance(ds_base_dn, DN)
         migrated = {} # {'OBJ': ['PKEY1', 'PKEY2', ...], ...}
         failed = {} # {'OBJ': {'PKEY1': 'Failed 'cos blabla', ...}, ...}
+        stats = {} # {'OBJ': {'read': 1, 'read_rate': 1.0, ...}, ...}
+        checkpoints = []
         search_bases = self._get_search_bases(options, ds_base_dn, self.migrate_order)
         migration_start = datetime.datetime.now()
-        for ldap_obj_name in self.migrate_order:
-            ldap_obj = self.api.Object[ldap_obj_name]
-
-            template = self.migrate_objects[ldap_obj_name]['filter_template']
-            oc_list = options[to_cli(self.migrate_objects[ldap_obj_name]['oc_option'])]
-            search_filter = construct_filter(template, oc_list)
-
-            exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
-            context = dict(ds_ldap = ds_ldap)
-
-            migrated[ldap_obj_name] = []
-            failed[ldap_obj_name] = {}
+        try:
+            for ldap_obj_name in self.migrate_order:
+                ldap_obj = self.api.Object[ldap_obj_name]
+                callbacks = self.migrate_objects[ldap_obj_name]
+
+                template = callbacks['filter_template']
+                oc_list = options[to_cli(callbacks['oc_option'])]
+                search_filter = construct_filter(template, oc_list)
+
+                exclude = options['exclude_%ss' % to_cli(ldap_obj_name)]
+                context = dict(ds_ldap = ds_ldap)
+
+                migrated[ldap_obj_name] = []
+                failed[ldap_obj_name] = {}
+                counts = dict(read=0, converted=0, written=0, skipped=0)
+                durations = dict(read=0.0, converted=0.0, written=0.0)
+
+                checkpoint_path = self._get_checkpoint_file(
+                    ds_ldap.ldap_uri, search_bases[ldap_obj_name], search_filter,
+                    ldap_obj_name)
+                done = set()
+                if options.get('resume', False):
+                    done = self._read_checkpoint(checkpoint_path)
+                checkpoint = self._open_checkpoint(
+                    checkpoint_path, options.get('resume', False))
+                if checkpoint is not None:
+                    checkpoints.append((checkpoint_path, checkpoint))
+
+                blacklists = {}
+                for blacklist in ('oc_blacklist', 'attr_blacklist'):
+                    blacklist_option = callbacks[blacklist+'_option']
+                    if blacklist_option is not None:
+                        blacklists[blacklist] = options.get(blacklist_option, tuple())
+                    else:
+                        blacklists[blacklist] = tuple()
 
-            try:
-                entries, truncated = ds_ldap.find_entries(
+                # get default primary group for new users
+                if 'def_group_dn' not in context:
+                    def_group = config.get('ipadefaultprimarygroup')
+                    context['def_group_dn'] = self.api.Object.group.get_dn(def_group)
+                    try:
+                        g_attrs = ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
+                    except errors.NotFound:
+                        error_msg = _('Default group for new users not found')
+                        raise errors.NotFound(reason=error_msg)
+                    if 'gidnumber' in g_attrs:
+                        context['def_group_gid'] = g_attrs['gidnumber'][0]
+
+                context['has_upg'] = ldap.has_upg()
+                context['def_group_members'] = []
+
+                valid_gids = []
+                invalid_gids = []
+                migrate_cnt = 0
+                context['migrate_cnt'] = 0
+
+                pages = ds_ldap.find_entries_paged(
                     search_filter, ['*'], search_bases[ldap_obj_name],
                     ds_ldap.SCOPE_ONELEVEL,
                     time_limit=0, size_limit=-1,
                     search_refs=True    # migrated DS may contain search references
                 )
-            except errors.NotFound:
-                if not options.get('continue',False):
+                try:
+                    while True:
+                        s = time.time()
+                        try:
+                            (entries, truncated) = pages.next()
+                        except StopIteration:
+                            break
+                        except errors.NotFound:
+                            # the search base does not exist
+                            break
+                        durations['read'] += time.time() - s
+                        counts['read'] += len(entries)
+                        if truncated:
+                            self.log.error(
+                                '%s: %s' % (
+                                    ldap_obj.name, self.truncated_err_msg
+                                )
+                            )
+
+                        # Convert the entries of the page
+                        s = time.time()
+                        page = []
+                        for entry_attrs in entries:
+                            ava = entry_attrs.dn[0][0]
+                            if ava.attr == ldap_obj.primary_key.name:
+                                # In case if pkey attribute is in the migrated object DN
+                                # and the original LDAP is multivalued, make sure that
+                                # we pick the correct value (the unique one stored in DN)
+                                pkey = ava.value.lower()
+                            else:
+                                pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
+
+                            if pkey in exclude:
+                                continue
+                            if pkey in done:
+                                counts['skipped'] += 1
+                                continue
+                            page.append((pkey, entry_attrs))
+                        # The entries read from DS are referenced from page only
+                        del entries
+
+                        callback = callbacks['pre_page_callback']
+                        if callable(callback) and page:
+                            callback(ldap, [k for (k, _e) in page], config,
+                                     context)
+
+                        converted = []
+                        for (pkey, entry_attrs) in page:
+                            entry_attrs.dn = ldap_obj.get_dn(pkey)
+                            entry_attrs['objectclass'] = list(
+                                set(
+                                    config.get(
+                                        ldap_obj.object_class_config, ldap_obj.object_class
+                                    ) + [o.lower() for o in entry_attrs['objectclass']]
+                                )
+                            )
+                            entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
+
+                            callback = callbacks['pre_callback']
+                            if callable(callback):
+                                try:
+                                    entry_attrs.dn = callback(
+                                        ldap, pkey, entry_attrs.dn, entry_attrs,
+                                        failed[ldap_obj_name], config, context,
+                                        schema=options['schema'],
+                                        search_bases=search_bases,
+                                        valid_gids=valid_gids,
+                                        invalid_gids=invalid_gids,
+                                        **blacklists
+                                    )
+                                    if not entry_attrs.dn:
+                                        continue
+                                except errors.NotFound, e:
+                                    failed[ldap_obj_name][pkey] = unicode(e.reason)
+                                    continue
+                            converted.append((pkey, entry_attrs))
+                        durations['converted'] += time.time() - s
+                        counts['converted'] += len(converted)
+                        del page
+
+                        # Write the converted entries to IPA
+                        s = time.time()
+                        for (pkey, entry_attrs) in converted:
+                            try:
+                                ldap.add_entry(entry_attrs)
+                            except errors.ExecutionError, e:
+                                callback = callbacks['exc_callback']
+                                if callable(callback):
+                                    try:
+                                        callback(
+                                            ldap, entry_attrs.dn, entry_attrs, e, options)
+                                    except errors.ExecutionError, e:
+                                        failed[ldap_obj_name][pkey] = unicode(e)
+                                        continue
+                                else:
+                                    failed[ldap_obj_name][pkey] = unicode(e)
+                                    continue
+
+                            migrated[ldap_obj_name].append(pkey)
+                            counts['written'] += 1
+
+                            callback = callbacks['post_callback']
+                            if callable(callback):
+                                callback(
+                                    ldap, pkey, entry_attrs.dn, entry_attrs,
+                                    failed[ldap_obj_name], config, context)
+                            migrate_cnt += 1
+                            context['migrate_cnt'] = migrate_cnt
+
+                            # Failed objects are not recorded, so that they are
+                            # tried and reported again when resuming
+                            self._checkpoint(checkpoint, pkey)
+
+                        callback = callbacks['post_page_callback']
+                        if callable(callback) and converted:
+                            callback(ldap, [k for (k, _e) in converted],
+                                     config, context)
+                        if checkpoint is not None:
+                            checkpoint.flush()
+                        durations['written'] += time.time() - s
+                        del converted
+
+                        api.log.info("%d %ss migrated. %s elapsed." % (
+                            migrate_cnt, ldap_obj_name,
+                            datetime.datetime.now() - migration_start))
+                finally:
+                    pages.close()
+
+                if not counts['read'] and not options.get('continue', False):
                     raise errors.NotFound(
                         reason=_('%(container)s LDAP search did not return any result '
                                  '(search base: %(search_base)s, '
@@ -729,119 +1049,41 @@ can use their Kerberos accounts.''')
                                     'search_base': search_bases[ldap_obj_name],
                                     'objectclass': ', '.join(oc_list)}
                     )
-                else:
-                    truncated = False
-                    entries = []
-            if truncated:
-                self.log.error(
-                    '%s: %s' % (
-                        ldap_obj.name, self.truncated_err_msg
-                    )
-                )
 
-            blacklists = {}
-            for blacklist in ('oc_blacklist', 'attr_blacklist'):
-                blacklist_option = self.migrate_objects[ldap_obj_name][blacklist+'_option']
-                if blacklist_option is not None:
-                    blacklists[blacklist] = options.get(blacklist_option, tuple())
-                else:
-                    blacklists[blacklist] = tuple()
-
-            # get default primary group for new users
-            if 'def_group_dn' not in context:
-                def_group = config.get('ipadefaultprimarygroup')
-                context['def_group_dn'] = api.Object.group.get_dn(def_group)
-                try:
-                    g_attrs = ldap.get_entry(context['def_group_dn'], ['gidnumber', 'cn'])
-                except errors.NotFound:
-                    error_msg = _('Default group for new users not found')
-                    raise errors.NotFound(reason=error_msg)
-                if 'gidnumber' in g_attrs:
-                    context['def_group_gid'] = g_attrs['gidnumber'][0]
-
-            context['has_upg'] = ldap.has_upg()
-
-            valid_gids = []
-            invalid_gids = []
-            migrate_cnt = 0
-            context['migrate_cnt'] = 0
-            for entry_attrs in entries:
-                context['migrate_cnt'] = migrate_cnt
-                s = datetime.datetime.now()
-
-                ava = entry_attrs.dn[0][0]
-                if ava.attr == ldap_obj.primary_key.name:
-                    # In case if pkey attribute is in the migrated object DN
-                    # and the original LDAP is multivalued, make sure that
-                    # we pick the correct value (the unique one stored in DN)
-                    pkey = ava.value.lower()
-                else:
-                    pkey = entry_attrs[ldap_obj.primary_key.name][0].lower()
-
-                if pkey in exclude:
-                    continue
-
-                entry_attrs.dn = ldap_obj.get_dn(pkey)
-                entry_attrs['objectclass'] = list(
-                    set(
-                        config.get(
-                            ldap_obj.object_class_config, ldap_obj.object_class
-                        ) + [o.lower() for o in entry_attrs['objectclass']]
-                    )
-                )
-                entry_attrs[ldap_obj.primary_key.name][0] = entry_attrs[ldap_obj.primary_key.name][0].lower()
-
-                callback = self.migrate_objects[ldap_obj_name]['pre_callback']
-                if callable(callback):
-                    try:
-                        entry_attrs.dn = callback(
-                            ldap, pkey, entry_attrs.dn, entry_attrs,
-                            failed[ldap_obj_name], config, context,
-                            schema=options['schema'],
-                            search_bases=search_bases,
-                            valid_gids=valid_gids,
-                            invalid_gids=invalid_gids,
-                            **blacklists
-                        )
-                        if not entry_attrs.dn:
-                            continue
-                    except errors.NotFound, e:
-                        failed[ldap_obj_name][pkey] = unicode(e.reason)
-                        continue
-
-                try:
-                    ldap.add_entry(entry_attrs)
-                except errors.ExecutionError, e:
-                    callback = self.migrate_objects[ldap_obj_name]['exc_callback']
-                    if callable(callback):
-                        try:
-                            callback(
-                                ldap, entry_attrs.dn, entry_attrs, e, options)
-                        except errors.ExecutionError, e:
-                            failed[ldap_obj_name][pkey] = unicode(e)
-                            continue
+                stats[ldap_obj_name] = counts
+                for phase in ('read', 'converted', 'written'):
+                    if durations[phase] > 0:
+                        rate = counts[phase] / durations[phase]
                     else:
-                        failed[ldap_obj_name][pkey] = unicode(e)
-                        continue
-
-                migrated[ldap_obj_name].append(pkey)
-
-                callback = self.migrate_objects[ldap_obj_name]['post_callback']
-                if callable(callback):
-                    callback(
-                        ldap, pkey, entry_attrs.dn, entry_attrs,
-                        failed[ldap_obj_name], config, context)
-                e = datetime.datetime.now()
-                d = e - s
-                total_dur = e - migration_start
-                migrate_cnt += 1
-                if migrate_cnt > 0 and migrate_cnt % 100 == 0:
-                    api.log.info("%d %ss migrated. %s elapsed." % (migrate_cnt, ldap_obj_name, total_dur))
-                api.log.debug("%d %ss migrated, duration: %s (total %s)" % (migrate_cnt, ldap_obj_name, d, total_dur))
+                        rate = 0.0
+                    counts['%s_rate' % phase] = round(rate, 1)
+                api.log.info(
+                    '%ss: %d read (%.1f/s), %d converted (%.1f/s), '
+                    '%d written (%.1f/s), %d skipped', ldap_obj_name,
+                    counts['read'], counts['read_rate'],
+                    counts['converted'], counts['converted_rate'],
+                    counts['written'], counts['written_rate'], counts['skipped'])
+
+            _update_default_group(ldap, None, config, context, True)
+        finally:
+            # Also when interrupted, so that the processed objects are
+            # recorded and no file is left open
+            for (path, checkpoint) in checkpoints:
+                checkpoint.close()
+
+        # The migration is complete, there is nothing left to resume
+        for (path, checkpoint) in checkpoints:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
 
-        _update_default_group(ldap, pkey, config, context, True)
+        return (migrated, failed, stats)
 
-        return (migrated, failed)
+    def _checkpoint(self, checkpoint, pkey):
+        # Record a migrated object, only complete lines are read back
+        if checkpoint is not None:
+            checkpoint.write('%s\n' % pkey.encode('utf-8'))
 
     def execute(self, ldapuri, bindpw, **options):
         ldap = self.api.Backend.ldap2
@@ -854,7 +1096,8 @@ can use their Kerberos accounts.''')
 
         # check if migration mode is enabled
         if config.get('ipamigrationenabled', ('FALSE', ))[0] == 'FALSE':
-            return dict(result={}, failed={}, enabled=False, compat=True)
+            return dict(result={}, failed={}, stats={}, enabled=False,
+                        compat=True)
 
         # connect to DS
         ds_ldap = ldap2(shared_instance=False, ldap_uri=ldapuri, base_dn='')
@@ -879,7 +1122,8 @@ can use their Kerberos accounts.''')
                 check_compat = ldap.get_entry(_compat_dn)
                 if check_compat is not None and \
                         check_compat.get('nsslapd-pluginenabled', [''])[0].lower() == 'on':
-                    return dict(result={}, failed={}, enabled=True, compat=False)
+                    return dict(result={}, failed={}, stats={},
+                                enabled=True, compat=False)
             except errors.NotFound:
                 pass
 
@@ -900,11 +1144,12 @@ can use their Kerberos accounts.''')
                     raise StandardError(str(e))
 
         # migrate!
-        (migrated, failed) = self.migrate(
+        (migrated, failed, stats) = self.migrate(
             ldap, config, ds_ldap, ds_base_dn, options
         )
 
-        return dict(result=migrated, failed=failed, enabled=True, compat=True)
+        return dict(result=migrated, failed=failed, stats=stats,
+                    enabled=True, compat=True)
 
     def output_for_cli(self, textui, result, ldapuri, bindpw, **options):
         textui.print_name(self.name)
@@ -925,6 +1170,16 @@ can use their Kerberos accounts.''')
                 result['failed'][ldap_obj_name], attr_order=self.migrate_order,
                 one_value_per_line=True,
             )
+        for ldap_obj_name in self.migrate_order:
+            stats = result['stats'].get(ldap_obj_name)
+            if stats:
+                textui.print_plain(
+                    '%ss: %d read (%.1f/s), %d converted (%.1f/s), '
+                    '%d written (%.1f/s), %d skipped' % (
+                        ldap_obj_name, stats['read'], stats['read_rate'],
+                        stats['converted'], stats['converted_rate'],
+                        stats['written'], stats['written_rate'],
+                        stats['skipped']))
         textui.print_plain('-' * len(self.name))
         textui.print_plain(unicode(self.pwd_migration_msg))
 
@@ -27,6 +27,7 @@ from ipalib import api, _, ngettext
 from ipalib.plugable import Registry
 from ipalib.capabilities import client_has_capability
 from ipalib.aci import ACI
+from ipalib.plugins.aci import get_aci_index
 from ipapython.dn import DN
 from ipalib.request import context
 
@@ -615,11 +616,10 @@ class permission(baseldap.LDAPObject):
                 acientry = ldap.get_entry(location, ['aci'])
             except errors.NotFound:
                 acientry = ldap.make_entry(location)
-        acis = acientry.get('aci', ())
-        for acistring in acis:
-            aci = ACI(acistring)
+        index = get_aci_index(acientry.get('aci', ()))
+        for aci in index.by_name.get(wanted_aciname.lower(), ()):
             if aci.name == wanted_aciname:
-                return acientry, acistring
+                return acientry, aci.orig_acistr
         else:
             if notfound_ok:
                 return acientry, None
@@ -659,7 +659,7 @@ class permission(baseldap.LDAPObject):
         # (pylint thinks `base` is just a dict, but it's an LDAPEntry)
         assert base.dn == self.api.env.basedn, base  # pylint: disable=E1103
 
-        aci = ACI(acistring)
+        aci = get_aci_index(base.get('aci', ())).by_string[acistring]
 
         if 'target' in aci.target:
             target_entry.single_value['ipapermtarget'] = DN(strip_ldap_prefix(
@@ -673,7 +673,7 @@ class permission(baseldap.LDAPObject):
             target_entry.single_value['ipapermbindruletype'] = u'anonymous'
         else:
             target_entry.single_value['ipapermbindruletype'] = u'permission'
-        target_entry['ipapermright'] = aci.permissions
+        target_entry['ipapermright'] = list(aci.permissions)
         if 'targetattr' in aci.target:
             target_entry['ipapermincludedattr'] = [
                 unicode(a) for a in aci.target['targetattr']['expression']]
@@ -21,6 +21,9 @@
 
 import base64
 import os
+import collections
+import hashlib
+import threading
 
 from ipalib import api, errors, util
 from ipalib import Str, Flag, Bytes, StrEnum, Bool
@@ -202,12 +205,84 @@ def validate_certificate(ugettext, cert):
         # We'll assume this is DER data
         pass
 
+class _CertificateAttrsCache(object):
+    """
+    LRU cache of the attributes set_certificate_attrs derives from
+    certificates, keyed by the SHA-1 digest of the certificate.
+
+    It is shared by all requests of the process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            try:
+                attrs = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self.entries[key] = attrs
+            self.hits += 1
+            return attrs
+
+    def add(self, key, attrs, size):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = attrs
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                size=len(self.entries),
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+            )
+
+_certificate_attrs_cache = _CertificateAttrsCache()
+
+def get_certificate_attrs_cache_stats():
+    """
+    Return the number of certificates in the set_certificate_attrs cache,
+    and its hits, misses and evictions since the process started.
+    """
+    return _certificate_attrs_cache.stats()
+
+def get_certificate_attrs(cert):
+    """
+    Return a dict of the attributes shown for a certificate.
+    """
+    cert = x509.normalize_certificate(cert)
+    cert = x509.load_certificate(cert, datatype=x509.DER)
+    return dict(
+        subject=unicode(cert.subject),
+        serial_number=unicode(cert.serial_number),
+        serial_number_hex=u'0x%X' % cert.serial_number,
+        issuer=unicode(cert.issuer),
+        valid_not_before=unicode(cert.valid_not_before_str),
+        valid_not_after=unicode(cert.valid_not_after_str),
+        md5_fingerprint=unicode(nss.data_to_hex(nss.md5_digest(cert.der_data), 64)[0]),
+        sha1_fingerprint=unicode(nss.data_to_hex(nss.sha1_digest(cert.der_data), 64)[0]),
+    )
+
 def set_certificate_attrs(entry_attrs):
     """
     Set individual attributes from some values from a certificate.
 
     entry_attrs is a dict of an entry
 
+    The attributes of the last cert_attrs_cache_size certificates are
+    cached.
+
     returns nothing
     """
     if not 'usercertificate' in entry_attrs:
@@ -216,16 +291,21 @@ def set_certificate_attrs(entry_attrs):
         cert = entry_attrs['usercertificate'][0]
     else:
         cert = entry_attrs['usercertificate']
-    cert = x509.normalize_certificate(cert)
-    cert = x509.load_certificate(cert, datatype=x509.DER)
-    entry_attrs['subject'] = unicode(cert.subject)
-    entry_attrs['serial_number'] = unicode(cert.serial_number)
-    entry_attrs['serial_number_hex'] = u'0x%X' % cert.serial_number
-    entry_attrs['issuer'] = unicode(cert.issuer)
-    entry_attrs['valid_not_before'] = unicode(cert.valid_not_before_str)
-    entry_attrs['valid_not_after'] = unicode(cert.valid_not_after_str)
-    entry_attrs['md5_fingerprint'] = unicode(nss.data_to_hex(nss.md5_digest(cert.der_data), 64)[0])
-    entry_attrs['sha1_fingerprint'] = unicode(nss.data_to_hex(nss.sha1_digest(cert.der_data), 64)[0])
+
+    size = getattr(api.env, 'cert_attrs_cache_size', 0)
+    if not size:
+        entry_attrs.update(get_certificate_attrs(cert))
+        return
+
+    if isinstance(cert, unicode):
+        key = hashlib.sha1(cert.encode('utf-8')).digest()
+    else:
+        key = hashlib.sha1(cert).digest()
+    attrs = _certificate_attrs_cache.get(key)
+    if attrs is None:
+        attrs = get_certificate_attrs(cert)
+        _certificate_attrs_cache.add(key, attrs, size)
+    entry_attrs.update(attrs)
 
 def check_required_principal(ldap, hostname, service):
     """
@@ -541,8 +621,8 @@ class service_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+        self.obj.get_entries_password_attributes(ldap, entries)
         for entry_attrs in entries:
-            self.obj.get_password_attributes(ldap, entry_attrs.dn, entry_attrs)
             set_certificate_attrs(entry_attrs)
             set_kerberos_attrs(entry_attrs, options)
         return truncated
@@ -1272,6 +1272,9 @@ def fetch_domains_from_trust(self, trustinstance, trust_entry, **options):
 class trust_fetch_domains(LDAPRetrieve):
     __doc__ = _('Refresh list of the domains associated with the trust')
 
+    # Adds the domains of the trust
+    read_only = False
+
     has_output = output.standard_list_of_entries
 
     def execute(self, *keys, **options):
@@ -21,7 +21,6 @@
 from time import gmtime, strftime
 import string
 import posixpath
-import os
 
 from ipalib import api, errors
 from ipalib import Flag, Int, Password, Str, Bool, StrEnum
@@ -34,7 +33,7 @@ from ipapython.ipautil import ipa_generate_password
 from ipapython.ipavalidate import Email
 from ipalib.capabilities import client_has_capability
 from ipalib.util import (normalize_sshpubkey, validate_sshpubkey,
-    convert_sshpubkey_post)
+    convert_sshpubkey_post, convert_sshpubkey_post_entries)
 if api.env.in_server and api.env.context in ['lite', 'server']:
     from ipaserver.plugins.ldap2 import ldap2
 
@@ -770,11 +769,11 @@ class user_find(LDAPSearch):
     def post_callback(self, ldap, entries, truncated, *args, **options):
         if options.get('pkey_only', False):
             return truncated
+        self.obj.get_entries_password_attributes(ldap, entries)
+        convert_sshpubkey_post_entries(ldap, entries)
         for attrs in entries:
             self.obj._convert_manager(attrs, **options)
-            self.obj.get_password_attributes(ldap, attrs.dn, attrs)
             convert_nsaccountlock(attrs)
-            convert_sshpubkey_post(ldap, attrs.dn, attrs)
         return truncated
 
     msg_summary = ngettext(
@@ -928,7 +927,7 @@ class user_status(LDAPQuery):
                                    ldap_uri='ldap://%s' % host,
                                    base_dn=self.api.env.basedn)
                 try:
-                    other_ldap.connect(ccache=os.environ['KRB5CCNAME'])
+                    other_ldap.connect(ccache=context.ccache_name)
                 except Exception, e:
                     self.error("user_status: Connecting to %s failed with %s" % (host, str(e)))
                     newresult = {'dn': dn}
@@ -49,6 +49,7 @@ from dns.exception import DNSException
 from nss.error import NSPRError
 
 from ipalib.backend import Connectible
+from ipalib.crud import ResultStream
 from ipalib.errors import (public_errors, UnknownError, NetworkError,
     KerberosError, XMLRPCMarshallError, JSONError, ConversionError)
 from ipalib import errors
@@ -65,6 +66,7 @@ from ipalib.krb_utils import KRB5KDC_ERR_S_PRINCIPAL_UNKNOWN, KRB5KRB_AP_ERR_TKT
 from ipapython.dn import DN
 
 COOKIE_NAME = 'ipa_session'
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
 KEYRING_COOKIE_NAME = '%s_cookie:%%s' % COOKIE_NAME
 
 errors_by_code = dict((e.errno, e) for e in public_errors)
@@ -268,6 +270,66 @@ def json_encode_binary(val):
         return val
 
 
+_json_encode_string = json.encoder.encode_basestring_ascii
+
+
+def json_dumps_binary(val):
+    '''
+    Serialize val to compact JSON (no indentation, keys not sorted).
+
+    Binary values are encoded the same way json_encode_binary() does, but
+    during serialization, so no intermediate copy of val is built.
+    '''
+    chunks = []
+    _json_dumps_binary(val, chunks.append)
+    return ''.join(chunks)
+
+
+def _json_dumps_binary(val, append):
+    if isinstance(val, unicode):
+        append(_json_encode_string(val))
+    elif isinstance(val, str):
+        append('{"__base64__":"%s"}' % base64.b64encode(val))
+    elif isinstance(val, dict):
+        append('{')
+        first = True
+        for k, v in val.iteritems():
+            if first:
+                first = False
+            else:
+                append(',')
+            if not isinstance(k, basestring):
+                k = json.dumps(k)
+            append(_json_encode_string(k))
+            append(':')
+            _json_dumps_binary(v, append)
+        append('}')
+    elif isinstance(val, (list, tuple)):
+        append('[')
+        first = True
+        for v in val:
+            if first:
+                first = False
+            else:
+                append(',')
+            _json_dumps_binary(v, append)
+        append(']')
+    elif val is None:
+        append('null')
+    elif val is True:
+        append('true')
+    elif val is False:
+        append('false')
+    elif isinstance(val, (int, long)):
+        append(str(val))
+    elif isinstance(val, Decimal):
+        append('{"__base64__":"%s"}' % base64.b64encode(str(val)))
+    elif isinstance(val, DN):
+        append(_json_encode_string(str(val)))
+    else:
+        append(json.dumps(val))
+
+
 def json_decode_binary(val):
     '''
     JSON cannot transport binary data. In order to transport binary data we
@@ -381,6 +443,37 @@ class MultiProtocolTransport(Transport):
         connection.putheader("Content-Length", str(len(request_body)))
         connection.endheaders(request_body)
 
+    def stream_request(self, host, handler, request_body, accept, verbose=0):
+        """
+        Send a request and return the HTTP response without reading its
+        body so that the caller can consume it incrementally. The caller is
+        responsible for closing the transport when done.
+        """
+        h = self.make_connection(host)
+        if verbose:
+            h.set_debuglevel(1)
+
+        try:
+            self.send_request(h, handler, request_body)
+            self.send_host(h, host)
+            self.send_user_agent(h)
+            h.putheader("Accept", accept)
+            self.send_content(h, request_body)
+            response = h.getresponse(buffering=True)
+        except Exception:
+            self.close()
+            raise
+
+        if response.status != 200:
+            if response.getheader("content-length", 0):
+                response.read()
+            self.close()
+            raise ProtocolError(host + handler, response.status,
+                                response.reason, response.msg)
+
+        self.verbose = verbose
+        return response
+
 
 class LanguageAwareTransport(MultiProtocolTransport):
     """Transport sending Accept-Language header"""
@@ -577,6 +670,12 @@ class KerbTransport(SSLTransport):
         self.store_session_cookie(response.getheader('Set-Cookie'))
         return SSLTransport.parse_response(self, response)
 
+    def stream_request(self, host, handler, request_body, accept, verbose=0):
+        response = SSLTransport.stream_request(
+            self, host, handler, request_body, accept, verbose)
+        self.store_session_cookie(response.getheader('Set-Cookie'))
+        return response
+
 
 class DelegatedKerbTransport(KerbTransport):
     """
@@ -886,6 +985,19 @@ class RPCClient(Connectible):
         except (OverflowError, TypeError), e:
             raise XMLRPCMarshallError(error=str(e))
 
+    def forward_stream(self, name, *args, **kw):
+        """
+        Forward call to the search command named ``name`` and return a
+        `ResultStream` over the entries it found.
+
+        This implementation receives the whole result using `forward`,
+        protocols which support streaming override it.
+        """
+        result = self.forward(name, *args, **kw)
+        stream = ResultStream([(result['result'], result['truncated'])])
+        stream.summary = result.get('summary')
+        return stream
+
 
 class xmlclient(RPCClient):
     session_path = '/ipa/session/xml'
@@ -899,6 +1011,24 @@ class xmlclient(RPCClient):
         return xml_unwrap(result)
 
 
+def _iter_lines(response, block_size=8192):
+    """
+    Iterate over the non-empty lines of a HTTP response body.
+    """
+    pending = ''
+    while True:
+        data = response.read(block_size)
+        if not data:
+            break
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                yield line
+    if pending:
+        yield pending
+
+
 class JSONServerProxy(object):
     def __init__(self, uri, transport, encoding, verbose, allow_none):
         type, uri = urllib.splittype(uri)
@@ -917,7 +1047,8 @@ class JSONServerProxy(object):
         self._ServerProxy__transport = transport
 
     def __request(self, name, args):
-        payload = {'method': unicode(name), 'params': args, 'id': 0}
+        payload = {'method': unicode(name), 'params': args, 'id': 0,
+                   'format': 'compact'}
 
         response = self.__transport.request(
             self.__host,
@@ -926,11 +1057,62 @@ class JSONServerProxy(object):
             verbose=self.__verbose,
         )
 
+        return self.__handle_response(response)
+
+    def _stream_request(self, name, args):
+        """
+        Call the search command ``name`` asking for a streamed response.
+
+        The request is sent right away. Returns an iterator which yields
+        a ``('entry', entry)`` tuple for every entry read from the response
+        and finally a ``('result', result)`` tuple, where result contains
+        the ``truncated`` flag and ``summary`` of the search.
+        """
+        payload = {'method': unicode(name), 'params': args, 'id': 0,
+                   'format': 'compact'}
+
+        response = self.__transport.stream_request(
+            self.__host,
+            self.__handler,
+            json.dumps(json_encode_binary(payload)),
+            NDJSON_CONTENT_TYPE,
+            verbose=self.__verbose,
+        )
+
+        return self.__iter_stream(response)
+
+    def __iter_stream(self, response):
+        try:
+            content_type = response.getheader('Content-Type', '')
+            if not content_type.startswith(NDJSON_CONTENT_TYPE):
+                # The server did not stream the result
+                result = self.__handle_response(response.read())
+                for entry in result['result']:
+                    yield ('entry', entry)
+                yield ('result', result)
+                return
+
+            for line in _iter_lines(response):
+                try:
+                    message = json_decode_binary(json.loads(line))
+                except ValueError, e:
+                    raise JSONError(str(e))
+                if 'entry' in message:
+                    yield ('entry', message['entry'])
+                else:
+                    yield ('result', self.__handle_error(message))
+        finally:
+            self.__transport.close()
+
+    def __handle_response(self, response):
         try:
             response = json_decode_binary(json.loads(response))
         except ValueError, e:
             raise JSONError(str(e))
 
+        return self.__handle_error(response)
+
+    def __handle_error(self, response):
         error = response.get('error')
         if error:
             try:
@@ -957,3 +1139,45 @@ class jsonclient(RPCClient):
     server_proxy_class = JSONServerProxy
     protocol = 'json'
     env_rpc_uri_key = 'jsonrpc_uri'
+
+    def forward_stream(self, name, *args, **kw):
+        """
+        Forward call to the search command named ``name`` and return a
+        `ResultStream` which yields the entries as they are read from the
+        server response.
+        """
+        if name not in self.Command:
+            raise ValueError(
+                '%s.forward_stream(): %r not in api.Command' % (self.name, name)
+            )
+        server = getattr(context, 'request_url', None)
+        self.log.info("Streaming '%s' from %s server '%s'",
+                      name, self.protocol, server)
+        try:
+            messages = self.conn._stream_request(name, [args, kw])
+        except NSPRError, e:
+            raise NetworkError(uri=server, error=str(e))
+        except ProtocolError, e:
+            if getattr(context, 'session_cookie', None) and e.errcode == 401:
+                # Let forward() renew the session
+                return super(jsonclient, self).forward_stream(
+                    name, *args, **kw)
+            raise NetworkError(uri=server, error=e.errmsg)
+        except socket.error, e:
+            raise NetworkError(uri=server, error=str(e))
+
+        stream = ResultStream(None)
+
+        def pages():
+            try:
+                for (kind, value) in messages:
+                    if kind == 'entry':
+                        yield ([value], False)
+                    else:
+                        stream.summary = value.get('summary')
+                        yield ([], value['truncated'])
+            finally:
+                messages.close()
+
+        stream.pages = pages()
+        return stream
@@ -22,6 +22,7 @@ import errors
 import os
 import re
 import time
+import uuid
 from urllib2 import urlparse
 from text import _
 from ipapython.ipa_log_manager import *
@@ -277,6 +278,13 @@ session key before the RPC method begins execution. Thus session data
 can be read and written by any IPA component by accessing
 ``context.session``.
 
+The Kerberos credentials of the request are bound the same way. Each
+request gets its own ccache whose name is stored as
+``context.ccache_name``, and the language the client asked for is
+stored as ``context.languages``. The process environment (KRB5CCNAME,
+LANG) is not modified per request so a process may serve requests on
+several threads at once.
+
 When the RPC method finishes execution the session data bound to the
 request/method is retrieved from the context and written back to the
 memcached instance. The session ID is set in the response sent back to
@@ -1212,11 +1220,17 @@ krbccache_dir ='/var/run/ipa_memcached'
 krbccache_prefix = 'krbcc_'
 
 def _get_krbccache_pathname():
-    return os.path.join(krbccache_dir, '%s%s' % (krbccache_prefix, os.getpid()))
+    '''
+    Return a new ccache pathname. Every request gets its own ccache so
+    requests served concurrently by the threads of a process never share
+    credentials.
+    '''
+    return os.path.join(krbccache_dir, '%s%s_%s' % (
+        krbccache_prefix, os.getpid(), uuid.uuid4().hex))
 
 def get_ipa_ccache_name(scheme='FILE'):
     if scheme == 'FILE':
-        name = os.path.join(krbccache_dir, '%s%s' % (krbccache_prefix, os.getpid()))
+        name = _get_krbccache_pathname()
     else:
         raise ValueError('ccache scheme "%s" unsupported', scheme)
 
@@ -1239,34 +1253,25 @@ def bind_ipa_ccache(ccache_data, scheme='FILE'):
     if scheme == 'FILE':
         name = _get_krbccache_pathname()
         root_logger.debug('storing ccache data into file "%s"', name)
-        dst = open(name, 'w')
+        fd = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        dst = os.fdopen(fd, 'w')
         dst.write(ccache_data)
         dst.close()
     else:
         raise ValueError('ccache scheme "%s" unsupported', scheme)
 
     ccache_name = krb5_unparse_ccache(scheme, name)
-    os.environ['KRB5CCNAME'] = ccache_name
     return ccache_name
 
 def release_ipa_ccache(ccache_name):
     '''
-    Stop using the current request's ccache.
-      * Remove KRB5CCNAME from the enviroment
-      * Remove the ccache file from the file system
+    Stop using the current request's ccache by removing the ccache file
+    from the file system.
 
-    Note, we do not demand any of these elements exist, but if they
-    do we'll remove them.
+    Note, we do not demand the ccache exists, but if it does we'll
+    remove it.
     '''
 
-    if os.environ.has_key('KRB5CCNAME'):
-        if ccache_name != os.environ['KRB5CCNAME']:
-            root_logger.error('release_ipa_ccache: ccache_name (%s) != KRB5CCNAME environment variable (%s)',
-                              ccache_name, os.environ['KRB5CCNAME'])
-        del os.environ['KRB5CCNAME']
-    else:
-        root_logger.debug('release_ipa_ccache: KRB5CCNAME environment variable not set')
-
     scheme, name = krb5_parse_ccache(ccache_name)
     if scheme == 'FILE':
         if os.path.exists(name):
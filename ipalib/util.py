@@ -35,6 +35,7 @@ from dns.exception import DNSException
 
 from ipalib import errors
 from ipalib.text import _
+from ipalib.request import context
 from ipapython.ssh import SSHPublicKey
 from ipapython.dn import DN, RDN
 
@@ -59,7 +60,15 @@ def get_current_principal():
     try:
         # krbV isn't necessarily available on client machines, fail gracefully
         import krbV
-        return unicode(krbV.default_context().default_ccache().principal().name)
+        # Servers keep the ccache of the request in the context rather than
+        # in the process environment
+        ccache_name = getattr(context, 'ccache_name', None)
+        if ccache_name is not None:
+            ccache = krbV.CCache(name=str(ccache_name),
+                                 context=krbV.default_context())
+        else:
+            ccache = krbV.default_context().default_ccache()
+        return unicode(ccache.principal().name)
     except ImportError:
         raise RuntimeError('python-krbV is not available.')
     except krbV.Krb5Error:
@@ -338,10 +347,10 @@ def validate_sshpubkey_no_options(ugettext, value):
     if pubkey.has_options():
         return _('options are not allowed')
 
-def convert_sshpubkey_post(ldap, dn, entry_attrs):
+def convert_sshpubkey_post(ldap, dn, entry_attrs, pubkeys=None):
     if 'ipasshpubkey' in entry_attrs:
         pubkeys = entry_attrs['ipasshpubkey']
-    else:
+    elif pubkeys is None:
         old_entry_attrs = ldap.get_entry(dn, ['ipasshpubkey'])
         pubkeys = old_entry_attrs.get('ipasshpubkey')
     if not pubkeys:
@@ -369,6 +378,21 @@ def convert_sshpubkey_post(ldap, dn, entry_attrs):
     if fingerprints:
         entry_attrs['sshpubkeyfp'] = fingerprints
 
+def convert_sshpubkey_post_entries(ldap, entries):
+    """
+    Same as convert_sshpubkey_post for all of ``entries``, the public keys
+    which were not fetched with the entries are looked up together.
+    """
+    missing = [e.dn for e in entries if 'ipasshpubkey' not in e]
+    pubkeys = {}
+    if missing:
+        for e in ldap.find_entries_by_dn(
+                missing, '(ipasshpubkey=*)', ['ipasshpubkey']):
+            pubkeys[e.dn] = e['ipasshpubkey']
+    for entry_attrs in entries:
+        convert_sshpubkey_post(ldap, entry_attrs.dn, entry_attrs,
+                               pubkeys.get(entry_attrs.dn, ()))
+
 class cachedproperty(object):
     """
     A property-like attribute that caches the return value of a method call.
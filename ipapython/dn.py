@@ -474,12 +474,121 @@ of the same type to the constructor. For example:
 
 '''
 
-from ldap.dn import str2dn, dn2str
+from ldap.dn import str2dn, dn2str, escape_dn_chars
 from ldap import DECODING_ERROR
+import re
 import sys
 
 __all__ = ['AVA', 'EditableAVA', 'RDN', 'EditableRDN', 'DN', 'EditableDN']
 
+# Parsed form of recently parsed DN strings, shared by all the DN's created
+# from the same string (e.g. the base DN, container DN's and the values of
+# member attributes)
+_parsed_dn_cache = {}
+_parsed_dn_cache_size = 4096
+
+# Plain DN strings, without escapes, quoting, hex strings, whitespace
+# around separators or empty values, are parsed without str2dn
+_dn_plain_attr = r'(?:[A-Za-z][A-Za-z0-9-]*|[0-9]+(?:\.[0-9]+)*)'
+_dn_plain_value = (ur'[^ ,+=\\"#;<>\x00-\x1f]'
+                   ur'(?:[^,+=\\"#;<>\x00-\x1f]*[^ ,+=\\"#;<>\x00-\x1f])?')
+_dn_plain_ava = u'%s=%s' % (_dn_plain_attr, _dn_plain_value)
+_dn_plain_re = re.compile(
+    u'\\A%s(?:[,+]%s)*\\Z' % (_dn_plain_ava, _dn_plain_ava))
+# Values containing any of these characters are escaped by escape_dn_chars
+_dn_escape_re = re.compile(r'[\\,+"<>;=\x00]')
+
+def _ava_sort_key(ava):
+    return (ava[0].lower(), ava[1].lower())
+
+def _str2dn_plain(value):
+    '''
+    Parse the plain unicode DN string value.
+
+    Returns a (parsed, dn_str) tuple, see _str2dn, or None if value is not
+    a plain DN string.
+    '''
+    if _dn_plain_re.match(value) is None:
+        return None
+
+    dn_str = value.encode('utf-8')
+    rdns = []
+    for rdn_str in value.split(u','):
+        if u'+' in rdn_str:
+            avas = [tuple(ava_str.split(u'='))
+                    for ava_str in rdn_str.split(u'+')]
+            avas.sort(key=_ava_sort_key)
+            rdns.append(tuple(avas))
+            # AVA's are serialized in sorted order
+            dn_str = None
+        else:
+            rdns.append((tuple(rdn_str.split(u'=')),))
+    return (tuple(rdns), dn_str)
+
+def _str2dn(value):
+    '''
+    Parse the DN string value.
+
+    Returns a (parsed, dn_str) tuple. parsed is a tuple of RDN's, each RDN
+    being a tuple of (attr, value) unicode pairs sorted like the AVA's of
+    an RDN. dn_str is the string representation of the DN (as returned by
+    _dn2str) if it is known without further work, None otherwise.
+
+    Raises ValueError if value is not a valid DN.
+    '''
+    result = _parsed_dn_cache.get(value)
+    if result is not None:
+        return result
+
+    if isinstance(value, unicode):
+        result = _str2dn_plain(value)
+    else:
+        try:
+            result = _str2dn_plain(value.decode('ascii'))
+        except UnicodeDecodeError:
+            pass
+
+    if result is None:
+        try:
+            dn_list = str2dn(value.encode('utf-8'))
+        except DECODING_ERROR:
+            raise ValueError("malformed RDN string = \"%s\"" % value)
+        rdns = []
+        for rdn_list in dn_list:
+            avas = []
+            for (attr, val, flags) in rdn_list:
+                try:
+                    avas.append((attr.decode('utf-8'), val.decode('utf-8')))
+                except UnicodeDecodeError, e:
+                    raise ValueError('unable to convert "%s" to unicode: %s' %
+                                     (value, e))
+            if len(avas) > 1:
+                avas.sort(key=_ava_sort_key)
+            rdns.append(tuple(avas))
+        result = (tuple(rdns), None)
+
+    if len(_parsed_dn_cache) >= _parsed_dn_cache_size:
+        _parsed_dn_cache.clear()
+    _parsed_dn_cache[value] = result
+    return result
+
+def _dn2str(parsed):
+    '''
+    Return the string representation of a DN parsed by _str2dn, exactly as
+    dn2str would.
+    '''
+    rdn_strs = []
+    for rdn in parsed:
+        ava_strs = []
+        for (attr, value) in rdn:
+            value = value.encode('utf-8')
+            if (_dn_escape_re.search(value) is not None or
+                    value and (value[0] in '# ' or value[-1] == ' ')):
+                value = escape_dn_chars(value)
+            ava_strs.append('%s=%s' % (attr.encode('utf-8'), value))
+        rdn_strs.append('+'.join(ava_strs))
+    return ','.join(rdn_strs)
+
 def _adjust_indices(start, end, length):
     'helper to fixup start/end slice values'
 
@@ -553,6 +662,10 @@ class AVA(object):
     '''
     is_mutable = False
     flags = 0
+    # Cached by immutable objects on first use
+    _key = None
+    _str = None
+    _hash = None
 
     def __init__(self, *args, **kwds):
         if len(args) == 1:
@@ -632,8 +745,25 @@ class AVA(object):
     def _to_openldap(self):
         return [[(self._attr_unicode.encode('utf-8'), self._value_unicode.encode('utf-8'), self.flags)]]
 
+    def _get_key(self):
+        '''
+        Return the case folded (attr, value) tuple used for equality testing
+        and comparison. Immutable AVA's compute it only once.
+        '''
+        if self._key is not None:
+            return self._key
+
+        key = (self._attr_unicode.lower(), self._value_unicode.lower())
+        if not self.is_mutable:
+            self._key = key
+        return key
+
     def __str__(self):
-        return dn2str(self._to_openldap())
+        if self.is_mutable:
+            return dn2str(self._to_openldap())
+        if self._str is None:
+            self._str = dn2str(self._to_openldap())
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
@@ -654,7 +784,9 @@ class AVA(object):
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         '''
@@ -682,8 +814,7 @@ class AVA(object):
             return False
 
         # Perform comparison between objects of same type
-        return self._attr_unicode.lower() == other.attr.lower() and \
-            self._value_unicode.lower() == other.value.lower()
+        return self._get_key() == other._get_key()
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -694,11 +825,7 @@ class AVA(object):
         if not isinstance(other, AVA):
             raise TypeError("expected AVA but got %s" % (other.__class__.__name__))
 
-        result = cmp(self._attr_unicode.lower(), other.attr.lower())
-        if result != 0:
-            return result
-        result = cmp(self._value_unicode.lower(), other.value.lower())
-        return result
+        return cmp(self._get_key(), other._get_key())
 
 class EditableAVA(AVA):
     '''
@@ -827,6 +954,10 @@ class RDN(object):
 
     is_mutable = False
     flags = 0
+    # Cached by immutable objects on first use
+    _key = None
+    _str = None
+    _hash = None
     AVA_type = AVA
 
     def __init__(self, *args, **kwds):
@@ -835,11 +966,14 @@ class RDN(object):
 
     def _ava_from_value(self, value):
         if isinstance(value, AVA):
+            # Immutable AVA's can be shared instead of copied
+            if value.__class__ is self.AVA_type and not value.is_mutable:
+                return value
             return self.AVA_type(value.attr, value.value)
         elif isinstance(value, RDN):
             avas = []
             for ava in value.avas:
-                avas.append(self.AVA_type(ava.attr, ava.value))
+                avas.append(self._ava_from_value(ava))
             if len(avas) == 1:
                 return avas[0]
             else:
@@ -882,8 +1016,25 @@ class RDN(object):
     def _to_openldap(self):
         return [[(ava.attr.encode('utf-8'), ava.value.encode('utf-8'), self.flags) for ava in self.avas]]
 
+    def _get_key(self):
+        '''
+        Return the tuple of AVA keys used for equality testing and
+        comparison. Immutable RDN's compute it only once.
+        '''
+        if self._key is not None:
+            return self._key
+
+        key = tuple([ava._get_key() for ava in self.avas])
+        if not self.is_mutable:
+            self._key = key
+        return key
+
     def __str__(self):
-        return dn2str(self._to_openldap())
+        if self.is_mutable:
+            return dn2str(self._to_openldap())
+        if self._str is None:
+            self._str = dn2str(self._to_openldap())
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
@@ -943,7 +1094,9 @@ class RDN(object):
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         # Try coercing string to RDN, if successful compare to coerced object
@@ -959,7 +1112,7 @@ class RDN(object):
             return False
 
         # Perform comparison between objects of same type
-        return self.avas == other.avas
+        return self._get_key() == other._get_key()
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -971,21 +1124,15 @@ class RDN(object):
         result = cmp(len(self), len(other))
         if result != 0:
             return result
-        i = 0
-        while i < len(self):
-            result = cmp(self[i], other[i])
-            if result != 0:
-                return result
-            i += 1
-        return 0
+        return cmp(self._get_key(), other._get_key())
 
     def __add__(self, other):
         result = self.__class__(self)
         if isinstance(other, RDN):
             for ava in other.avas:
-                result.avas.append(self.AVA_type(ava.attr, ava.value))
+                result.avas.append(self._ava_from_value(ava))
         elif isinstance(other, AVA):
-            result.avas.append(self.AVA_type(other.attr, other.value))
+            result.avas.append(self._ava_from_value(other))
         elif isinstance(other, basestring):
             rdn = self.__class__(other)
             for ava in rdn.avas:
@@ -1214,35 +1361,53 @@ class DN(object):
 
     is_mutable = False
     flags = 0
+    # Cached by immutable objects on first use
+    _key = None
+    _str = None
+    _hash = None
+    # Immutable DN's created from a string keep the string parsed by
+    # _str2dn and create their RDN's only when they are first accessed.
+    # _parsed is never reset once set, DN's like api.env.basedn are
+    # shared between threads which may have just checked it.
+    _parsed = None
     AVA_type = AVA
     RDN_type = RDN
 
     def __init__(self, *args, **kwds):
+        if not self.is_mutable and len(args) == 1:
+            arg = args[0]
+            if isinstance(arg, basestring):
+                (self._parsed, self._str) = _str2dn(arg)
+                return
+            if isinstance(arg, DN) and arg._parsed is not None:
+                self._parsed = arg._parsed
+                self._str = arg._str
+                return
         self.rdns = self._rdns_from_sequence(args)
 
+    def __getattr__(self, name):
+        if name == 'rdns' and self._parsed is not None:
+            self.rdns = [self.RDN_type(*rdn) for rdn in self._parsed]
+            return self.rdns
+        raise AttributeError("'%s' object has no attribute '%s'" %
+                             (self.__class__.__name__, name))
+
     def _rdn_from_value(self, value):
         if isinstance(value, RDN):
+            # Immutable RDN's can be shared instead of copied
+            if value.__class__ is self.RDN_type and not value.is_mutable:
+                return value
             return self.RDN_type(value)
         elif isinstance(value, DN):
             rdns = []
             for rdn in value.rdns:
-                rdns.append(self.RDN_type(rdn))
+                rdns.append(self._rdn_from_value(rdn))
             if len(rdns) == 1:
                 return rdns[0]
             else:
                 return rdns
         elif isinstance(value, basestring):
-            rdns = []
-            try:
-                dn_list = str2dn(value.encode('utf-8'))
-                for rdn_list in dn_list:
-                    avas = []
-                    for ava_tuple in rdn_list:
-                        avas.append(self.AVA_type(ava_tuple[0], ava_tuple[1]))
-                    rdn = self.RDN_type(*avas)
-                    rdns.append(rdn)
-            except DECODING_ERROR:
-                raise ValueError("malformed RDN string = \"%s\"" % value)
+            rdns = [self.RDN_type(*rdn) for rdn in _str2dn(value)[0]]
             if len(rdns) == 1:
                 return rdns[0]
             else:
@@ -1270,8 +1435,35 @@ class DN(object):
     def _to_openldap(self):
         return [[(ava.attr.encode('utf-8'), ava.value.encode('utf-8'), self.flags) for ava in rdn] for rdn in self.rdns]
 
+    def _get_key(self):
+        '''
+        Return the tuple of RDN keys used for equality testing and
+        comparison. Immutable DN's compute it only once.
+        '''
+        if self._key is not None:
+            return self._key
+
+        if self._parsed is not None:
+            key = tuple([tuple([(attr.lower(), value.lower())
+                                for (attr, value) in rdn])
+                         for rdn in self._parsed])
+        else:
+            key = tuple([rdn._get_key() for rdn in self.rdns])
+        if not self.is_mutable:
+            self._key = key
+        return key
+
     def __str__(self):
-        return dn2str(self._to_openldap())
+        if self.is_mutable:
+            return dn2str(self._to_openldap())
+        if self._str is None:
+            if self._parsed is not None:
+                self._str = _dn2str(self._parsed)
+            else:
+                # The RDN's cache their own string, RDN's shared with
+                # other DN's (e.g. the base DN) are serialized only once
+                self._str = ','.join([str(rdn) for rdn in self.rdns])
+        return self._str
 
     def __repr__(self):
         return "%s.%s('%s')" % (self.__module__, self.__class__.__name__, self.__str__())
@@ -1284,6 +1476,8 @@ class DN(object):
         return self._next()
 
     def __len__(self):
+        if self._parsed is not None:
+            return len(self._parsed)
         return len(self.rdns)
 
     def __getitem__(self, key):
@@ -1305,7 +1499,9 @@ class DN(object):
         # hash value between two objects which compare as equal but
         # differ in case must yield the same hash value.
 
-        return hash(str(self).lower())
+        if self._hash is None:
+            self._hash = hash(str(self).lower())
+        return self._hash
 
     def __eq__(self, other):
         # Try coercing string to DN, if successful compare to coerced object
@@ -1321,7 +1517,7 @@ class DN(object):
             return False
 
         # Perform comparison between objects of same type
-        return self.rdns == other.rdns
+        return self._get_key() == other._get_key()
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -1336,6 +1532,21 @@ class DN(object):
         return self._cmp_sequence(other, 0, len(self))
 
     def _cmp_sequence(self, pattern, self_start, pat_len):
+        if not self.is_mutable and not pattern.is_mutable:
+            # Compare the cached keys, same ordering as RDN.__cmp__
+            self_key = self._get_key()
+            pat_key = pattern._get_key()
+            for pat_idx in xrange(pat_len):
+                self_rdn = self_key[self_start + pat_idx]
+                pat_rdn = pat_key[pat_idx]
+                result = cmp(len(self_rdn), len(pat_rdn))
+                if result != 0:
+                    return result
+                result = cmp(self_rdn, pat_rdn)
+                if result != 0:
+                    return result
+            return 0
+
         self_idx = self_start
         pat_idx = 0
         while pat_idx < pat_len:
@@ -1347,20 +1558,18 @@ class DN(object):
         return 0
 
     def __add__(self, other):
-        result = self.__class__(self)
         if isinstance(other, DN):
-            for rdn in other.rdns:
-                result.rdns.append(self.RDN_type(rdn))
+            rdns = other.rdns
         elif isinstance(other, RDN):
-            result.rdns.append(self.RDN_type(other))
+            rdns = [other]
         elif isinstance(other, basestring):
-            dn = self.__class__(other)
-            for rdn in dn.rdns:
-                result.rdns.append(rdn)
+            rdns = self.__class__(other).rdns
         else:
             raise TypeError("expected DN, RDN or basestring but got %s" % (other.__class__.__name__))
 
-        return result
+        # Immutable DN's cache their string and key, build the result
+        # from all of its RDN's rather than modifying a copy
+        return self.__class__(*(self.rdns + rdns))
 
     # The implementation of startswith, endswith, tailmatch, adjust_indices
     # was based on the Python's stringobject.c implementation
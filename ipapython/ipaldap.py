@@ -19,13 +19,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import os
 import string
 import time
 import shutil
+import tempfile
+import hashlib
+import cPickle
 from decimal import Decimal
 from copy import deepcopy
 import contextlib
 import collections
+import weakref
 
 import ldap
 import ldap.sasl
@@ -50,6 +55,15 @@ _debug_log_ldap = False
 
 _missing = object()
 
+# Syntax properties of an attribute type, see
+# IPASimpleLDAPObject._compile_attribute_table
+_AttributeInfo = collections.namedtuple(
+    '_AttributeInfo',
+    ['syntax', 'dn_syntax', 'single_value', 'decoder', 'names'])
+
+# Compiled attribute tables of the schemas in use
+_attribute_tables = weakref.WeakKeyDictionary()
+
 
 def unicode_from_utf8(val):
     '''
@@ -101,11 +115,19 @@ class _ServerSchema(object):
 class SchemaCache(object):
     '''
     Cache the schema's from individual LDAP servers.
+
+    If cache_dir is set, parsed schemas are also stored there so that
+    other processes can reuse them. A stored schema is used only as long
+    as the modifyTimestamp and nsSchemaCSN of the server's schema entry
+    do not change.
     '''
 
-    def __init__(self):
+    schema_stamp_attrs = ('modifytimestamp', 'nsschemacsn')
+
+    def __init__(self, cache_dir=None):
         self.log = log_mgr.get_logger(self)
         self.servers = {}
+        self.cache_dir = cache_dir
 
     def get_schema(self, url, conn, force_update=False):
         '''
@@ -122,7 +144,12 @@ class SchemaCache(object):
 
         server_schema = self.servers.get(url)
         if server_schema is None:
-            schema = self._retrieve_schema_from_server(url, conn)
+            schema = None
+            if not force_update:
+                schema = self._load_schema(url, conn)
+            if schema is None:
+                schema, stamp = self._retrieve_schema_from_server(url, conn)
+                self._store_schema(url, stamp, schema)
             server_schema = _ServerSchema(url, schema)
             self.servers[url] = server_schema
         return server_schema.schema
@@ -134,11 +161,84 @@ class SchemaCache(object):
         except KeyError:
             pass
 
+    def _get_schema_file(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url).hexdigest())
+
+    def _get_schema_stamp(self, schema_attrs):
+        """
+        Return the values identifying the version of a schema entry, None
+        if the server does not provide them.
+        """
+        schema_attrs = dict((k.lower(), v) for k, v in schema_attrs.items())
+        stamp = tuple(tuple(schema_attrs.get(attr, ()))
+                      for attr in self.schema_stamp_attrs)
+        if not any(stamp):
+            return None
+        return stamp
+
+    def _load_schema(self, url, conn):
+        """
+        Return the schema stored in cache_dir if it is still current, None
+        otherwise.
+        """
+        if not self.cache_dir:
+            return None
+
+        path = self._get_schema_file(url)
+        try:
+            with open(path, 'rb') as f:
+                # Only trust files written by ourselves
+                if os.fstat(f.fileno()).st_uid != os.geteuid():
+                    return None
+                (stored_url, stored_stamp, schema) = cPickle.load(f)
+        except IOError:
+            return None
+        except Exception, e:
+            self.log.debug('cannot load schema from %s: %s', path, e)
+            return None
+        if stored_url != url:
+            return None
+
+        try:
+            schema_entry = conn.search_s(
+                'cn=schema', ldap.SCOPE_BASE,
+                attrlist=list(self.schema_stamp_attrs))[0]
+        except (ldap.LDAPError, IndexError), e:
+            self.log.debug('cannot check schema of %s: %s', url, e)
+            return None
+        if self._get_schema_stamp(schema_entry[1]) != stored_stamp:
+            self.log.debug('schema of %s changed, discarding %s', url, path)
+            return None
+
+        self.log.debug('using schema of %s stored in %s', url, path)
+        return schema
+
+    def _store_schema(self, url, stamp, schema):
+        if not self.cache_dir or stamp is None:
+            return
+
+        path = self._get_schema_file(url)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    cPickle.dump((url, stamp, schema), f,
+                                 cPickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except Exception, e:
+            self.log.debug('cannot store schema of %s in %s: %s',
+                           url, path, e)
+
     def _retrieve_schema_from_server(self, url, conn):
         """
         Retrieve the LDAP schema from the provided url and determine if
         User-Private Groups (upg) are configured.
 
+        Returns a (schema, stamp) tuple, see _get_schema_stamp.
+
         Bind using kerberos credentials. If in the context of the
         in-tree "lite" server then use the current ccache. If in the context of
         Apache then create a new ccache and bind using the Apache HTTP service
@@ -153,16 +253,18 @@ class SchemaCache(object):
         self.log.debug(
             'retrieving schema for SchemaCache url=%s conn=%s', url, conn)
 
+        attrlist = ['attributetypes', 'objectclasses']
+        attrlist.extend(self.schema_stamp_attrs)
         try:
             try:
                 schema_entry = conn.search_s('cn=schema', ldap.SCOPE_BASE,
-                    attrlist=['attributetypes', 'objectclasses'])[0]
+                    attrlist=attrlist)[0]
             except ldap.NO_SUCH_OBJECT:
                 # try different location for schema
                 # openldap has schema located in cn=subschema
                 self.log.debug('cn=schema not found, fallback to cn=subschema')
                 schema_entry = conn.search_s('cn=subschema', ldap.SCOPE_BASE,
-                    attrlist=['attributetypes', 'objectclasses'])[0]
+                    attrlist=attrlist)[0]
         except ldap.SERVER_DOWN:
             raise errors.NetworkError(uri=url,
                                error=u'LDAP Server Down, unable to retrieve LDAP schema')
@@ -180,7 +282,8 @@ class SchemaCache(object):
             if tmpdir:
                 shutil.rmtree(tmpdir)
 
-        return ldap.schema.SubSchema(schema_entry[1])
+        return (ldap.schema.SubSchema(schema_entry[1]),
+                self._get_schema_stamp(schema_entry[1]))
 
 schema_cache = SchemaCache()
 
@@ -289,6 +392,7 @@ class IPASimpleLDAPObject(object):
         self._schema = None
         self._force_schema_updates = force_schema_updates
         self._decode_attrs = decode_attrs
+        self._attribute_table = None
 
     def _get_schema(self):
         if self._no_schema:
@@ -333,24 +437,87 @@ class IPASimpleLDAPObject(object):
 
         self._has_schema = False
         self._schema = None
+        self._attribute_table = None
 
-    def get_syntax(self, attr):
-        if isinstance(attr, unicode):
-            attr = attr.encode('utf-8')
-
-        # Is this a special case attribute?
-        if attr in self._SYNTAX_OVERRIDE:
-            return self._SYNTAX_OVERRIDE[attr]
+    @classmethod
+    def _compile_attribute_table(cls, schema):
+        """
+        Return a dict mapping the lowercase names and OIDs of all attribute
+        types in schema to their _AttributeInfo.
+        """
+        table = {}
+
+        if schema is not None:
+            for oid in schema.listall(ldap.schema.AttributeType):
+                obj = schema.get_obj(ldap.schema.AttributeType, oid)
+                if obj is None:
+                    continue
+                info = _AttributeInfo(
+                    obj.syntax,
+                    obj.syntax == DN_SYNTAX_OID,
+                    obj.single_value,
+                    cls._SYNTAX_MAPPING.get(obj.syntax, unicode_from_utf8),
+                    tuple(name.decode('utf-8') for name in obj.names))
+                table[oid.lower()] = info
+                for name in obj.names:
+                    table[name.lower()] = info
+
+        # Apply the special case attributes
+        for attr, syntax in cls._SYNTAX_OVERRIDE.iteritems():
+            attr = attr.lower()
+            info = table.get(
+                attr, _AttributeInfo(None, False, None, None, ()))
+            table[attr] = info._replace(
+                syntax=syntax,
+                dn_syntax=syntax == DN_SYNTAX_OID,
+                decoder=cls._SYNTAX_MAPPING.get(syntax, unicode_from_utf8))
+        for attr, single_value in cls._SINGLE_VALUE_OVERRIDE.iteritems():
+            attr = attr.lower()
+            info = table.get(
+                attr, _AttributeInfo(None, False, None, unicode_from_utf8, ()))
+            table[attr] = info._replace(single_value=single_value)
+
+        return table
+
+    def _get_attribute_table(self):
+        table = self._attribute_table
+        if table is None:
+            schema = self.schema
+            if schema is None:
+                table = self._compile_attribute_table(None)
+            else:
+                table = _attribute_tables.get(schema)
+                if table is None:
+                    table = self._compile_attribute_table(schema)
+                    _attribute_tables[schema] = table
+            self._attribute_table = table
+        return table
 
-        if self.schema is None:
-            return None
+    _unknown_attribute = _AttributeInfo(
+        None, False, None, unicode_from_utf8, ())
 
-        # Try to lookup the syntax in the schema returned by the server
-        obj = self.schema.get_obj(ldap.schema.AttributeType, attr)
-        if obj is None:
-            return None
+    def get_attribute_info(self, attr):
+        """
+        Return the _AttributeInfo of an attribute.
+        """
+        table = self._get_attribute_table()
+        try:
+            return table[attr]
+        except KeyError:
+            pass
+        if isinstance(attr, unicode):
+            key = attr.encode('utf-8')
+        else:
+            key = attr
+        # Strip attribute options, as the schema does
+        key = key.split(';', 1)[0].strip().lower()
+        info = table.get(key, self._unknown_attribute)
+        # Remember the name as spelled by the caller for the next lookup
+        table[attr] = info
+        return info
 
-        return obj.syntax
+    def get_syntax(self, attr):
+        return self.get_attribute_info(attr).syntax
 
     def has_dn_syntax(self, attr):
         """
@@ -358,8 +525,7 @@ class IPASimpleLDAPObject(object):
 
         Returns True/False
         """
-        syntax = self.get_syntax(attr)
-        return syntax == DN_SYNTAX_OID
+        return self.get_attribute_info(attr).dn_syntax
 
     def get_single_value(self, attr):
         """
@@ -370,20 +536,7 @@ class IPASimpleLDAPObject(object):
         If there is a problem loading the schema or the attribute is
         not in the schema return None
         """
-        if isinstance(attr, unicode):
-            attr = attr.encode('utf-8')
-
-        if attr in self._SINGLE_VALUE_OVERRIDE:
-            return self._SINGLE_VALUE_OVERRIDE[attr]
-
-        if self.schema is None:
-            return None
-
-        obj = self.schema.get_obj(ldap.schema.AttributeType, attr)
-        if obj is None:
-            return None
-
-        return obj.single_value
+        return self.get_attribute_info(attr).single_value
 
 
     def encode(self, val):
@@ -418,10 +571,22 @@ class IPASimpleLDAPObject(object):
         """
         Decode attribute value from LDAP representation (str).
         """
+        if isinstance(val, (str, list, tuple)):
+            if self._decode_attrs:
+                target_type = self.get_attribute_info(attr).decoder
+            else:
+                target_type = str
+            return self._decode_value(val, attr, target_type)
+        elif isinstance(val, dict):
+            dct = dict((unicode_from_utf8(k), self.decode(v, k)) for k, v in val.iteritems())
+            return dct
+        elif val is None:
+            return None
+        else:
+            raise TypeError("attempt to pass unsupported type from ldap, value=%s type=%s" %(val, type(val)))
+
+    def _decode_value(self, val, attr, target_type):
         if isinstance(val, str):
-            if not self._decode_attrs:
-                return val
-            target_type = self._SYNTAX_MAPPING.get(self.get_syntax(attr), unicode_from_utf8)
             if target_type is str:
                 return val
             try:
@@ -431,16 +596,11 @@ class IPASimpleLDAPObject(object):
                 self.log.error(msg)
                 raise ValueError(msg)
         elif isinstance(val, list):
-            return [self.decode(m, attr) for m in val]
+            return [self._decode_value(m, attr, target_type) for m in val]
         elif isinstance(val, tuple):
-            return tuple(self.decode(m, attr) for m in val)
-        elif isinstance(val, dict):
-            dct = dict((unicode_from_utf8(k), self.decode(v, k)) for k, v in val.iteritems())
-            return dct
-        elif val is None:
-            return None
+            return tuple(self._decode_value(m, attr, target_type) for m in val)
         else:
-            raise TypeError("attempt to pass unsupported type from ldap, value=%s type=%s" %(val, type(val)))
+            return self.decode(val, attr)
 
     def convert_result(self, result):
         '''
@@ -823,13 +983,8 @@ class LDAPEntry(collections.MutableMapping):
                 if oldname in self._orig:
                     self._orig[name] = self._orig.pop(oldname)
         else:
-            if self._conn.schema is not None:
-                attrtype = self._conn.schema.get_obj(ldap.schema.AttributeType,
-                    name.encode('utf-8'))
-                if attrtype is not None:
-                    for altname in attrtype.names:
-                        altname = altname.decode('utf-8')
-                        self._names[altname] = name
+            for altname in self._conn.get_attribute_info(name).names:
+                self._names[altname] = name
 
             self._names[name] = name
 
@@ -970,7 +1125,9 @@ class LDAPEntry(collections.MutableMapping):
         if other is None:
             other = self
         assert isinstance(other, LDAPEntry)
-        self._orig = deepcopy(dict(other.raw))
+        # Raw values are lists of str, copying the lists is enough
+        self._orig = dict((name, list(value))
+                          for (name, value) in other.raw.iteritems())
 
     def generate_modlist(self):
         modlist = []
@@ -1404,6 +1561,57 @@ class LDAPClient(object):
             raise errors.LimitsExceeded()
         return entries
 
+    # Maximum number of entries looked up by a single search in
+    # find_entries_by_dn()
+    find_entries_by_dn_chunk = 100
+
+    def find_entries_by_dn(self, dns, filter=None, attrs_list=None):
+        """Return the entries from ``dns`` which match ``filter``.
+
+        The entries are looked up with one search per parent DN and per
+        ``find_entries_by_dn_chunk`` entries, rather than with one search
+        per entry. Entries which do not exist or do not match the filter
+        are not returned. Raises an error if a search is truncated by the
+        server.
+
+        :param dns: DNs of the entries to look up
+        :param filter: LDAP filter the entries must match
+        :param attrs_list: list of attributes to return, all if None
+        """
+        children = {}
+        for dn in dns:
+            assert isinstance(dn, DN)
+            children.setdefault(DN(*dn[1:]), []).append(dn)
+
+        entries = []
+        for (parent_dn, child_dns) in children.iteritems():
+            wanted = set(child_dns)
+            for i in xrange(0, len(child_dns), self.find_entries_by_dn_chunk):
+                chunk = child_dns[i:i + self.find_entries_by_dn_chunk]
+                rdn_filters = []
+                for dn in chunk:
+                    rdn_filters.append(self.combine_filters(
+                        [self.make_filter_from_attr(ava.attr, ava.value)
+                         for ava in dn[0]],
+                        self.MATCH_ALL))
+                chunk_filter = self.combine_filters(
+                    (filter, self.combine_filters(rdn_filters,
+                                                  self.MATCH_ANY)),
+                    self.MATCH_ALL)
+                # The RDN values can also match other entries with
+                # multi-valued attributes, so the search is not limited to
+                # the size of the chunk
+                try:
+                    (result, truncated) = self.find_entries(
+                        chunk_filter, attrs_list, parent_dn,
+                        self.SCOPE_ONELEVEL, size_limit=0)
+                except errors.NotFound:
+                    continue
+                if truncated:
+                    raise errors.LimitsExceeded()
+                entries.extend(e for e in result if e.dn in wanted)
+        return entries
+
     def find_entries(self, filter=None, attrs_list=None, base_dn=None,
                      scope=ldap.SCOPE_SUBTREE, time_limit=None,
                      size_limit=None, search_refs=False, paged_search=False):
@@ -1424,13 +1632,44 @@ class LDAPClient(object):
             (default skips these entries)
         paged_search -- search using paged results control
         """
+        res = []
+        truncated = False
+
+        for (page, truncated) in self._search_pages(
+                filter, attrs_list, base_dn, scope, time_limit, size_limit,
+                search_refs, paged_search):
+            res.extend(page)
+
+        if not res and not truncated:
+            raise errors.NotFound(reason='no such entry')
+
+        return (res, truncated)
+
+    def find_entries_paged(self, filter=None, attrs_list=None, base_dn=None,
+                           scope=ldap.SCOPE_SUBTREE, time_limit=None,
+                           size_limit=None, search_refs=False):
+        """
+        Generator version of find_entries.
+
+        The search is always done using the paged results control and a
+        (entries, truncated) tuple is yielded for every page of results, so
+        the entries do not need to be kept in memory all at once. truncated
+        can only be True for the last page. Unlike find_entries, NotFound is
+        not raised when nothing matches.
+
+        See find_entries for the description of the arguments.
+        """
+        return self._search_pages(
+            filter, attrs_list, base_dn, scope, time_limit, size_limit,
+            search_refs, True)
+
+    def _search_pages(self, filter, attrs_list, base_dn, scope, time_limit,
+                      size_limit, search_refs, paged_search):
         if base_dn is None:
             base_dn = DN()
         assert isinstance(base_dn, DN)
         if not filter:
             filter = '(objectClass=*)'
-        res = []
-        truncated = False
 
         if time_limit is None or time_limit == 0:
             time_limit = -1.0
@@ -1451,8 +1690,11 @@ class LDAPClient(object):
             paged_search = False
 
         # pass arguments to python-ldap
-        with self.error_handler():
-            while True:
+        while True:
+            res = []
+            truncated = False
+
+            with self.error_handler():
                 if paged_search:
                     sctrls = [SimplePagedResultsControl(0, page_size, cookie)]
 
@@ -1483,15 +1725,9 @@ class LDAPClient(object):
                 except ldap.LDAPError, e:
                     # If paged search is in progress, try to cancel it
                     if paged_search and cookie:
-                        sctrls = [SimplePagedResultsControl(0, 0, cookie)]
-                        try:
-                            self.conn.search_ext_s(
-                                base_dn, scope, filter, attrs_list,
-                                serverctrls=sctrls, timeout=time_limit,
-                                sizelimit=size_limit)
-                        except ldap.LDAPError, e:
-                            self.log.warning(
-                                "Error cancelling paged search: %s", e)
+                        self._cancel_paged_search(
+                            base_dn, scope, filter, attrs_list, time_limit,
+                            size_limit, cookie)
                         cookie = ''
 
                     try:
@@ -1499,15 +1735,32 @@ class LDAPClient(object):
                     except (ldap.ADMINLIMIT_EXCEEDED, ldap.TIMELIMIT_EXCEEDED,
                             ldap.SIZELIMIT_EXCEEDED):
                         truncated = True
-                        break
 
-                if not paged_search or not cookie:
-                    break
+            try:
+                yield (res, truncated)
+            except GeneratorExit:
+                # The consumer is not interested in the remaining pages
+                if paged_search and cookie:
+                    with self.error_handler():
+                        self._cancel_paged_search(
+                            base_dn, scope, filter, attrs_list, time_limit,
+                            size_limit, cookie)
+                raise
 
-        if not res and not truncated:
-            raise errors.NotFound(reason='no such entry')
+            if truncated or not paged_search or not cookie:
+                break
 
-        return (res, truncated)
+    def _cancel_paged_search(self, base_dn, scope, filter, attrs_list,
+                             time_limit, size_limit, cookie):
+        sctrls = [SimplePagedResultsControl(0, 0, cookie)]
+        try:
+            self.conn.search_ext_s(
+                base_dn, scope, filter, attrs_list,
+                serverctrls=sctrls, timeout=time_limit,
+                sizelimit=size_limit)
+        except ldap.LDAPError, e:
+            self.log.warning(
+                "Error cancelling paged search: %s", e)
 
     def find_entry_by_attr(self, attr, value, object_class, attrs_list=None,
                            base_dn=None):
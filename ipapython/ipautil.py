@@ -41,6 +41,8 @@ import xmlrpclib
 import datetime
 import netaddr
 import time
+import threading
+from contextlib import contextmanager
 import krbV
 import pwd
 from dns import resolver, rdatatype
@@ -1194,6 +1196,32 @@ def kinit_hostprincipal(keytab, ccachedir, principal):
     except krbV.Krb5Error, e:
         raise StandardError('Error initializing principal %s in %s: %s' % (principal, keytab, str(e)))
 
+# KRB5CCNAME is shared by all threads of the process, see krb5ccname()
+krb5ccname_lock = threading.RLock()
+
+@contextmanager
+def krb5ccname(ccache):
+    """
+    Make ccache the default Kerberos credential cache within a block.
+
+    Some libraries, such as the Cyrus SASL GSSAPI plugin used for LDAP
+    binds, only ever use the default ccache named by the KRB5CCNAME
+    environment variable. The variable is set while holding
+    krb5ccname_lock so a thread never acquires credentials from the ccache
+    of a request served by another thread. The previous value is restored
+    when the block is left.
+    """
+    with krb5ccname_lock:
+        original_value = os.environ.get('KRB5CCNAME')
+        os.environ['KRB5CCNAME'] = str(ccache)
+        try:
+            yield
+        finally:
+            if original_value is not None:
+                os.environ['KRB5CCNAME'] = original_value
+            else:
+                os.environ.pop('KRB5CCNAME', None)
+
 def dn_attribute_property(private_name):
     '''
     Create a property for a dn attribute which assures the attribute
@@ -36,6 +36,7 @@ from ipalib.util import normalize_name
 
 import os, string, struct, copy
 import uuid
+from contextlib import contextmanager
 from samba import param
 from samba import credentials
 from samba.dcerpc import security, lsa, drsblobs, nbt, netlogon
@@ -51,6 +52,7 @@ except ImportError:
 import ldap as _ldap
 from ipapython.ipaldap import IPAdmin
 from ipalib.session import krbccache_dir, krbccache_prefix
+from ipalib.request import context
 from dns import resolver, rdatatype
 from dns.exception import DNSException
 import pysss_nss_idmap
@@ -107,6 +109,23 @@ def assess_dcerpc_exception(num=None,message=None):
                   message "%(message)s" (both may be "None")''') % dict(num=num, message=message)
     return errors.RemoteRetrieveError(reason=reason)
 
+@contextmanager
+def request_ccache():
+    """
+    Make the ccache of the request served by this thread the default one
+    within a block.
+
+    Samba credentials which must use Kerberos find their ccache through
+    KRB5CCNAME when they are guessed, and the request ccache is only kept
+    in the context.
+    """
+    ccache_name = getattr(context, 'ccache_name', None)
+    if ccache_name is None:
+        yield
+        return
+    with ipautil.krb5ccname(ccache_name):
+        yield
+
 class ExtendedDNControl(LDAPControl):
     # This class attempts to implement LDAP control that would work
     # with both python-ldap 2.4.x and 2.3.x, thus there is mix of properties
@@ -459,7 +478,7 @@ class DomainValidator(object):
         Initializes ccache with http service credentials.
 
         Applies session code defaults for ccache directory and naming prefix.
-        Session code uses krbccache_prefix+<pid>, we use
+        Session code uses krbccache_prefix+<pid>_<uuid>, we use
         krbccache_prefix+<TD>+<domain netbios name> so there is no clash.
 
         Returns tuple (ccache path, principal) where (None, None) signifes an
@@ -573,22 +592,23 @@ class DomainValidator(object):
         if domain in self._info:
             return self._info[domain]
 
-        if not self._creds:
-            self._parm = param.LoadParm()
-            self._parm.load(os.path.join(ipautil.SHARE_DIR,"smb.conf.empty"))
-            self._parm.set('netbios name', self.flatname)
-            self._creds = credentials.Credentials()
-            self._creds.set_kerberos_state(credentials.MUST_USE_KERBEROS)
-            self._creds.guess(self._parm)
-            self._creds.set_workstation(self.flatname)
-
-        netrc = net.Net(creds=self._creds, lp=self._parm)
-        finddc_error = None
-        result = None
-        try:
-            result = netrc.finddc(domain=domain, flags=nbt.NBT_SERVER_LDAP | nbt.NBT_SERVER_GC | nbt.NBT_SERVER_CLOSEST)
-        except RuntimeError, e:
-            finddc_error = e
+        with request_ccache():
+            if not self._creds:
+                self._parm = param.LoadParm()
+                self._parm.load(os.path.join(ipautil.SHARE_DIR,"smb.conf.empty"))
+                self._parm.set('netbios name', self.flatname)
+                self._creds = credentials.Credentials()
+                self._creds.set_kerberos_state(credentials.MUST_USE_KERBEROS)
+                self._creds.guess(self._parm)
+                self._creds.set_workstation(self.flatname)
+
+            netrc = net.Net(creds=self._creds, lp=self._parm)
+            finddc_error = None
+            result = None
+            try:
+                result = netrc.finddc(domain=domain, flags=nbt.NBT_SERVER_LDAP | nbt.NBT_SERVER_GC | nbt.NBT_SERVER_CLOSEST)
+            except RuntimeError, e:
+                finddc_error = e
 
         if not self._domains:
             self._domains = self.get_trusted_domains()
@@ -1046,9 +1066,10 @@ class TrustDomainJoins(object):
         ld = TrustDomainInstance(self.local_flatname)
         ld.creds = credentials.Credentials()
         ld.creds.set_kerberos_state(credentials.MUST_USE_KERBEROS)
-        ld.creds.guess(ld.parm)
-        ld.creds.set_workstation(ld.hostname)
-        ld.retrieve(installutils.get_fqdn())
+        with request_ccache():
+            ld.creds.guess(ld.parm)
+            ld.creds.set_workstation(ld.hostname)
+            ld.retrieve(installutils.get_fqdn())
         self.local_domain = ld
 
     def populate_remote_domain(self, realm, realm_server=None, realm_admin=None, realm_passwd=None):
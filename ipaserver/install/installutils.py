@@ -798,18 +798,10 @@ def private_ccache(path=None):
         (desc, path) = tempfile.mkstemp(prefix='krbcc')
         os.close(desc)
 
-    original_value = os.environ.get('KRB5CCNAME', None)
-
-    os.environ['KRB5CCNAME'] = path
-
     try:
-        yield
+        with ipautil.krb5ccname(path):
+            yield
     finally:
-        if original_value is not None:
-            os.environ['KRB5CCNAME'] = original_value
-        else:
-            os.environ.pop('KRB5CCNAME')
-
         if os.path.exists(path):
             os.remove(path)
 
@@ -23,20 +23,27 @@ import shutil
 import tempfile
 import time
 import pwd
+import signal
+import hashlib
+import tarfile
+import subprocess
 from optparse import OptionGroup
-from ConfigParser import SafeConfigParser
+from ConfigParser import SafeConfigParser, Error as ConfigParserError
+
+import ldif
 
 from ipalib import api, errors
 from ipapython import version
 from ipapython.ipautil import run, write_tmp_file
 from ipapython import admintool
 from ipapython.config import IPAOptionParser
-from ipapython.dn import DN
+from ipapython.dn import DN, RDN
 from ipaserver.install.dsinstance import realm_to_serverid, DS_USER
 from ipaserver.install.replication import wait_for_task
 from ipaserver.install import installutils
 from ipapython import services as ipaservices
 from ipapython import ipaldap
+from ipapython.ipa_log_manager import root_logger
 from ipalib.session import ISO8601_DATETIME_FMT
 from ipalib.constants import CACERT
 from ConfigParser import SafeConfigParser
@@ -64,15 +71,51 @@ EOF
 
 BACKUP_DIR = '/var/lib/ipa/backup'
 
-
-def encrypt_file(filename, keyring, remove_original=True):
-    source = filename
-    dest = filename + '.gpg'
-
+# Size of the reads and writes done on the backup archive
+BUFSIZE = 1024 * 1024
+
+# Programs used for each compression, in order of preference. The
+# parallel implementations are used when they are installed.
+COMPRESSORS = {
+    'gz': ('/usr/bin/pigz', '/bin/gzip', '/usr/bin/gzip'),
+    'bz2': ('/usr/bin/pbzip2', '/usr/bin/bzip2', '/bin/bzip2'),
+    'xz': ('/usr/bin/xz',),
+}
+
+COMPRESSIONS = ('gz', 'bz2', 'xz', 'none')
+
+
+def compression_args(compression, level=None, decompress=False):
+    """
+    Return the command line which compresses (or decompresses) stdin
+    to stdout, or None if no compression is used.
+    """
+    if compression == 'none':
+        return None
+
+    for path in COMPRESSORS[compression]:
+        if os.path.exists(path):
+            break
+    else:
+        raise admintool.ScriptError(
+            'No program found for %s compression' % compression)
+
+    args = [path]
+    if decompress:
+        args.append('-d')
+    else:
+        if level is not None:
+            args.append('-%d' % level)
+        if compression == 'xz':
+            # use all the CPUs, xz is single-threaded by default
+            args.append('-T0')
+    args.append('-c')
+    return args
+
+
+def gpg_args(keyring):
     args = ['/usr/bin/gpg',
-            '--batch',
-            '--default-recipient-self',
-            '-o', dest]
+            '--batch']
 
     if keyring is not None:
         args.append('--no-default-keyring')
@@ -81,6 +124,16 @@ def encrypt_file(filename, keyring, remove_original=True):
         args.append('--secret-keyring')
         args.append(keyring + '.sec')
 
+    return args
+
+
+def encrypt_file(filename, keyring, remove_original=True):
+    source = filename
+    dest = filename + '.gpg'
+
+    args = gpg_args(keyring)
+    args.extend(['--default-recipient-self', '-o', dest])
+
     args.append('-e')
     args.append(source)
 
@@ -94,6 +147,126 @@ def encrypt_file(filename, keyring, remove_original=True):
     return dest
 
 
+def get_backend_suffix(conn, backend):
+    """
+    Return the suffix of a 389-ds backend.
+    """
+    dn = DN(('cn', backend), ('cn', 'ldbm database'), ('cn', 'plugins'),
+            ('cn', 'config'))
+    entry = conn.get_entry(dn, ['nsslapd-suffix'])
+    return DN(entry.single_value['nsslapd-suffix'])
+
+
+def _restore_sigpipe():
+    # Python ignores SIGPIPE, let the programs of a pipeline stop when
+    # the program they write to exits
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+
+class Pipeline(object):
+    """
+    A chain of programs, each one reading the output of the previous one.
+
+    stdin is passed to the first program and stdout to the last one,
+    either may be subprocess.PIPE. The data is then written to
+    self.stdin or read from self.stdout. When there are no programs
+    self.stdin is stdout and self.stdout is stdin.
+    """
+    def __init__(self, commands, stdin, stdout):
+        self.processes = []
+        if not commands:
+            self.stdin = stdout
+            self.stdout = stdin
+            if stdin is subprocess.PIPE:
+                self.stdout = None
+            if stdout is subprocess.PIPE:
+                self.stdin = None
+            return
+
+        try:
+            for i, args in enumerate(commands):
+                if self.processes:
+                    p_in = self.processes[-1].stdout
+                else:
+                    p_in = stdin
+                if i == len(commands) - 1:
+                    p_out = stdout
+                else:
+                    p_out = subprocess.PIPE
+                root_logger.debug('Starting pipeline process %s',
+                                  ' '.join(args))
+                errors = tempfile.TemporaryFile()
+                p = subprocess.Popen(args, stdin=p_in, stdout=p_out,
+                                     stderr=errors, close_fds=True,
+                                     preexec_fn=_restore_sigpipe)
+                p.args = args
+                p.errors = errors
+                if self.processes:
+                    # only the next program reads from the pipe
+                    self.processes[-1].stdout.close()
+                self.processes.append(p)
+        finally:
+            # the programs have their own copies of the files
+            for f in (stdin, stdout):
+                if f is not subprocess.PIPE:
+                    f.close()
+
+        self.stdin = self.processes[0].stdin
+        self.stdout = self.processes[-1].stdout
+
+    def close(self, check=True):
+        """
+        Wait for the programs to finish.
+
+        If check is True, the remaining output is read and ScriptError is
+        raised if a program failed. Otherwise the programs are stopped
+        and failures are only logged.
+        """
+        if self.stdin is not None and not self.stdin.closed:
+            self.stdin.close()
+        if self.stdout is not None and not self.stdout.closed:
+            if check:
+                while self.stdout.read(BUFSIZE):
+                    pass
+            self.stdout.close()
+        if not check:
+            for p in self.processes:
+                if p.poll() is None:
+                    p.terminate()
+
+        error = None
+        for p in self.processes:
+            rc = p.wait()
+            if rc == 0 or (not check and rc < 0):
+                continue
+            p.errors.seek(0)
+            msg = '%s returned %d: %s' % (p.args[0], rc, p.errors.read())
+            root_logger.debug(msg)
+            if error is None:
+                error = msg
+        if error is not None:
+            if check:
+                raise admintool.ScriptError(error)
+            root_logger.error(error)
+
+
+class HashedFile(object):
+    """
+    Read a file while computing its SHA-256 checksum.
+    """
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.hash.update(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
 class Backup(admintool.AdminTool):
     command_name = 'ipa-backup'
     log_file_name = '/var/log/ipabackup.log'
@@ -198,10 +371,22 @@ class Backup(admintool.AdminTool):
             help="The gpg key name to be used (or full path)")
         parser.add_option("--gpg", dest="gpg", action="store_true",
           default=False, help="Encrypt the backup")
+        parser.add_option("--compression", dest="compression",
+            type="choice", choices=COMPRESSIONS, default='gz',
+            help="Compression of the backup: %s (default gz)" %
+                 ', '.join(COMPRESSIONS))
+        parser.add_option("--compression-level", dest="compression_level",
+            type="int", help="Compression level, from 1 (fastest) to "
+                             "9 (best)")
         parser.add_option("--data", dest="data_only", action="store_true",
             default=False, help="Backup only the data")
         parser.add_option("--logs", dest="logs", action="store_true",
             default=False, help="Include log files in backup")
+        parser.add_option("--incremental", dest="incremental",
+            action="store_true", default=False,
+            help="Back up only the data changed since the last backup, "
+                 "requires --data and --online, not supported on "
+                 "replicated servers")
         parser.add_option("--online", dest="online", action="store_true",
             default=False, help="Perform the LDAP backups online, for data only.")
 
@@ -225,6 +410,16 @@ class Backup(admintool.AdminTool):
             self.option_parser.error("You cannot specify --online "
                 "without --data")
 
+        if options.incremental and not options.online:
+            self.option_parser.error("You cannot specify --incremental "
+                "without --data and --online")
+
+        if (options.compression_level is not None and
+            not 1 <= options.compression_level <= 9):
+            self.option_parser.error("--compression-level must be between "
+                "1 and 9")
+        compression_args(options.compression)
+
         if options.gpg:
             tmpfd = write_tmp_file('encryptme')
             newfile = encrypt_file(tmpfd.name, options.gpg_keyring, False)
@@ -267,6 +462,13 @@ class Backup(admintool.AdminTool):
 
             self.get_connection()
 
+            # Changes made from now on are in the next incremental backup
+            self.high_water = time.strftime('%Y%m%d%H%M%SZ', time.gmtime())
+            self.parent = None
+            if options.incremental:
+                self.check_replication_agreements()
+                self.parent = self.find_parent_backup()
+
             self.create_header(options.data_only)
             if options.data_only:
                 if not options.online:
@@ -278,13 +480,19 @@ class Backup(admintool.AdminTool):
 
             for instance in [realm_to_serverid(api.env.realm), 'PKI-IPA']:
                 if os.path.exists('/var/lib/dirsrv/slapd-%s' % instance):
+                    if options.incremental:
+                        self.delta_backup(instance)
+                        continue
                     if os.path.exists('/var/lib/dirsrv/slapd-%s/db/ipaca' % instance):
                         self.db2ldif(instance, 'ipaca', online=options.online)
                     self.db2ldif(instance, 'userRoot', online=options.online)
                     self.db2bak(instance, online=options.online)
             if not options.data_only:
                 self.file_backup(options)
-            self.finalize_backup(options.data_only, options.gpg, options.gpg_keyring)
+            self.finalize_backup(options.data_only, options.gpg,
+                                 options.gpg_keyring, options.compression,
+                                 options.compression_level,
+                                 options.incremental)
 
             if options.data_only:
                 if not options.online:
@@ -410,6 +618,153 @@ class Backup(admintool.AdminTool):
         shutil.move(ldiffile, os.path.join(self.dir, ldifname))
 
 
+    def check_replication_agreements(self):
+        '''
+        Refuse incremental backups of a server which has replication
+        agreements.
+
+        The changes are found by their modifyTimestamp, which is set by
+        the server the change was made on. A change replicated after
+        the previous backup can have an earlier timestamp and would be
+        missing from the incremental backup.
+        '''
+        conn = self.get_connection()
+        try:
+            entries = conn.get_entries(
+                DN(('cn', 'mapping tree'), ('cn', 'config')),
+                conn.SCOPE_SUBTREE,
+                '(|(objectclass=nsds5ReplicationAgreement)'
+                '(objectclass=nsDSWindowsReplicationAgreement))',
+                ['nsds5replicahost'])
+        except errors.NotFound:
+            return
+        hosts = sorted(set(e.single_value.get('nsds5replicahost', '')
+                           for e in entries))
+        raise admintool.ScriptError(
+            'Incremental backups are not supported on servers with '
+            'replication agreements (%s), make a data backup instead' %
+            ', '.join(hosts))
+
+
+    def find_parent_backup(self):
+        '''
+        Find the most recent backup of this host in BACKUP_DIR.
+
+        Return its name and the time from which changes were not included
+        in it.
+        '''
+        parent = None
+        for name in os.listdir(BACKUP_DIR):
+            header = os.path.join(BACKUP_DIR, name, 'header')
+            if not os.path.isfile(header):
+                continue
+            config = SafeConfigParser()
+            try:
+                config.read(header)
+                if config.get('ipa', 'host') != api.env.host:
+                    continue
+                backup_time = config.get('ipa', 'time')
+                high_water = config.get('ipa', 'high_water')
+            except ConfigParserError:
+                # backups made before incremental backups were supported
+                continue
+            if parent is None or backup_time > parent[0]:
+                parent = (backup_time, name, high_water)
+
+        if parent is None:
+            raise admintool.ScriptError(
+                'No backup to base an incremental backup on found in %s' %
+                BACKUP_DIR)
+        self.log.info('Backing up changes since backup %s' % parent[1])
+        return parent[1:]
+
+
+    def delta_backup(self, instance):
+        '''
+        Create LDIF files of the changes made in this instance since the
+        parent backup.
+
+        The -delta LDIF contains the entries added or modified since then
+        and the -deleted LDIF the entries deleted since then, which are
+        found through their replication tombstones. Both have the
+        nsUniqueId of the entries so that renamed entries can be found
+        when the changes are restored.
+        '''
+        if instance == 'PKI-IPA':
+            raise admintool.ScriptError(
+                'Incremental backups of the PKI-IPA instance are not '
+                'supported')
+
+        backends = ['userRoot']
+        if os.path.exists('/var/lib/dirsrv/slapd-%s/db/ipaca' % instance):
+            backends.insert(0, 'ipaca')
+
+        (parent, high_water) = self.parent
+        conn = self.get_connection()
+        for backend in backends:
+            self.log.info('Backing up changes to %s in %s' %
+                (backend, instance))
+            suffix = get_backend_suffix(conn, backend)
+
+            changed = self.__write_ldif(
+                conn, '%s-%s-delta.ldif' % (instance, backend), suffix,
+                '(modifyTimestamp>=%s)' % high_water, ['*', 'nsuniqueid'])
+
+            deleted = self.__write_ldif(
+                conn, '%s-%s-deleted.ldif' % (instance, backend), suffix,
+                '(&(objectClass=nsTombstone)(modifyTimestamp>=%s))' %
+                high_water, ['nsuniqueid'], self.__tombstone_target)
+
+            self.log.info('%d entries changed and %d deleted' %
+                (changed, deleted))
+
+
+    def __write_ldif(self, conn, ldifname, suffix, filter, attrs_list,
+                     transform=None):
+        '''
+        Write the entries matching filter to a LDIF file in self.dir.
+
+        transform is called for every entry and returns the DN to write
+        it with, or None to leave the entry out.
+        '''
+        count = 0
+        with open(os.path.join(self.dir, ldifname), 'w') as fd:
+            writer = ldif.LDIFWriter(fd)
+            for (entries, truncated) in conn.find_entries_paged(
+                    filter, attrs_list, suffix):
+                if truncated:
+                    raise admintool.ScriptError(
+                        'Search for changes in %s was truncated' % suffix)
+                for entry in entries:
+                    dn = entry.dn
+                    if transform is not None:
+                        dn = transform(entry)
+                        if dn is None:
+                            continue
+                    writer.unparse(str(dn), dict(entry.raw))
+                    count += 1
+        return count
+
+
+    def __tombstone_target(self, entry):
+        '''
+        Return the DN of the deleted entry a tombstone stands for.
+        '''
+        uniqueid = entry.single_value.get('nsuniqueid', '')
+        if uniqueid.lower() == 'ffffffff-ffffffff-ffffffff-ffffffff':
+            # the replica update vector, not a deleted entry
+            return None
+
+        # The tombstone RDN is either nsuniqueid=...+<RDN> or
+        # nsuniqueid=... followed by the RDN of the entry
+        rdn = entry.dn[0]
+        if len(rdn) > 1:
+            return DN(RDN(*[ava for ava in rdn
+                            if ava.attr.lower() != 'nsuniqueid']),
+                      *entry.dn[1:])
+        return DN(*entry.dn[1:])
+
+
     def db2bak(self, instance, online=True):
         '''
         Create a BAK backup of the data and changelog in this instance.
@@ -459,10 +814,12 @@ class Backup(admintool.AdminTool):
             return [s for s in dirs if os.path.exists(s)]
 
         self.log.info("Backing up files")
+        # The tarball is not compressed here, it is compressed with the
+        # rest of the backup in finalize_backup.
         args = ['tar',
                 '--xattrs',
                 '--selinux',
-                '-czf',
+                '-cf',
                 os.path.join(self.dir, 'files.tar')
                ]
 
@@ -491,7 +848,10 @@ class Backup(admintool.AdminTool):
         config.set('ipa', 'time', time.strftime(ISO8601_DATETIME_FMT, time.gmtime()))
         config.set('ipa', 'host', api.env.host)
         config.set('ipa', 'ipa_version', str(version.VERSION))
-        config.set('ipa', 'version', '1')
+        config.set('ipa', 'version', '2')
+        config.set('ipa', 'high_water', self.high_water)
+        if self.parent is not None:
+            config.set('ipa', 'incremental', self.parent[0])
 
         dn = DN(('cn', api.env.host), ('cn', 'masters'), ('cn', 'ipa'), ('cn', 'etc'), api.env.basedn)
         services_cns = []
@@ -512,20 +872,28 @@ class Backup(admintool.AdminTool):
             config.write(fd)
 
 
-    def finalize_backup(self, data_only=False, encrypt=False, keyring=None):
+    def finalize_backup(self, data_only=False, encrypt=False, keyring=None,
+                        compression='gz', level=None, incremental=False):
         '''
         Create the final location of the backup files and move the files
         we've backed up there, optionally encrypting them.
 
-        This is done in a couple of steps. We have a directory that
-        contains the tarball of the files, a directory that contains
-        the db2bak output and an LDIF.
+        We have a directory that contains the tarball of the files, a
+        directory that contains the db2bak output and an LDIF. These are
+        archived, compressed and encrypted in a single pass: the tar
+        stream is piped through the compression program and gpg straight
+        into the final file.
 
-        These, along with the header, are moved into a new subdirectory
-        in /var/lib/ipa/backup.
+        The archive, along with the header, is put into a new subdirectory
+        in /var/lib/ipa/backup. The header gets a manifest with the
+        checksum and size of every file in the archive so ipa-restore can
+        verify them.
         '''
 
-        if data_only:
+        if incremental:
+            backup_dir = os.path.join(BACKUP_DIR, time.strftime('ipa-incr-%Y-%m-%d-%H-%M-%S'))
+            filename = os.path.join(backup_dir, "ipa-data.tar")
+        elif data_only:
             backup_dir = os.path.join(BACKUP_DIR, time.strftime('ipa-data-%Y-%m-%d-%H-%M-%S'))
             filename = os.path.join(backup_dir, "ipa-data.tar")
         else:
@@ -534,25 +902,69 @@ class Backup(admintool.AdminTool):
 
         os.mkdir(backup_dir, 0700)
 
-        cwd = os.getcwd()
-        os.chdir(self.dir)
-        args = ['tar',
-                '--xattrs',
-                '--selinux',
-                '-czf',
-                filename,
-                '.'
-               ]
-        (stdout, stderr, rc) = run(args, raiseonerr=False)
-        if rc != 0:
-            raise admintool.ScriptError('tar returned non-zero %d: %s' % (rc, stdout))
-
+        commands = []
+        args = compression_args(compression, level)
+        if args is not None:
+            commands.append(args)
         if encrypt:
-            self.log.info('Encrypting %s' % filename)
-            filename = encrypt_file(filename, keyring)
+            filename = filename + '.gpg'
+            commands.append(gpg_args(keyring) +
+                            ['--default-recipient-self', '-o', '-', '-e'])
+
+        self.log.info('Writing %s' % filename)
+        manifest = []
+        pipeline = Pipeline(commands, subprocess.PIPE, open(filename, 'wb'))
+        try:
+            tar = tarfile.open(mode='w|', fileobj=pipeline.stdin,
+                               bufsize=BUFSIZE)
+            for name in self.__archive_members():
+                path = os.path.join(self.dir, name)
+                tarinfo = tar.gettarinfo(path, name)
+                if tarinfo.isreg():
+                    with open(path, 'rb') as fd:
+                        hashed = HashedFile(fd)
+                        tar.addfile(tarinfo, hashed)
+                    manifest.append((name, hashed.hexdigest(), tarinfo.size))
+                else:
+                    tar.addfile(tarinfo)
+            tar.close()
+        finally:
+            pipeline.close()
+
+        config = SafeConfigParser()
+        config.optionxform = str
+        config.read(self.header)
+        config.set('ipa', 'compression', compression)
+        config.add_section('manifest')
+        for (name, digest, size) in manifest:
+            config.set('manifest', name, 'sha256:%s %d' % (digest, size))
+        with open(self.header, 'w') as fd:
+            config.write(fd)
 
         shutil.move(self.header, backup_dir)
 
+    def __archive_members(self):
+        """
+        Return the names of the files to archive, relative to self.dir.
+
+        The LDIF files come first and the files tarball next, so that a
+        data restore can stop reading the archive early.
+        """
+        members = []
+        for root, dirs, files in os.walk(self.dir):
+            for name in dirs + files:
+                members.append(
+                    os.path.relpath(os.path.join(root, name), self.dir))
+
+        def order(name):
+            if name.endswith('.ldif') and os.sep not in name:
+                return (0, name)
+            elif name == 'files.tar':
+                return (1, name)
+            return (2, name)
+
+        return sorted(members, key=order)
+
     def __find_scripts_dir(self, instance):
         """
         IPA stores its 389-ds scripts in a different directory than dogtag
@@ -23,8 +23,14 @@ import shutil
 import tempfile
 import time
 import pwd
+import hashlib
+import tarfile
+import subprocess
 from ConfigParser import SafeConfigParser
 
+import ldap.filter
+import ldif
+
 from ipalib import api, errors
 from ipapython import version
 from ipapython.ipautil import run, user_input
@@ -38,7 +44,8 @@ from ipaserver.install.replication import (wait_for_task, ReplicationManager,
 from ipaserver.install import installutils
 from ipapython import services as ipaservices
 from ipapython import ipaldap
-from ipaserver.install.ipa_backup import BACKUP_DIR
+from ipaserver.install.ipa_backup import (BACKUP_DIR, BUFSIZE, COMPRESSIONS,
+    Pipeline, compression_args, get_backend_suffix, gpg_args)
 
 
 def recursive_chown(path, uid, gid):
@@ -64,16 +71,8 @@ def decrypt_file(tmpdir, filename, keyring):
     dest = os.path.basename(dest)
     dest = os.path.join(tmpdir, dest)
 
-    args = ['/usr/bin/gpg',
-            '--batch',
-            '-o', dest]
-
-    if keyring is not None:
-        args.append('--no-default-keyring')
-        args.append('--keyring')
-        args.append(keyring + '.pub')
-        args.append('--secret-keyring')
-        args.append(keyring + '.sec')
+    args = gpg_args(keyring)
+    args.extend(['-o', dest])
 
     args.append('-d')
     args.append(source)
@@ -96,6 +95,7 @@ class Restore(admintool.AdminTool):
     def __init__(self, options, args):
         super(Restore, self).__init__(options, args)
         self._conn = None
+        self.deltas = []
 
     @classmethod
     def add_options(cls, parser):
@@ -247,7 +247,16 @@ class Restore(admintool.AdminTool):
             self.log.info("Disabling all replication.")
             self.disable_agreements()
 
-            self.extract_backup(options.gpg_keyring)
+            if self.backup_type == 'FULL' and not options.data_only:
+                members = None
+            else:
+                # only the LDIF files are needed to restore the data
+                members = lambda name: (name.endswith('.ldif') and
+                                        os.sep not in name)
+            if self.backup_incremental:
+                self.extract_backup_chain(options.gpg_keyring, members)
+            else:
+                self.extract_backup(options.gpg_keyring, members)
             if options.data_only:
                 if not options.online:
                     self.log.info('Stopping Directory Server')
@@ -275,14 +284,18 @@ class Restore(admintool.AdminTool):
             # userRoot backend in it and the main IPA instance. If we
             # have a unified instance we need to restore both userRoot and
             # ipaca.
+            restored = []
             for instance in instances:
                 if os.path.exists('/var/lib/dirsrv/slapd-%s' % instance):
                     if options.backend is None:
                         self.ldif2db(instance, 'userRoot', online=options.online)
+                        restored.append((instance, 'userRoot'))
                         if os.path.exists('/var/lib/dirsrv/slapd-%s/db/ipaca' % instance):
                             self.ldif2db(instance, 'ipaca', online=options.online)
+                            restored.append((instance, 'ipaca'))
                     else:
                         self.ldif2db(instance, options.backend, online=options.online)
+                        restored.append((instance, options.backend))
                 else:
                     raise admintool.ScriptError('389-ds instance %s does not exist' % instance)
 
@@ -301,6 +314,9 @@ class Restore(admintool.AdminTool):
                 self.log.info('Restarting SSSD')
                 sssd = ipaservices.service('sssd')
                 sssd.restart()
+
+            if self.deltas:
+                self.replay_deltas(restored)
         finally:
             try:
                 os.chdir(cwd)
@@ -508,8 +524,10 @@ class Restore(admintool.AdminTool):
         self.log.info("Restoring files")
         cwd = os.getcwd()
         os.chdir('/')
+        # tar detects whether the tarball is compressed, it is in backups
+        # made before the whole backup was compressed in a single pass
         args = ['tar',
-                '-xzf',
+                '-xf',
                 os.path.join(self.dir, 'files.tar')
                ]
         if nologs:
@@ -530,6 +548,7 @@ class Restore(admintool.AdminTool):
         '''
         fd = open(self.header)
         config = SafeConfigParser()
+        config.optionxform = str
         config.readfp(fd)
 
         self.backup_type = config.get('ipa', 'type')
@@ -539,11 +558,45 @@ class Restore(admintool.AdminTool):
         self.backup_version = config.get('ipa', 'version')
         self.backup_services = config.get('ipa', 'services')
 
+        # the name of the backup an incremental backup is based on
+        self.backup_incremental = None
+        if config.has_option('ipa', 'incremental'):
+            self.backup_incremental = config.get('ipa', 'incremental')
+
+        if self.backup_version not in ('1', '2'):
+            raise admintool.ScriptError(
+                'Unsupported backup version %s' % self.backup_version)
+
+        # version 1 backups are always compressed with gzip
+        self.backup_compression = 'gz'
+        if config.has_option('ipa', 'compression'):
+            self.backup_compression = config.get('ipa', 'compression')
+        if self.backup_compression not in COMPRESSIONS:
+            raise admintool.ScriptError(
+                'Unsupported backup compression %s' % self.backup_compression)
 
-    def extract_backup(self, keyring=None):
+        # name -> (algorithm, checksum, size)
+        self.backup_manifest = None
+        if config.has_section('manifest'):
+            self.backup_manifest = {}
+            for (name, value) in config.items('manifest'):
+                (checksum, size) = value.split()
+                (algorithm, checksum) = checksum.split(':', 1)
+                self.backup_manifest[name] = (algorithm, checksum, int(size))
+
+
+    def extract_backup(self, keyring=None, members=None):
         '''
         Extract the contents of the tarball backup into a temporary location,
-        decrypting if necessary.
+        decrypting and decompressing it while it is read.
+
+        members is a function which is passed the name of a file in the
+        backup and returns whether to extract it. By default everything is
+        extracted.
+
+        If the header has a manifest, the checksum of every extracted file
+        is verified and reading stops once all of the selected files have
+        been extracted.
         '''
 
         encrypt = False
@@ -559,27 +612,260 @@ class Restore(admintool.AdminTool):
                 filename = filename + '.gpg'
                 encrypt = True
 
+        commands = []
         if encrypt:
             self.log.info('Decrypting %s' % filename)
-            filename = decrypt_file(self.dir, filename, keyring)
-
-        cwd = os.getcwd()
-        os.chdir(self.dir)
+            commands.append(gpg_args(keyring) + ['-d'])
+        args = compression_args(self.backup_compression, decompress=True)
+        if args is not None:
+            commands.append(args)
+
+        wanted = None
+        if self.backup_manifest is not None:
+            wanted = set(name for name in self.backup_manifest
+                         if members is None or members(name))
+
+        complete = False
+        pipeline = Pipeline(commands, open(filename, 'rb'), subprocess.PIPE)
+        try:
+            tar = tarfile.open(mode='r|', fileobj=pipeline.stdout,
+                               bufsize=BUFSIZE)
+            for tarinfo in tar:
+                name = os.path.normpath(tarinfo.name)
+                if name == '.':
+                    continue
+                if (os.path.isabs(name) or name == os.pardir or
+                    name.startswith(os.pardir + os.sep)):
+                    raise admintool.ScriptError(
+                        'Invalid file name %s in backup' % tarinfo.name)
+                if members is not None and not members(name):
+                    continue
+                self.__extract_member(tar, tarinfo, name)
+                if wanted is not None:
+                    wanted.discard(name)
+                    if not wanted:
+                        complete = True
+                        break
+            tar.close()
+        except tarfile.TarError, e:
+            pipeline.close(check=False)
+            raise admintool.ScriptError(
+                'Unable to read backup file %s: %s' % (filename, e))
+        except:
+            pipeline.close(check=False)
+            raise
+        else:
+            # when reading stopped early the programs are simply stopped
+            pipeline.close(check=not complete)
 
-        args = ['tar',
-                '-xzf',
-                filename,
-                '.'
-               ]
-        run(args)
+        if wanted:
+            raise admintool.ScriptError(
+                'Backup file %s is missing %s' %
+                (filename, ', '.join(sorted(wanted))))
 
         pent = pwd.getpwnam(DS_USER)
         os.chown(self.top_dir, pent.pw_uid, pent.pw_gid)
         recursive_chown(self.dir, pent.pw_uid, pent.pw_gid)
 
-        if encrypt:
-            # We can remove the decoded tarball
-            os.unlink(filename)
+
+    def __extract_member(self, tar, tarinfo, name):
+        '''
+        Extract a file from the backup into self.dir and verify its
+        checksum against the manifest.
+
+        Only directories and regular files are extracted, links and
+        special files could make the following files be written outside
+        of self.dir.
+        '''
+        path = os.path.join(self.dir, name)
+        if tarinfo.isdir():
+            if not os.path.isdir(path):
+                os.makedirs(path, 0750)
+            return
+        if not tarinfo.isreg():
+            raise admintool.ScriptError(
+                'Unsupported type of file %s in backup' % tarinfo.name)
+
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, 0750)
+
+        digest = hashlib.sha256()
+        src = tar.extractfile(tarinfo)
+        with open(path, 'wb') as dst:
+            while True:
+                data = src.read(BUFSIZE)
+                if not data:
+                    break
+                digest.update(data)
+                dst.write(data)
+
+        if self.backup_manifest is None:
+            return
+        expected = self.backup_manifest.get(name)
+        if expected is None:
+            raise admintool.ScriptError(
+                '%s is not in the backup manifest' % name)
+        if expected != ('sha256', digest.hexdigest(), tarinfo.size):
+            raise admintool.ScriptError(
+                'Checksum of %s does not match the backup manifest' % name)
+
+
+    def get_backup_chain(self):
+        '''
+        Return the directories of the backups an incremental backup is
+        based on, starting with the full or data backup, and ending with
+        the incremental backup itself.
+        '''
+        chain = [self.backup_dir]
+        parent = self.backup_incremental
+        while parent is not None:
+            backup_dir = os.path.join(os.path.dirname(self.backup_dir), parent)
+            header = os.path.join(backup_dir, 'header')
+            if not os.path.isfile(header) or backup_dir in chain:
+                raise admintool.ScriptError(
+                    'Unable to find backup %s which %s is based on' %
+                    (parent, os.path.basename(chain[0])))
+            chain.insert(0, backup_dir)
+
+            config = SafeConfigParser()
+            config.read(header)
+            parent = None
+            if config.has_option('ipa', 'incremental'):
+                parent = config.get('ipa', 'incremental')
+        return chain
+
+
+    def extract_backup_chain(self, keyring=None, members=None):
+        '''
+        Extract an incremental backup and the backups it is based on.
+
+        The backup the chain starts with is extracted into self.dir, so it
+        is restored like any other backup. Every incremental backup is
+        extracted into its own directory, which is added to self.deltas.
+        '''
+        chain = self.get_backup_chain()
+        self.log.info('Restoring %s and %d incremental backups' %
+            (os.path.basename(chain[0]), len(chain) - 1))
+
+        (backup_dir, header, dir) = (self.backup_dir, self.header, self.dir)
+        try:
+            for (i, path) in enumerate(chain):
+                self.backup_dir = path
+                self.header = os.path.join(path, 'header')
+                self.read_header()
+                if i > 0:
+                    self.dir = os.path.join(self.top_dir, 'delta-%d' % i)
+                    os.mkdir(self.dir, 0750)
+                    self.deltas.append(self.dir)
+                self.extract_backup(keyring, members)
+        finally:
+            (self.backup_dir, self.header, self.dir) = (backup_dir, header, dir)
+            self.read_header()
+
+
+    def replay_deltas(self, restored):
+        '''
+        Apply the changes recorded by the incremental backups, oldest
+        first, to the backends in restored, a list of (instance, backend).
+
+        This is done online after the data of the backup the incremental
+        backups are based on has been restored.
+        '''
+        # The Directory Server has been restarted since we connected
+        self._conn = None
+        conn = self.get_connection()
+
+        for dirname in self.deltas:
+            for (instance, backend) in restored:
+                suffix = get_backend_suffix(conn, backend)
+                prefix = os.path.join(dirname, '%s-%s' % (instance, backend))
+                if not os.path.exists(prefix + '-delta.ldif'):
+                    continue
+                self.log.info('Applying changes to %s in %s from %s' %
+                    (backend, instance, os.path.basename(dirname)))
+                self.__replay_deleted(conn, prefix + '-deleted.ldif')
+                self.__replay_changed(conn, prefix + '-delta.ldif', suffix)
+
+
+    def __read_ldif(self, filename):
+        with open(filename) as fd:
+            parser = ldif.LDIFRecordList(fd)
+            parser.parse()
+        return [(DN(dn), dict((k.lower(), v) for (k, v) in entry.iteritems()))
+                for (dn, entry) in parser.all_records]
+
+
+    def __replay_deleted(self, conn, filename):
+        '''
+        Delete the entries deleted since the previous backup.
+
+        An entry is only deleted if it still has the nsUniqueId of the
+        deleted entry, it may have been re-created since.
+        '''
+        records = self.__read_ldif(filename)
+        # children first
+        records.sort(key=lambda record: len(record[0]), reverse=True)
+        for (dn, entry) in records:
+            uniqueid = entry['nsuniqueid'][0].lower()
+            try:
+                current = conn.get_entry(dn, ['nsuniqueid'])
+            except errors.NotFound:
+                continue
+            if current.single_value.get('nsuniqueid', u'').lower() != uniqueid:
+                continue
+            try:
+                conn.delete_entry(dn)
+            except errors.ExecutionError, e:
+                self.log.error('Unable to delete %s: %s' % (dn, e))
+
+
+    def __replay_changed(self, conn, filename, suffix):
+        '''
+        Add or replace the entries changed since the previous backup.
+
+        Entries are matched by nsUniqueId, so an entry which was renamed
+        is renamed again rather than added a second time.
+        '''
+        records = self.__read_ldif(filename)
+        # parents first
+        records.sort(key=lambda record: len(record[0]))
+        for (dn, attrs) in records:
+            uniqueid = attrs.pop('nsuniqueid', [None])[0]
+            current = None
+            if uniqueid is not None:
+                try:
+                    (entries, truncated) = conn.find_entries(
+                        '(nsuniqueid=%s)' % ldap.filter.escape_filter_chars(
+                            uniqueid),
+                        ['*'], suffix)
+                    current = entries[0]
+                except errors.NotFound:
+                    pass
+
+            try:
+                if current is not None and current.dn != dn:
+                    newsuperior = None
+                    if current.dn[1:] != dn[1:]:
+                        newsuperior = str(DN(*dn[1:]))
+                    with conn.error_handler():
+                        conn.conn.rename_s(current.dn, dn[0], newsuperior)
+                    current = conn.get_entry(dn, ['*'])
+
+                if current is None:
+                    with conn.error_handler():
+                        conn.conn.add_s(dn, attrs.items())
+                    continue
+
+                modlist = [(ldap.MOD_REPLACE, k, v)
+                           for (k, v) in attrs.iteritems()]
+                for k in current.raw.keys():
+                    if k.lower() not in attrs:
+                        modlist.append((ldap.MOD_DELETE, k, None))
+                with conn.error_handler():
+                    conn.conn.modify_s(dn, modlist)
+            except errors.ExecutionError, e:
+                self.log.error('Unable to restore %s: %s' % (dn, e))
 
 
     def __find_scripts_dir(self, instance):
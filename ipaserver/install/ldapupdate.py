@@ -33,6 +33,9 @@ import pwd
 import fnmatch
 import csv
 import re
+import hashlib
+import tempfile
+import cPickle
 
 import krbV
 import ldap
@@ -108,9 +111,32 @@ def safe_output(attr, values):
     else:
         return values
 
+# Compiled update files by key, see LDAPUpdate._get_compiled_update_file
+_compiled_update_files = {}
+
 class LDAPUpdate:
     action_keywords = ["default", "add", "remove", "only", "onlyifexist", "deleteentry", "replace", "addifnew", "addifexist"]
 
+    index_dn = DN(('cn', 'index'), ('cn', 'userRoot'), ('cn', 'ldbm database'),
+                  ('cn', 'plugins'), ('cn', 'config'))
+    # Seconds between index task status checks, the interval grows from
+    # the minimum to the maximum while the task is running
+    index_poll_min = 0.25
+    index_poll_max = 5
+    # Maximum number of entries fetched by one search of a container
+    prefetch_batch_size = 100
+    # Attributes read from the entries to update
+    entry_attrs = ["*", "aci", "attributeTypes", "objectClasses"]
+    # Directory where compiled update files are stored for later runs,
+    # None keeps them in memory only
+    parse_cache_dir = '/var/cache/ipa/updates'
+    # Substitution variables whose value changes in every run, update files
+    # using them are not stored in parse_cache_dir
+    volatile_sub_vars = ('TIME',)
+    # Version of the compiled form of update files, change it whenever
+    # _compile_update_file returns something different
+    compiled_format = 1
+
     def __init__(self, dm_password, sub_dict={}, live_run=True,
                  online=True, ldapi=False, plugins=False):
         '''
@@ -166,6 +192,12 @@ class LDAPUpdate:
         self.online = online
         self.ldapi = ldapi
         self.plugins = plugins
+        self.index_attributes = []
+        self.prefetched = {}
+        self.search_count = 0
+        self.write_count = 0
+        self.written_dns = set()
+        self.pass_files = []
         self.pw_name = pwd.getpwuid(os.geteuid()).pw_name
         self.realm = None
         suffix = None
@@ -324,6 +356,107 @@ class LDAPUpdate:
     def parse_update_file(self, data_source_name, source_data, all_updates):
         """Parse the update file into a dictonary of lists and apply the update
            for each DN in the file."""
+        compiled = self._get_compiled_update_file(data_source_name,
+                                                  source_data)
+        for dn, dispositions in compiled:
+            # merge_updates and _combine_updates modify the updates in
+            # place, never hand out the cached lists
+            update = dict((disposition, list(values))
+                          for disposition, values in dispositions.iteritems())
+            update['dn'] = DN(dn)
+            self._combine_updates(all_updates, update)
+
+        return all_updates
+
+    def _get_update_file_key(self, source_data):
+        """
+        Return the key identifying the compiled form of an update file.
+
+        The key covers the content of the file and the values of the
+        substitution variables which may be used in it, so a TIME value
+        which changes in every run does not invalidate files without $TIME.
+        """
+        text = ''.join(source_data)
+        key = hashlib.sha1(str(self.compiled_format))
+        key.update(text)
+        for name, value in sorted(self.sub_dict.iteritems()):
+            if name in text:
+                key.update('\0%s=%r' % (name, value))
+        return key.hexdigest()
+
+    def _get_compiled_update_file(self, data_source_name, source_data):
+        """
+        Return the compiled form of an update file, see _compile_update_file.
+
+        Compiled files are kept for the rest of the process. Unless they
+        use one of volatile_sub_vars they are also stored in parse_cache_dir
+        for later runs of the updater, otherwise every run would store them
+        under a new key.
+        """
+        key = self._get_update_file_key(source_data)
+        compiled = _compiled_update_files.get(key)
+        if compiled is None:
+            text = ''.join(source_data)
+            stored = not any(name in text for name in self.volatile_sub_vars)
+            if stored:
+                compiled = self._load_compiled_update_file(key)
+            if compiled is None:
+                compiled = self._compile_update_file(data_source_name,
+                                                     source_data)
+                if stored:
+                    self._store_compiled_update_file(key, compiled)
+            else:
+                self.debug("Using compiled update file '%s'",
+                           data_source_name)
+            _compiled_update_files[key] = compiled
+        return compiled
+
+    def _load_compiled_update_file(self, key):
+        if not self.parse_cache_dir:
+            return None
+
+        path = os.path.join(self.parse_cache_dir, key)
+        try:
+            with open(path, 'rb') as f:
+                # Only trust files written by ourselves
+                if os.fstat(f.fileno()).st_uid != os.geteuid():
+                    return None
+                (stored_key, compiled) = cPickle.load(f)
+        except IOError:
+            return None
+        except Exception, e:
+            self.debug("cannot load compiled update file %s: %s", path, e)
+            return None
+        if stored_key != key:
+            return None
+        return compiled
+
+    def _store_compiled_update_file(self, key, compiled):
+        if not self.parse_cache_dir:
+            return
+
+        path = os.path.join(self.parse_cache_dir, key)
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.parse_cache_dir)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    cPickle.dump((key, compiled), f, cPickle.HIGHEST_PROTOCOL)
+                os.rename(tmp_path, path)
+            except:
+                os.unlink(tmp_path)
+                raise
+        except Exception, e:
+            self.debug("cannot store compiled update file %s: %s", path, e)
+
+    def _compile_update_file(self, data_source_name, source_data):
+        """
+        Parse an update file and substitute the variables in it.
+
+        Returns a list of (dn, dispositions) tuples in the order of the
+        file, where dn is the DN string and dispositions a dictionary
+        of the default, updates and deleteentry lists of the DN.
+        """
+        compiled = []
         update = {}
         logical_line = ""
         action = ""
@@ -379,11 +512,11 @@ class LDAPUpdate:
 
         def emit_update(update):
             '''
-            When processing a dn is completed emit the update by merging it into
-            the set of all updates.
+            When processing a dn is completed emit the update by appending it
+            to the compiled updates.
             '''
 
-            self._combine_updates(all_updates, update)
+            compiled.append((dn, update))
 
         # Iterate over source input lines
         for source_line in source_data:
@@ -406,8 +539,9 @@ class LDAPUpdate:
                     update = {}
 
                 dn = source_line[3:].strip()
-                dn = DN(self._template_str(dn))
-                update['dn'] = dn
+                dn = self._template_str(dn)
+                # Reject invalid DN's when parsing, not when applying
+                DN(dn)
             else:
                 # Process items belonging to dn
                 if dn is None:
@@ -429,10 +563,10 @@ class LDAPUpdate:
             emit_update(update)
             update = {}
 
-        return all_updates
+        return compiled
 
-    def create_index_task(self, attribute):
-        """Create a task to update an index for an attribute"""
+    def create_index_task(self, *attributes):
+        """Create a task to update the indexes of one or more attributes"""
 
         # Sleep a bit to ensure previous operations are complete
         if self.live_run:
@@ -442,7 +576,11 @@ class LDAPUpdate:
         # cn_uuid.time is in nanoseconds, but other users of LDAPUpdate expect
         # seconds in 'TIME' so scale the value down
         self.sub_dict['TIME'] = int(cn_uuid.time/1e9)
-        cn = "indextask_%s_%s_%s" % (attribute, cn_uuid.time, cn_uuid.clock_seq)
+        if len(attributes) == 1:
+            name = attributes[0]
+        else:
+            name = 'multi'
+        cn = "indextask_%s_%s_%s" % (name, cn_uuid.time, cn_uuid.clock_seq)
         dn = DN(('cn', cn), ('cn', 'index'), ('cn', 'tasks'), ('cn', 'config'))
 
         e = self.conn.make_entry(
@@ -450,10 +588,11 @@ class LDAPUpdate:
             objectClass=['top', 'extensibleObject'],
             cn=[cn],
             nsInstance=['userRoot'],
-            nsIndexAttribute=[attribute],
+            nsIndexAttribute=list(attributes),
         )
 
-        self.info("Creating task to index attribute: %s", attribute)
+        self.info("Creating task to index attributes: %s",
+                  ', '.join(attributes))
         self.debug("Task id: %s", dn)
 
         if self.live_run:
@@ -471,13 +610,16 @@ class LDAPUpdate:
             # If not doing this live there is nothing to monitor
             return
 
-        # Pause for a moment to give the task time to be created
-        time.sleep(1)
-
         attrlist = ['nstaskstatus', 'nstaskexitcode']
         entry = None
+        interval = self.index_poll_min
 
         while True:
+            # Short tasks are noticed quickly, long ones are not polled
+            # more often than necessary
+            time.sleep(interval)
+            interval = min(interval * 2, self.index_poll_max)
+
             try:
                 entry = self.conn.get_entry(dn, attrlist)
             except errors.NotFound, e:
@@ -490,18 +632,43 @@ class LDAPUpdate:
             status = entry.single_value.get('nstaskstatus')
             if status is None:
                 # task doesn't have a status yet
-                time.sleep(1)
                 continue
 
             if status.lower().find("finished") > -1:
-                self.info("Indexing finished")
+                exitcode = entry.single_value.get('nstaskexitcode')
+                if exitcode not in (None, '0'):
+                    self.error("Indexing failed: %s", status)
+                else:
+                    self.info("Indexing finished")
                 break
 
             self.debug("Indexing in progress")
-            time.sleep(1)
 
         return
 
+    def _run_index_tasks(self):
+        """
+        Reindex all the attributes whose index definitions were added or
+        updated since the last call.
+
+        The directory server reindexes a backend with one task at a time,
+        so all the attributes are indexed by a single task.
+        """
+        attributes = self.index_attributes
+        if not attributes:
+            return
+        self.index_attributes = []
+
+        start = time.time()
+        taskid = self.create_index_task(*attributes)
+        self.monitor_index_task(taskid)
+        elapsed = time.time() - start
+
+        self.info("Indexing of %d attributes took %.1f seconds:",
+                  len(attributes), elapsed)
+        for attribute in attributes:
+            self.info("\t%s", attribute)
+
     def _create_default_entry(self, dn, default):
         """Create the default entry from the values provided.
 
@@ -535,12 +702,68 @@ class LDAPUpdate:
            The return type is ipaldap.LDAPEntry
         """
         assert isinstance(dn, DN)
+
+        entry = self.prefetched.pop(dn, None)
+        if entry is not None:
+            return [entry]
+
         searchfilter="objectclass=*"
-        sattrs = ["*", "aci", "attributeTypes", "objectClasses"]
+        sattrs = self.entry_attrs
         scope = ldap.SCOPE_BASE
 
+        self.search_count += 1
         return self.conn.get_entries(dn, scope, searchfilter, sattrs)
 
+    def _prefetch_entries(self, updates):
+        """
+        Fetch the existing entries targeted by updates with one search per
+        parent container instead of one search per entry.
+
+        The entries are returned by _get_entry. Entries which are not
+        prefetched (e.g. because they do not exist yet) are looked up by
+        _get_entry as usual.
+        """
+        by_parent = {}
+        for update in updates:
+            if update.has_key('deleteentry'):
+                continue
+            dn = update['dn']
+            if len(dn) < 2:
+                continue
+            by_parent.setdefault(DN(*dn[1:]), []).append(dn)
+
+        self.prefetched = {}
+        for (parent_dn, dns) in by_parent.iteritems():
+            if len(dns) < 2:
+                # a base search is just as good
+                continue
+            for i in xrange(0, len(dns), self.prefetch_batch_size):
+                filters = []
+                for dn in dns[i:i + self.prefetch_batch_size]:
+                    filters.append(self.conn.combine_filters(
+                        [self.conn.make_filter_from_attr(ava.attr, ava.value)
+                         for ava in dn[0]],
+                        self.conn.MATCH_ALL))
+                # LDAP subentries are returned only when asked for
+                searchfilter = self.conn.combine_filters(
+                    ['(|(objectclass=*)(objectclass=ldapsubentry))',
+                     self.conn.combine_filters(filters, self.conn.MATCH_ANY)],
+                    self.conn.MATCH_ALL)
+
+                self.search_count += 1
+                try:
+                    entries = self.conn.get_entries(
+                        parent_dn, ldap.SCOPE_ONELEVEL, searchfilter,
+                        self.entry_attrs)
+                except errors.NotFound:
+                    continue
+                except errors.ExecutionError, e:
+                    self.debug("Unable to prefetch entries of %s: %s",
+                               parent_dn, e)
+                    continue
+                for entry in entries:
+                    self.prefetched[entry.dn] = entry
+
     def _apply_update_disposition(self, updates, entry):
         """
         updates is a list of changes to apply
@@ -637,12 +860,18 @@ class LDAPUpdate:
             for l in value:
                 self.debug("\t%s", safe_output(a, l))
 
-    def _update_record(self, update):
+    def _plan_record(self, update):
+        """
+        Compute the final value of the entry targeted by update.
+
+        Returns an (entry, found) tuple, where found tells whether the entry
+        already exists, or None if there is nothing to add or update.
+        """
         found = False
 
         # If the entry is going to be deleted no point in processing it.
         if update.has_key('deleteentry'):
-            return
+            return None
 
         new_entry = self._create_default_entry(update.get('dn'),
                                                update.get('default'))
@@ -670,10 +899,43 @@ class LDAPUpdate:
         entry = self._apply_update_disposition(update.get('updates'), entry)
         if entry is None:
             # It might be None if it is just deleting an entry
-            return
+            return None
 
         self.print_entity(entry, "Final value after applying updates")
 
+        return (entry, found)
+
+    def _report_plan(self, plan):
+        """
+        Log the changes the planned updates are going to make, before any
+        of them is made.
+        """
+        mod_names = {
+            ldap.MOD_ADD: 'add',
+            ldap.MOD_DELETE: 'delete',
+            ldap.MOD_REPLACE: 'replace',
+        }
+        for (entry, found) in plan:
+            if not found:
+                if len(entry):
+                    self.info("Planned: add %s", entry.dn)
+                continue
+            try:
+                changes = entry.generate_modlist()
+            except errors.PublicError, e:
+                self.info("Planned: update %s (%s)", entry.dn, e)
+                continue
+            if not changes:
+                continue
+            self.info("Planned: update %s", entry.dn)
+            for (type, attr, values) in changes:
+                self.info("\t%s %s: %s", mod_names.get(type, type), attr,
+                          safe_output(attr, values))
+
+    def _apply_record(self, entry, found):
+        """
+        Add or update entry, as planned by _plan_record.
+        """
         added = False
         updated = False
         if not found:
@@ -684,6 +946,7 @@ class LDAPUpdate:
                         # dn defined. In that case there is nothing to do.
                         # It means the entry doesn't exist, so skip it.
                         try:
+                            self._note_write(entry.itervalues())
                             self.conn.add_entry(entry)
                         except errors.NotFound:
                             # parent entry of the added entry does not exist
@@ -707,6 +970,7 @@ class LDAPUpdate:
                 self.debug("%s" % safe_changes)
                 self.debug("Live %d, updated %d" % (self.live_run, updated))
                 if self.live_run and updated:
+                    self._note_write(values for (type, attr, values) in changes)
                     self.conn.update_entry(entry)
                 self.info("Done")
             except errors.EmptyModlist:
@@ -722,13 +986,37 @@ class LDAPUpdate:
             if updated:
                 self.modified = True
 
-        if entry.dn.endswith(DN(('cn', 'index'), ('cn', 'userRoot'),
-                                ('cn', 'ldbm database'), ('cn', 'plugins'),
-                                ('cn', 'config'))) and (added or updated):
-            taskid = self.create_index_task(entry.single_value['cn'])
-            self.monitor_index_task(taskid)
+        if entry.dn.endswith(self.index_dn) and (added or updated):
+            # Reindexed by _run_index_tasks once all the updates are done
+            attribute = entry.single_value['cn']
+            if attribute not in self.index_attributes:
+                self.index_attributes.append(attribute)
         return
 
+    def _note_write(self, value_lists):
+        """
+        Count a write and remember the DN's among the written values.
+
+        Server plugins change the entries a written value points to, e.g.
+        memberOf adds memberof to the members of a group.
+        """
+        self.write_count += 1
+        for values in value_lists:
+            # values is None when a whole attribute is deleted
+            for value in values or []:
+                if isinstance(value, DN):
+                    self.written_dns.add(value)
+                elif isinstance(value, basestring) and '=' in value:
+                    try:
+                        self.written_dns.add(DN(value))
+                    except ValueError:
+                        pass
+
+    def _update_record(self, update):
+        planned = self._plan_record(update)
+        if planned is not None:
+            self._apply_record(*planned)
+
     def _delete_record(self, updates):
         """
         Run through all the updates again looking for any that should be
@@ -783,16 +1071,52 @@ class LDAPUpdate:
             assert isinstance(dn, DN)
             return len(dn)
 
+        start = time.time()
+        self.search_count = 0
         sorted_updates = sorted(all_updates.iteritems(), key=update_sort_key)
 
+        # Read all the entries and compute their final values first, so
+        # the changes can be reported before any of them is made
+        self._prefetch_entries([update for dn, update in sorted_updates])
+        plan = []
         for dn, update in sorted_updates:
-            self._update_record(update)
+            planned = self._plan_record(update)
+            if planned is not None:
+                plan.append((update, planned))
+        self.prefetched = {}
+        self._report_plan([p for (u, p) in plan])
+
+        write_count = self.write_count
+        self.written_dns = set()
+        for update, planned in plan:
+            (entry, found) = planned
+            if entry.dn in self.written_dns or (
+                    not found and self.write_count != write_count):
+                # An earlier write of this pass may have changed the entry
+                # through a server plugin (memberOf, referential integrity)
+                # or created it (Managed Entries), plan the update anew
+                self.info("Planning %s again, it may have been changed by "
+                          "an earlier update", entry.dn)
+                planned = self._plan_record(update)
+                if planned is None:
+                    continue
+                self._report_plan([planned])
+            self._apply_record(*planned)
+
+        self._run_index_tasks()
 
         # Now run the deletes in reversed order
         sorted_updates.reverse()
         for dn, update in sorted_updates:
             self._delete_record(update)
 
+        if self.pass_files:
+            self.info("Applied updates from %s", ', '.join(
+                os.path.basename(f) for f in self.pass_files))
+            self.pass_files = []
+        self.info("Processed %d updates with %d searches in %.1f seconds",
+                  len(sorted_updates), self.search_count, time.time() - start)
+
     def update(self, files, ordered=False):
         """Execute the update. files is a list of the update files to use.
 
@@ -841,6 +1165,7 @@ class LDAPUpdate:
                     sys.exit(e)
 
                 self.parse_update_file(f, data, all_updates)
+                self.pass_files.append(f)
 
             self._run_updates(all_updates)
         finally:
@@ -30,12 +30,17 @@ Backend plugin for LDAP.
 import os
 import re
 import pwd
+import time
+import threading
 
 import krbV
 import ldap as _ldap
 
+from ipapython import ipautil
 from ipapython.dn import DN
-from ipapython.ipaldap import SASL_GSSAPI, IPASimpleLDAPObject, LDAPClient
+from ipapython.ipaldap import (
+    SASL_GSSAPI, IPASimpleLDAPObject, LDAPClient, schema_cache)
+from ipapython.ipa_log_manager import log_mgr
 
 
 try:
@@ -52,9 +57,261 @@ except ImportError:
         def __init__(self, criticality, authzId=None):
             LDAPControl.__init__(self, '1.3.6.1.4.1.42.2.27.9.5.2', criticality, authzId)
 
+try:
+    from ldap.controls.libldap import MatchedValuesControl #pylint: disable=F0401,E0611
+except ImportError:
+    # python-ldap 2.3.x cannot encode the matched values control, the
+    # direct memberships are then looked up entry by entry
+    MatchedValuesControl = None
+
 from ipalib import api, errors
 from ipalib.crud import CrudBackend
 from ipalib.request import context
+from ipalib.krb_utils import KRB5_CCache
+
+
+class _PooledConnection(object):
+    '''
+    Bookkeeping for a bound connection owned by `LDAPConnectionPool`.
+    '''
+
+    __slots__ = ('conn', 'key', 'created', 'last_used', 'expiration')
+
+    def __init__(self, conn, key, expiration=None):
+        self.conn = conn
+        self.key = key
+        self.created = self.last_used = time.time()
+        self.expiration = expiration
+
+    def expired(self, now, idle_timeout):
+        if self.expiration and now >= self.expiration:
+            return True
+        return now - self.last_used > idle_timeout
+
+
+class LDAPConnectionPool(object):
+    '''
+    Bounded pool of bound LDAP connections.
+
+    Connections are keyed by (ldap_uri, principal) so a connection is
+    only ever handed out to a request authenticated as the principal it
+    was bound as; every request has a ccache of its own so the ccache
+    name is not part of the key. Idle connections are dropped after
+    idle_timeout seconds, when the Kerberos ticket used for the bind
+    expires, or when the pool is full and a newer connection needs the
+    slot (least recently used first). Connections which were idle for
+    more than check_interval seconds are health checked before reuse.
+    '''
+
+    def __init__(self, max_size=0, idle_timeout=60, check_interval=10):
+        self.log = log_mgr.get_logger(self)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._borrowed = {}
+        self.reset_stats()
+
+    def configure(self, max_size=None, idle_timeout=None, check_interval=None):
+        if max_size is not None:
+            self.max_size = int(max_size)
+        if idle_timeout is not None:
+            self.idle_timeout = int(idle_timeout)
+        if check_interval is not None:
+            self.check_interval = int(check_interval)
+        if self.max_size <= 0:
+            self.clear()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.binds = 0
+        self.bind_time = 0.0
+
+    def stats(self):
+        '''
+        Return a dict with the pool counters.
+        '''
+        with self._lock:
+            idle = sum(len(l) for l in self._idle.itervalues())
+            borrowed = len(self._borrowed)
+        if self.binds:
+            bind_time_avg = self.bind_time / self.binds
+        else:
+            bind_time_avg = 0.0
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            idle=idle,
+            borrowed=borrowed,
+            binds=self.binds,
+            bind_time=self.bind_time,
+            bind_time_avg=bind_time_avg,
+        )
+
+    def _close(self, pooled):
+        try:
+            pooled.conn.unbind_s()
+        except _ldap.LDAPError:
+            pass
+
+    def _is_alive(self, conn):
+        try:
+            conn.search_s(DN(), _ldap.SCOPE_BASE, attrlist=['1.1'])
+        except _ldap.LDAPError, e:
+            self.log.debug('pooled LDAP connection failed health check: %s',
+                           e)
+            return False
+        return True
+
+    def acquire(self, key):
+        '''
+        Borrow an idle connection bound for key.
+
+        Returns None when there is no usable connection in the pool; the
+        caller is then expected to bind a new one and `register()` it.
+        '''
+        while True:
+            stale = []
+            pooled = None
+            with self._lock:
+                now = time.time()
+                idle = self._idle.get(key, [])
+                while idle:
+                    candidate = idle.pop()
+                    if candidate.expired(now, self.idle_timeout):
+                        stale.append(candidate)
+                        continue
+                    pooled = candidate
+                    break
+                if not idle:
+                    self._idle.pop(key, None)
+                self.evictions += len(stale)
+            for candidate in stale:
+                self._close(candidate)
+
+            if pooled is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+
+            if (now - pooled.last_used > self.check_interval and
+                    not self._is_alive(pooled.conn)):
+                with self._lock:
+                    self.evictions += 1
+                self._close(pooled)
+                continue
+
+            pooled.last_used = now
+            with self._lock:
+                self._borrowed[id(pooled.conn)] = pooled
+                self.hits += 1
+            return pooled.conn
+
+    def register(self, key, conn, expiration=None, bind_time=None):
+        '''
+        Track a freshly bound connection so `release()` returns it to the
+        pool instead of unbinding it.
+        '''
+        pooled = _PooledConnection(conn, key, expiration)
+        with self._lock:
+            self._borrowed[id(conn)] = pooled
+            if bind_time is not None:
+                self.binds += 1
+                self.bind_time += bind_time
+
+    def release(self, conn):
+        '''
+        Return a borrowed connection to the pool.
+
+        Returns False if conn is not owned by the pool, in which case the
+        caller remains responsible for unbinding it.
+        '''
+        with self._lock:
+            pooled = self._borrowed.pop(id(conn), None)
+        if pooled is None:
+            return False
+
+        broken = False
+        try:
+            # make sure no left-over controls leak to the next borrower
+            conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
+        except _ldap.LDAPError:
+            broken = True
+
+        evicted = []
+        with self._lock:
+            now = time.time()
+            if broken or self.max_size <= 0 or (
+                    pooled.expiration and now >= pooled.expiration):
+                evicted.append(pooled)
+            else:
+                pooled.last_used = now
+                idle = sum(len(l) for l in self._idle.itervalues())
+                while idle >= self.max_size:
+                    oldest = min(
+                        (l[0] for l in self._idle.itervalues()),
+                        key=lambda p: p.last_used)
+                    self._idle[oldest.key].remove(oldest)
+                    if not self._idle[oldest.key]:
+                        del self._idle[oldest.key]
+                    evicted.append(oldest)
+                    idle -= 1
+                self._idle.setdefault(pooled.key, []).append(pooled)
+            self.evictions += len(evicted)
+        for pooled in evicted:
+            self._close(pooled)
+        return True
+
+    def discard(self, conn):
+        '''
+        Forget a borrowed connection without returning it to the pool.
+        '''
+        with self._lock:
+            self._borrowed.pop(id(conn), None)
+
+    def clear(self):
+        '''
+        Unbind and drop all idle connections.
+        '''
+        with self._lock:
+            idle = [p for l in self._idle.itervalues() for p in l]
+            self._idle.clear()
+        for pooled in idle:
+            self._close(pooled)
+
+ldap_pool = LDAPConnectionPool()
+
+# Process wide cache of the IPA configuration entry, see
+# ldap2.get_ipa_config(). Maps ldap_uri to (timestamp, dn, raw attributes).
+_ipa_config_cache = {}
+
+# Callables called with the DN of every entry written through ldap2 in this
+# process, see ldap2.register_write_callback()
+_write_callbacks = []
+
+
+class _EntryCache(object):
+    '''
+    Entries read by `ldap2.get_entry` on one connection during one request.
+
+    Entries are stored as raw values keyed by the lowercase DN and the
+    requested attributes.
+    '''
+
+    __slots__ = ('conn', 'entries', 'hits')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.entries = {}
+        self.hits = 0
 
 
 class ldap2(LDAPClient, CrudBackend):
@@ -62,6 +319,10 @@ class ldap2(LDAPClient, CrudBackend):
     LDAP Backend Take 2.
     """
 
+    # Number of entries whose memberindirect/memberofindirect values are
+    # resolved together by one search, 0 resolves each entry separately
+    indirect_batch_size = 100
+
     def __init__(self, shared_instance=True, ldap_uri=None, base_dn=None,
                  schema=None):
         try:
@@ -80,6 +341,14 @@ class ldap2(LDAPClient, CrudBackend):
         except AttributeError:
             self.base_dn = DN()
 
+        try:
+            ldap_pool.configure(
+                max_size=api.env.ldap_pool_size,
+                idle_timeout=api.env.ldap_pool_idle_timeout)
+            schema_cache.cache_dir = api.env.schema_cache_dir
+        except AttributeError:
+            pass
+
     def _init_connection(self):
         # Connectible.conn is a proxy to thread-local storage;
         # do not set it
@@ -126,6 +395,26 @@ class ldap2(LDAPClient, CrudBackend):
 
         with self.error_handler():
             force_updates = api.env.context in ('installer', 'updates')
+            pool_key = None
+            if ccache is not None:
+                if isinstance(ccache, krbV.CCache):
+                    principal = ccache.principal().name
+                    # Get a fully qualified CCACHE name (schema+name)
+                    # As we do not use the krbV.CCache object later,
+                    # we can safely overwrite it
+                    ccache = "%(type)s:%(name)s" % dict(type=ccache.type,
+                                                        name=ccache.name)
+                else:
+                    principal = krbV.CCache(name=ccache,
+                        context=krbV.default_context()).principal().name
+
+                if self._use_pool(force_updates):
+                    pool_key = (self.ldap_uri, principal)
+                    conn = ldap_pool.acquire(pool_key)
+                    if conn is not None:
+                        setattr(context, 'principal', principal)
+                        return conn
+
             conn = IPASimpleLDAPObject(
                 self.ldap_uri, force_schema_updates=force_updates)
             if self.ldap_uri.startswith('ldapi://') and ccache:
@@ -140,20 +429,16 @@ class ldap2(LDAPClient, CrudBackend):
                 if maxssf < minssf:
                     conn.set_option(_ldap.OPT_X_SASL_SSF_MAX, minssf)
             if ccache is not None:
-                if isinstance(ccache, krbV.CCache):
-                    principal = ccache.principal().name
-                    # Get a fully qualified CCACHE name (schema+name)
-                    # As we do not use the krbV.CCache object later,
-                    # we can safely overwrite it
-                    ccache = "%(type)s:%(name)s" % dict(type=ccache.type,
-                                                        name=ccache.name)
-                else:
-                    principal = krbV.CCache(name=ccache,
-                        context=krbV.default_context()).principal().name
-
-                os.environ['KRB5CCNAME'] = ccache
-                conn.sasl_interactive_bind_s(None, SASL_GSSAPI)
+                start = time.time()
+                with ipautil.krb5ccname(ccache):
+                    conn.sasl_interactive_bind_s(None, SASL_GSSAPI)
                 setattr(context, 'principal', principal)
+
+                if pool_key is not None:
+                    ldap_pool.register(
+                        pool_key, conn,
+                        expiration=self._get_ccache_endtime(ccache),
+                        bind_time=time.time() - start)
             else:
                 # no kerberos ccache, use simple bind or external sasl
                 if autobind:
@@ -165,24 +450,200 @@ class ldap2(LDAPClient, CrudBackend):
 
         return conn
 
+    def _use_pool(self, force_updates):
+        """
+        Return True if bound connections should be borrowed from and
+        returned to `ldap_pool`.
+
+        Only the server uses the pool; installers and updaters need a fresh
+        schema on every bind.
+        """
+        if force_updates or not ldap_pool.enabled:
+            return False
+        return getattr(api.env, 'in_server', False)
+
+    def _get_ccache_endtime(self, ccache):
+        try:
+            return KRB5_CCache(ccache).endtime(api.env.host, api.env.realm)
+        except Exception, e:
+            self.debug('unable to get ticket expiration of %s: %s', ccache, e)
+            return None
+
     def destroy_connection(self):
         """Disconnect from LDAP server."""
+        cache = getattr(context, 'entry_cache', None)
+        if cache is not None and cache.conn is self.conn:
+            if cache.hits:
+                self.debug('entry cache avoided %d searches', cache.hits)
+            delattr(context, 'entry_cache')
+        if ldap_pool.release(self.conn):
+            return
         try:
             self.conn.unbind_s()
         except _ldap.LDAPError:
             # ignore when trying to unbind multiple times
             pass
 
+    def _use_entry_cache(self):
+        """
+        Return True if get_entry should cache entries for the rest of the
+        request.
+
+        Only the server caches entries; installers and updaters run for a
+        long time with no request to limit the lifetime of the cache.
+        """
+        if not getattr(api.env, 'in_server', False):
+            return False
+        if api.env.context in ('installer', 'updates'):
+            return False
+        return getattr(api.env, 'ldap_entry_cache', False)
+
+    def _get_entry_cache(self):
+        """
+        Return the `_EntryCache` of the current request and connection, or
+        None if entries are not cached.
+        """
+        if not self._use_entry_cache():
+            return None
+
+        cache = getattr(context, 'entry_cache', None)
+        if cache is None or cache.conn is not self.conn:
+            cache = _EntryCache(self.conn)
+            context.entry_cache = cache
+        return cache
+
+    def invalidate_entry_cache(self):
+        """
+        Drop all entries cached by get_entry in the current request.
+
+        A single write can change other entries on the server as well
+        (memberOf, referential integrity, managed entries), so the whole
+        cache is dropped rather than the written entry only.
+        """
+        cache = getattr(context, 'entry_cache', None)
+        if cache is not None and cache.conn is self.conn:
+            cache.entries.clear()
+
+    def register_write_callback(self, callback):
+        """
+        Call callback with the DN of every entry written through ldap2 in
+        this process from now on.
+
+        This lets plugins keep data derived from the directory for longer
+        than a request and drop it as soon as this process changes it.
+        """
+        if callback not in _write_callbacks:
+            _write_callbacks.append(callback)
+
+    def _entry_written(self, dn):
+        # Called after every successful write to the entry dn
+        self.invalidate_entry_cache()
+        for callback in _write_callbacks:
+            callback(dn)
+
+    def get_entry(self, dn, attrs_list=None, time_limit=None,
+                  size_limit=None):
+        cache = self._get_entry_cache()
+        if cache is None:
+            return super(ldap2, self).get_entry(
+                dn, attrs_list, time_limit=time_limit, size_limit=size_limit)
+
+        assert isinstance(dn, DN)
+        if attrs_list is not None:
+            key = (str(dn).lower(),
+                   tuple(sorted(attr.lower() for attr in attrs_list)))
+        else:
+            key = (str(dn).lower(), None)
+
+        try:
+            (entry_dn, raw) = cache.entries[key]
+        except KeyError:
+            pass
+        else:
+            cache.hits += 1
+            entry = self.make_entry(entry_dn)
+            for (attr, values) in raw.iteritems():
+                entry.raw[attr] = list(values)
+            entry.reset_modlist()
+            return entry
+
+        entry = super(ldap2, self).get_entry(
+            dn, attrs_list, time_limit=time_limit, size_limit=size_limit)
+        cache.entries[key] = (
+            entry.dn,
+            dict((attr, list(values))
+                 for (attr, values) in entry.raw.iteritems()))
+        return entry
+
+    def add_entry(self, entry, entry_attrs=None):
+        super(ldap2, self).add_entry(entry, entry_attrs)
+        self._entry_written(entry.dn)
+
+    def update_entry_rdn(self, dn, new_rdn, del_old=True):
+        super(ldap2, self).update_entry_rdn(dn, new_rdn, del_old)
+        self._entry_written(dn)
+
+    def update_entry(self, entry, entry_attrs=None):
+        super(ldap2, self).update_entry(entry, entry_attrs)
+        self._entry_written(entry.dn)
+
+    def delete_entry(self, entry_or_dn):
+        super(ldap2, self).delete_entry(entry_or_dn)
+        if isinstance(entry_or_dn, DN):
+            self._entry_written(entry_or_dn)
+        else:
+            self._entry_written(entry_or_dn.dn)
+
     def find_entries(self, filter=None, attrs_list=None, base_dn=None,
                      scope=_ldap.SCOPE_SUBTREE, time_limit=None,
                      size_limit=None, search_refs=False, paged_search=False):
+        time_limit, size_limit = self._get_search_limits(
+            time_limit, size_limit)
+        has_indirect = self._strip_indirect_attrs(attrs_list)
+
+        res, truncated = super(ldap2, self).find_entries(
+            filter=filter, attrs_list=attrs_list, base_dn=base_dn, scope=scope,
+            time_limit=time_limit, size_limit=size_limit,
+            search_refs=search_refs, paged_search=paged_search)
+
+        self._process_indirect(res, has_indirect, time_limit, size_limit)
+
+        return (res, truncated)
+
+    def find_entries_paged(self, filter=None, attrs_list=None, base_dn=None,
+                           scope=_ldap.SCOPE_SUBTREE, time_limit=None,
+                           size_limit=None, search_refs=False):
+        time_limit, size_limit = self._get_search_limits(
+            time_limit, size_limit)
+        has_indirect = self._strip_indirect_attrs(attrs_list)
+
+        pages = super(ldap2, self).find_entries_paged(
+            filter=filter, attrs_list=attrs_list, base_dn=base_dn, scope=scope,
+            time_limit=time_limit, size_limit=size_limit,
+            search_refs=search_refs)
+        try:
+            for (res, truncated) in pages:
+                self._process_indirect(
+                    res, has_indirect, time_limit, size_limit)
+                yield (res, truncated)
+        finally:
+            pages.close()
+
+    def _get_search_limits(self, time_limit, size_limit):
         if time_limit is None or size_limit is None:
             config = self.get_ipa_config()
             if time_limit is None:
                 time_limit = config.get('ipasearchtimelimit', [None])[0]
             if size_limit is None:
                 size_limit = config.get('ipasearchrecordslimit', [None])[0]
+        return (time_limit, size_limit)
 
+    def _strip_indirect_attrs(self, attrs_list):
+        """
+        Remove the virtual memberindirect and memberofindirect attributes
+        from attrs_list and return a (has_memberindirect,
+        has_memberofindirect) tuple.
+        """
         has_memberindirect = False
         has_memberofindirect = False
         if attrs_list:
@@ -192,22 +653,34 @@ class ldap2(LDAPClient, CrudBackend):
             if 'memberofindirect' in attrs_list:
                 has_memberofindirect = True
                 attrs_list.remove('memberofindirect')
+        return (has_memberindirect, has_memberofindirect)
 
-        res, truncated = super(ldap2, self).find_entries(
-            filter=filter, attrs_list=attrs_list, base_dn=base_dn, scope=scope,
-            time_limit=time_limit, size_limit=size_limit,
-            search_refs=search_refs, paged_search=paged_search)
+    def _process_indirect(self, res, has_indirect, time_limit, size_limit):
+        has_memberindirect, has_memberofindirect = has_indirect
+        if not has_memberindirect and not has_memberofindirect:
+            return
 
-        if has_memberindirect or has_memberofindirect:
+        if self.indirect_batch_size > 0 and len(res) > 1:
+            for start in xrange(0, len(res), self.indirect_batch_size):
+                batch = res[start:start + self.indirect_batch_size]
+                if has_memberindirect:
+                    self._process_memberindirect_batch(
+                        batch, time_limit=time_limit,
+                        size_limit=size_limit)
+                if has_memberofindirect:
+                    self._process_memberofindirect_batch(
+                        batch, time_limit=time_limit,
+                        size_limit=size_limit)
+        else:
             for entry in res:
                 if has_memberindirect:
                     self._process_memberindirect(
-                        entry, time_limit=time_limit, size_limit=size_limit)
+                        entry, time_limit=time_limit,
+                        size_limit=size_limit)
                 if has_memberofindirect:
                     self._process_memberofindirect(
-                        entry, time_limit=time_limit, size_limit=size_limit)
-
-        return (res, truncated)
+                        entry, time_limit=time_limit,
+                        size_limit=size_limit)
 
     def _process_memberindirect(self, group_entry, time_limit=None,
                                 size_limit=None):
@@ -262,6 +735,105 @@ class ldap2(LDAPClient, CrudBackend):
         if indirect:
             entry['memberofindirect'] = list(indirect)
 
+    def _find_indirect_batch(self, filter, attrs_list, batch_len,
+                             time_limit=None, size_limit=None,
+                             paged_search=False):
+        # The per-entry searches each had size_limit to themselves, allow
+        # the same total for the combined search.
+        if size_limit:
+            size_limit = int(size_limit) * batch_len
+        try:
+            result, truncated = self.find_entries(
+                base_dn=self.api.env.basedn,
+                filter=filter,
+                attrs_list=attrs_list,
+                time_limit=time_limit,
+                size_limit=size_limit,
+                paged_search=paged_search)
+            if truncated:
+                raise errors.LimitsExceeded()
+        except errors.NotFound:
+            result = []
+        return result
+
+    def _process_memberindirect_batch(self, group_entries, time_limit=None,
+                                      size_limit=None):
+        """
+        Compute memberindirect of several groups with a single search.
+
+        Gives the same result as calling `_process_memberindirect` for each
+        of the entries.
+        """
+        dns = [e.dn for e in group_entries]
+        filter = self.combine_filters(
+            ['(member=*)', self.make_filter({'memberof': dns})],
+            self.MATCH_ALL)
+        result = self._find_indirect_batch(
+            filter, ['member', 'memberof'], len(dns),
+            time_limit=time_limit, size_limit=size_limit, paged_search=True)
+
+        indirect = dict((dn, set()) for dn in dns)
+        for entry in result:
+            members = entry.get('member', [])
+            for dn in entry.get('memberof', []):
+                if dn in indirect:
+                    indirect[dn].update(members)
+
+        for group_entry in group_entries:
+            group_indirect = indirect[group_entry.dn]
+            group_indirect.difference_update(group_entry.get('member', []))
+            if group_indirect:
+                group_entry['memberindirect'] = list(group_indirect)
+
+    def _process_memberofindirect_batch(self, entries, time_limit=None,
+                                        size_limit=None):
+        """
+        Compute memberofindirect of several entries with a single search.
+
+        Gives the same result as calling `_process_memberofindirect` for
+        each of the entries. The matched values control makes the server
+        return only the member values which are DNs of the entries, not
+        the full member lists of the groups.
+        """
+        if MatchedValuesControl is None:
+            for entry in entries:
+                self._process_memberofindirect(
+                    entry, time_limit=time_limit, size_limit=size_limit)
+            return
+
+        member_attrs = ['member', 'memberuser', 'memberhost']
+        dns = [e.dn for e in entries]
+        filter = self.make_filter(dict((a, dns) for a in member_attrs))
+        values_filter = '(%s)' % ''.join(
+            self.make_filter_from_attr(a, dn)
+            for a in member_attrs for dn in dns)
+        # Without support of the control the server returns all values,
+        # the result is the same, only bigger
+        sctrl = [MatchedValuesControl(False, values_filter)]
+        self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, sctrl)
+        try:
+            result = self._find_indirect_batch(
+                filter, member_attrs, len(dns),
+                time_limit=time_limit, size_limit=size_limit)
+        finally:
+            self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
+
+        direct_of = dict((dn, set()) for dn in dns)
+        for group_entry in result:
+            for attr in member_attrs:
+                for dn in group_entry.get(attr, []):
+                    if dn in direct_of:
+                        direct_of[dn].add(group_entry.dn)
+
+        for entry in entries:
+            indirect = set(entry.get('memberof', []))
+            direct = indirect & direct_of[entry.dn]
+            indirect.difference_update(direct)
+
+            entry['memberof'] = list(direct)
+            if indirect:
+                entry['memberofindirect'] = list(indirect)
+
     config_defaults = {'ipasearchtimelimit': [2], 'ipasearchrecordslimit': [0]}
     def get_ipa_config(self, attrs_list=None):
         """Returns the IPA configuration entry (dn, entry_attrs)."""
@@ -276,22 +848,80 @@ class ldap2(LDAPClient, CrudBackend):
         except AttributeError:
             # Not in our context yet
             pass
-        try:
-            (entries, truncated) = self.find_entries(
-                None, attrs_list, base_dn=dn, scope=self.SCOPE_BASE,
-                time_limit=2, size_limit=10
-            )
-            if truncated:
-                raise errors.LimitsExceeded()
-            config_entry = entries[0]
-        except errors.NotFound:
-            config_entry = self.make_entry(dn)
+
+        config_entry = self._get_cached_ipa_config(dn)
+        if config_entry is None:
+            try:
+                (entries, truncated) = self.find_entries(
+                    None, attrs_list, base_dn=dn, scope=self.SCOPE_BASE,
+                    time_limit=2, size_limit=10
+                )
+                if truncated:
+                    raise errors.LimitsExceeded()
+                config_entry = entries[0]
+                if attrs_list is None:
+                    self._cache_ipa_config(config_entry)
+            except errors.NotFound:
+                config_entry = self.make_entry(dn)
         for a in self.config_defaults:
             if a not in config_entry:
                 config_entry[a] = self.config_defaults[a]
         context.config_entry = config_entry
         return config_entry
 
+    def _get_cached_ipa_config(self, dn):
+        """
+        Return a private copy of the configuration entry from the process
+        wide cache, or None if it is not cached or older than the
+        config_cache_ttl setting.
+        """
+        ttl = self._get_config_cache_ttl()
+        if not ttl:
+            return None
+        try:
+            (timestamp, cached_dn, raw) = _ipa_config_cache[self.ldap_uri]
+        except KeyError:
+            return None
+        if cached_dn != dn or time.time() - timestamp > ttl:
+            return None
+
+        config_entry = self.make_entry(dn)
+        for (attr, values) in raw.iteritems():
+            config_entry.raw[attr] = list(values)
+        config_entry.reset_modlist()
+        return config_entry
+
+    def _get_config_cache_ttl(self):
+        # Installers and updaters modify the configuration entry directly,
+        # only the server can rely on config_mod invalidating the cache.
+        if not getattr(api.env, 'in_server', False):
+            return 0
+        if api.env.context in ('installer', 'updates'):
+            return 0
+        return getattr(api.env, 'config_cache_ttl', 0)
+
+    def _cache_ipa_config(self, config_entry):
+        if not self._get_config_cache_ttl():
+            return
+        raw = dict((attr, list(values))
+                   for (attr, values) in config_entry.raw.iteritems())
+        _ipa_config_cache[self.ldap_uri] = (time.time(), config_entry.dn, raw)
+
+    def invalidate_ipa_config(self):
+        """
+        Drop the cached configuration entry, both the copy used by the
+        current request and the one shared by all requests of this
+        process.
+
+        Other processes will pick up the change once their copy is older
+        than config_cache_ttl seconds.
+        """
+        _ipa_config_cache.pop(self.ldap_uri, None)
+        try:
+            delattr(context, 'config_entry')
+        except AttributeError:
+            pass
+
     def has_upg(self):
         """Returns True/False whether User-Private Groups are enabled.
            This is determined based on whether the UPG Template exists.
@@ -326,7 +956,8 @@ class ldap2(LDAPClient, CrudBackend):
             "krbPrincipalAux", base_dn=api.env.basedn)
         sctrl = [GetEffectiveRightsControl(True, "dn: " + str(entry.dn))]
         self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, sctrl)
-        entry = self.get_entry(dn, attrs_list)
+        # bypass the entry cache, the result depends on the control
+        entry = super(ldap2, self).get_entry(dn, attrs_list)
         # remove the control so subsequent operations don't include GER
         self.conn.set_option(_ldap.OPT_SERVER_CONTROLS, [])
         return entry
@@ -415,6 +1046,7 @@ class ldap2(LDAPClient, CrudBackend):
 
         with self.error_handler():
             self.conn.passwd_s(dn, old_pass, new_pass)
+        self._entry_written(dn)
 
     def add_entry_to_group(self, dn, group_dn, member_attr='member', allow_same=False):
         """
@@ -449,6 +1081,39 @@ class ldap2(LDAPClient, CrudBackend):
                 self.conn.modify_s(group_dn, modlist)
         except errors.DatabaseError:
             raise errors.AlreadyGroupMember()
+        self._entry_written(group_dn)
+
+    def add_entries_to_group(self, dns, group_dn, member_attr='member'):
+        """
+        Add the entries designated by dns to group group_dn in the member
+        attribute member_attr with a single modification.
+
+        Entries which are already members are skipped. The entries are not
+        checked for existence.
+        """
+
+        assert isinstance(group_dn, DN)
+        if not dns:
+            return
+
+        self.log.debug(
+            "add_entries_to_group: %d entries group_dn=%s member_attr=%s",
+            len(dns), group_dn, member_attr)
+
+        modlist = [(_ldap.MOD_ADD, member_attr, list(dns))]
+        try:
+            with self.error_handler():
+                self.conn.modify_s(group_dn, modlist)
+        except errors.DatabaseError:
+            # Some of them are members already, add the rest one by one
+            for dn in dns:
+                try:
+                    self.add_entry_to_group(dn, group_dn, member_attr,
+                                            allow_same=True)
+                except (errors.AlreadyGroupMember, errors.NotFound):
+                    pass
+            return
+        self._entry_written(group_dn)
 
     def remove_entry_from_group(self, dn, group_dn, member_attr='member'):
         """Remove entry from group."""
@@ -469,6 +1134,7 @@ class ldap2(LDAPClient, CrudBackend):
                 self.conn.modify_s(group_dn, modlist)
         except errors.MidairCollision:
             raise errors.NotGroupMember()
+        self._entry_written(group_dn)
 
     def set_entry_active(self, dn, active):
         """Mark entry active/inactive."""
@@ -521,6 +1187,7 @@ class ldap2(LDAPClient, CrudBackend):
 
         with self.error_handler():
             self.conn.modify_s(dn, mod)
+        self._entry_written(dn)
 
     # CrudBackend methods
 
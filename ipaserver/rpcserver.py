@@ -30,6 +30,8 @@ import datetime
 import urlparse
 import time
 import json
+import tempfile
+from wsgiref.util import FileWrapper
 
 from ipalib import plugable, capabilities, errors
 from ipalib.backend import Executioner
@@ -38,7 +40,8 @@ from ipalib.errors import (PublicError, InternalError, CommandError, JSONError,
     ExecutionError)
 from ipalib.request import context, destroy_context
 from ipalib.rpc import (xml_dumps, xml_loads,
-    json_encode_binary, json_decode_binary)
+    json_encode_binary, json_decode_binary, json_dumps_binary,
+    NDJSON_CONTENT_TYPE)
 from ipalib.util import parse_time_duration, normalize_name
 from ipapython.dn import DN
 from ipaserver.plugins.ldap2 import ldap2
@@ -290,6 +293,10 @@ class WSGIExecutioner(Executioner):
     """
 
     content_type = None
+    # Content type of streamed search results, None if not supported
+    stream_content_type = None
+    # Streamed results bigger than this are spooled to disk
+    stream_spool_size = 1024 * 1024
     key = ''
 
     _system_commands = {}
@@ -307,10 +314,10 @@ class WSGIExecutioner(Executioner):
         result = None
         error = None
         _id = None
-        lang = os.environ['LANG']
         name = None
         args = ()
         options = {}
+        spool = None
 
         e = None
         if not 'HTTP_REFERER' in environ:
@@ -326,7 +333,9 @@ class WSGIExecutioner(Executioner):
                     reg = lang_reg.split('-')[1].upper();
                 else:
                     reg = lang_.upper()
-                os.environ['LANG'] = '%s_%s' % (lang_, reg)
+                # Messages of this request are translated to the language
+                # of the client, see ipalib.text.create_translation()
+                setattr(context, 'languages', ['%s_%s' % (lang_, reg)])
             if (
                 environ.get('CONTENT_TYPE', '').startswith(self.content_type)
                 and environ['REQUEST_METHOD'] == 'POST'
@@ -339,6 +348,13 @@ class WSGIExecutioner(Executioner):
                 result = self._system_commands[name](self, *args, **options)
             elif name not in self.Command:
                 raise CommandError(name=name)
+            elif (self.stream_requested(environ) and
+                    hasattr(self.Command[name], 'stream')):
+                # Serialize the entries as they are found, the response is
+                # sent from the spool once the request context is gone
+                spool = tempfile.SpooledTemporaryFile(self.stream_spool_size)
+                result = self.Command[name].stream(*args, **options)
+                self.marshal_stream(result, spool)
             else:
                 result = self.Command[name](*args, **options)
         except PublicError, e:
@@ -348,8 +364,6 @@ class WSGIExecutioner(Executioner):
                 'non-public: %s: %s', e.__class__.__name__, str(e)
             )
             error = InternalError()
-        finally:
-            os.environ['LANG'] = lang
 
         principal = getattr(context, 'principal', 'UNKNOWN')
         if name and name in self.Command:
@@ -378,8 +392,21 @@ class WSGIExecutioner(Executioner):
                       name,
                       type(e).__name__)
 
+        if spool is not None:
+            spool.write(self.marshal_stream_end(result, error, _id))
+            spool.seek(0)
+            return spool
+
         return self.marshal(result, error, _id)
 
+    def stream_requested(self, environ):
+        """
+        Return True if the client accepts streamed search results.
+        """
+        if not self.stream_content_type:
+            return False
+        return self.stream_content_type in environ.get('HTTP_ACCEPT', '')
+
     def simple_unmarshal(self, environ):
         name = environ['PATH_INFO'].strip('/')
         options = extract_query(environ)
@@ -394,11 +421,18 @@ class WSGIExecutioner(Executioner):
         try:
             status = HTTP_STATUS_SUCCESS
             response = self.wsgi_execute(environ)
-            headers = [('Content-Type', self.content_type + '; charset=utf-8')]
+            if isinstance(response, basestring):
+                content_type = self.content_type
+                response = [response]
+            else:
+                content_type = self.stream_content_type
+                file_wrapper = environ.get('wsgi.file_wrapper', FileWrapper)
+                response = file_wrapper(response)
+            headers = [('Content-Type', content_type + '; charset=utf-8')]
         except StandardError, e:
             self.exception('WSGI %s.__call__():', self.name)
             status = HTTP_STATUS_SERVER_ERROR
-            response = status
+            response = [status]
             headers = [('Content-Type', 'text/plain; charset=utf-8')]
 
         session_data = getattr(context, 'session_data', None)
@@ -410,7 +444,7 @@ class WSGIExecutioner(Executioner):
             headers.append(('Set-Cookie', session_cookie))
 
         start_response(status, headers)
-        return [response]
+        return response
 
     def unmarshal(self, data):
         raise NotImplementedError('%s.unmarshal()' % self.fullname)
@@ -418,6 +452,12 @@ class WSGIExecutioner(Executioner):
     def marshal(self, result, error, _id=None):
         raise NotImplementedError('%s.marshal()' % self.fullname)
 
+    def marshal_stream(self, stream, out):
+        raise NotImplementedError('%s.marshal_stream()' % self.fullname)
+
+    def marshal_stream_end(self, stream, error, _id=None):
+        raise NotImplementedError('%s.marshal_stream_end()' % self.fullname)
+
 
 class jsonserver(WSGIExecutioner, HTTP_Status):
     """
@@ -429,6 +469,9 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
     """
 
     content_type = 'application/json'
+    stream_content_type = NDJSON_CONTENT_TYPE
+    # Response formats a client can ask for, the first one is the default
+    formats = ('pretty', 'compact')
 
     def __call__(self, environ, start_response):
         '''
@@ -439,7 +482,31 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
         response = super(jsonserver, self).__call__(environ, start_response)
         return response
 
-    def marshal(self, result, error, _id=None):
+    def wsgi_execute(self, environ):
+        # The format can be also requested by the "format" member of the
+        # request, see unmarshal()
+        setattr(context, 'json_format', self.get_accept_format(environ))
+        try:
+            return super(jsonserver, self).wsgi_execute(environ)
+        finally:
+            delattr(context, 'json_format')
+
+    def get_accept_format(self, environ):
+        """
+        Return the response format requested by a
+        ``Accept: application/json; format=compact`` header, or None.
+        """
+        for media_range in environ.get('HTTP_ACCEPT', '').split(','):
+            params = media_range.split(';')
+            if params[0].strip() != self.content_type:
+                continue
+            for param in params[1:]:
+                name, sep, value = param.partition('=')
+                if name.strip() == 'format' and value.strip() in self.formats:
+                    return value.strip()
+        return None
+
+    def _response(self, result, error, _id):
         if error:
             assert isinstance(error, PublicError)
             error = dict(
@@ -448,16 +515,47 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
                 name=unicode(error.__class__.__name__),
             )
         principal = getattr(context, 'principal', 'UNKNOWN')
-        response = dict(
+        return dict(
             result=result,
             error=error,
             id=_id,
             principal=unicode(principal),
             version=unicode(VERSION),
         )
+
+    def marshal(self, result, error, _id=None):
+        response = self._response(result, error, _id)
+        if getattr(context, 'json_format', None) == 'compact':
+            return json_dumps_binary(response)
         response = json_encode_binary(response)
         return json.dumps(response, sort_keys=True, indent=4)
 
+    def marshal_stream(self, stream, out):
+        """
+        Write every entry of stream to out as a single line JSON object
+        ``{"entry": {...}}``.
+        """
+        for entry in stream:
+            out.write(json_dumps_binary(dict(entry=entry)))
+            out.write('\n')
+
+    def marshal_stream_end(self, stream, error, _id=None):
+        """
+        Return the last line of a streamed response. It is a regular
+        JSON-RPC response whose result holds the count, truncated flag and
+        summary of the search.
+        """
+        if error:
+            result = None
+        else:
+            result = dict(
+                count=stream.count,
+                truncated=stream.truncated,
+                summary=stream.summary,
+            )
+        response = self._response(result, error, _id)
+        return json_dumps_binary(response) + '\n'
+
     def unmarshal(self, data):
         try:
             d = json.loads(data)
@@ -484,6 +582,11 @@ class jsonserver(WSGIExecutioner, HTTP_Status):
         if not isinstance(options, dict):
             raise JSONError(error=_('params[1] (aka options) must be a dict'))
         options = dict((str(k), v) for (k, v) in options.iteritems())
+        if 'format' in d:
+            if d['format'] not in self.formats:
+                raise JSONError(error=_('format must be one of %s') %
+                                ', '.join(self.formats))
+            setattr(context, 'json_format', d['format'])
         return (method, args, options, _id)
 
 class AuthManagerKerb(AuthManager):
@@ -22,15 +22,20 @@ Test the `ipaserver/install/ldapupdate.py` module.
 
 import unittest
 import os
+import shutil
+import tempfile
 
+import ldap
 import nose
 
 from ipalib import api
 from ipalib import errors
+from ipaserver.install import ldapupdate
 from ipaserver.install.ldapupdate import LDAPUpdate, BadSyntax
 from ipaserver.install import installutils
 from ipapython import ipautil, ipaldap
 from ipapython.dn import DN
+from ipapython.ipa_log_manager import log_mgr
 
 """
 The updater works through files only so this is just a thin-wrapper controlling
@@ -335,3 +340,315 @@ class test_update(unittest.TestCase):
         with self.assertRaises(errors.NotFound):
             entries = self.ld.get_entries(
                 self.user_dn, self.ld.SCOPE_BASE, 'objectclass=*', ['*'])
+
+    def test_parse_cache(self):
+        """
+        Test that parsed update files are reused but not shared
+        """
+        filename = self.testdir + "1_add.update"
+        data = self.updater.read_file(filename)
+        self.updater.parse_cache_dir = tempfile.mkdtemp()
+        try:
+            first = self.updater.parse_update_file(filename, data, {})
+            for update in first.values():
+                update.setdefault('updates', []).append('add:description:x')
+
+            second = self.updater.parse_update_file(filename, data, {})
+            self.assertEqual(sorted(second),
+                             [self.container_dn, self.user_dn])
+            for update in second.values():
+                self.assertFalse(
+                    'add:description:x' in update.get('updates', []))
+        finally:
+            shutil.rmtree(self.updater.parse_cache_dir)
+
+
+def _copy_attrs(attrs):
+    return dict((attr, list(values)) for (attr, values) in attrs.iteritems())
+
+
+class _FakeEntry(dict):
+    def __init__(self, dn, attrs={}):
+        super(_FakeEntry, self).__init__(_copy_attrs(attrs))
+        self.dn = dn
+        self.reset_modlist()
+
+    @property
+    def single_value(self):
+        return dict((attr, values[0]) for (attr, values) in self.iteritems()
+                    if values)
+
+    def reset_modlist(self):
+        self.orig = _copy_attrs(self)
+
+    def generate_modlist(self):
+        return [(ldap.MOD_REPLACE, attr, values)
+                for (attr, values) in self.iteritems()
+                if self.orig.get(attr) != values]
+
+
+class _FakeConnection(object):
+    """
+    Directory which adds side effects to entry additions, like the
+    memberOf and Managed Entries plugins of the directory server do
+    """
+    MATCH_ALL = '&'
+    MATCH_ANY = '|'
+
+    def __init__(self, entries, side_effects):
+        self.entries = entries
+        self.side_effects = side_effects
+
+    def make_entry(self, dn, **attrs):
+        return _FakeEntry(dn, attrs)
+
+    def make_filter_from_attr(self, attr, value):
+        return '(%s=%s)' % (attr, value)
+
+    def combine_filters(self, filters, rules):
+        return '(%s%s)' % (rules, ''.join(filters))
+
+    def get_entries(self, base_dn, scope, filter, attrs_list):
+        if scope == ldap.SCOPE_BASE:
+            dns = [dn for dn in self.entries if dn == base_dn]
+        else:
+            dns = [dn for dn in self.entries if DN(*dn[1:]) == base_dn]
+        if not dns:
+            raise errors.NotFound(reason='no such entry')
+        return [_FakeEntry(dn, self.entries[dn]) for dn in dns]
+
+    def add_entry(self, entry):
+        if entry.dn in self.entries:
+            raise errors.DuplicateEntry()
+        self.entries[entry.dn] = _copy_attrs(entry)
+        for (dn, attr, values) in self.side_effects.get(entry.dn, []):
+            self.entries.setdefault(dn, {}).setdefault(attr, []).extend(
+                values)
+
+    def update_entry(self, entry):
+        if self.entries[entry.dn] != entry.orig:
+            # the modlist was computed from a stale copy of the entry
+            raise errors.DatabaseError(desc='Type or value exists', info='')
+        self.entries[entry.dn] = _copy_attrs(entry)
+
+
+class _OfflineLDAPUpdate(LDAPUpdate):
+    def __init__(self, conn):
+        log_mgr.get_logger(self, True)
+        self.live_run = True
+        self.conn = conn
+        self.modified = False
+        self.index_attributes = []
+        self.prefetched = {}
+        self.search_count = 0
+        self.write_count = 0
+        self.written_dns = set()
+        self.pass_files = []
+
+
+class test_update_plan(unittest.TestCase):
+    """
+    Test that updates see the changes made earlier in the same pass.
+    """
+
+    def setUp(self):
+        suffix = DN(('dc', 'example'), ('dc', 'com'))
+        container_dn = DN(('cn', 'test'), ('cn', 'accounts'), suffix)
+        self.group_dn = DN(('cn', 'tgroup'), ('cn', 'accounts'), suffix)
+        self.user_dn = DN(('uid', 'tuser'), container_dn)
+        self.managed_dn = DN(('cn', 'tgroup'), container_dn)
+
+        self.conn = _FakeConnection(
+            {self.user_dn: {'objectclass': ['top', 'person'],
+                            'description': ['a']}},
+            {self.group_dn: [
+                (self.user_dn, 'memberof', [str(self.group_dn)]),
+                (self.managed_dn, 'objectclass', ['top', 'nsContainer']),
+            ]})
+
+        self.updater = _OfflineLDAPUpdate(self.conn)
+
+    def test_side_effects(self):
+        self.updater._run_updates({
+            self.group_dn:
+                {'dn': self.group_dn,
+                 'updates': ['add:objectclass: top',
+                             'add:objectclass: groupofnames',
+                             "add:member:'%s'" % self.user_dn]},
+            self.user_dn:
+                {'dn': self.user_dn,
+                 'updates': ['add:description: b']},
+            self.managed_dn:
+                {'dn': self.managed_dn,
+                 'updates': ['add:description: managed']},
+        })
+
+        self.assertEqual(self.conn.entries[self.user_dn], {
+            'objectclass': ['top', 'person'],
+            'description': ['a', 'b'],
+            'memberof': [str(self.group_dn)],
+        })
+        self.assertEqual(self.conn.entries[self.managed_dn], {
+            'objectclass': ['top', 'nsContainer'],
+            'description': ['managed'],
+        })
+
+    def test_prefetch(self):
+        # The entries of a container are read by a single search and
+        # writes which do not refer to them do not make them read again
+        dns = [DN(('uid', 'user%d' % i), *self.user_dn[1:]) for i in range(3)]
+        for dn in dns:
+            self.conn.entries[dn] = {'objectclass': ['top', 'person']}
+        self.updater._run_updates(dict(
+            (dn, {'dn': dn, 'updates': ['add:description: b']})
+            for dn in dns + [self.user_dn]))
+
+        self.assertEqual(self.updater.search_count, 1)
+        self.assertEqual(self.updater.write_count, 4)
+        for dn in dns:
+            self.assertEqual(self.conn.entries[dn]['description'], ['b'])
+
+    def test_report_plan(self):
+        # Every change is reported before the first write, entries which
+        # may have been changed by a write are reported again
+        logged = []
+        self.updater.info = lambda fmt, *args: logged.append(
+            (self.updater.write_count, fmt % args))
+        self.test_side_effects()
+
+        planned = [(writes > 0, msg) for (writes, msg) in logged
+                   if msg.startswith('Planned: ')]
+        self.assertEqual(sorted(planned), [
+            (False, 'Planned: add %s' % self.group_dn),
+            (False, 'Planned: add %s' % self.managed_dn),
+            (False, 'Planned: update %s' % self.user_dn),
+            (True, 'Planned: update %s' % self.managed_dn),
+            (True, 'Planned: update %s' % self.user_dn),
+        ])
+
+
+class _FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class _TaskConnection(_FakeConnection):
+    """
+    Directory whose index tasks report the given statuses, one per poll
+    """
+    def __init__(self, entries, statuses):
+        super(_TaskConnection, self).__init__(entries, {})
+        self.statuses = list(statuses)
+        self.tasks = []
+
+    def add_entry(self, entry):
+        super(_TaskConnection, self).add_entry(entry)
+        if entry.dn.endswith(DN(('cn', 'tasks'), ('cn', 'config'))):
+            self.tasks.append(entry.dn)
+
+    def get_entry(self, dn, attrs_list=None):
+        entry = _FakeEntry(dn, self.entries[dn])
+        entry.update(self.statuses.pop(0))
+        return entry
+
+
+class test_index_task(unittest.TestCase):
+    """
+    Test that the updated index definitions are reindexed by one task.
+    """
+
+    def setUp(self):
+        self.clock = _FakeClock()
+        self.orig_time = ldapupdate.time
+        ldapupdate.time = self.clock
+
+    def tearDown(self):
+        ldapupdate.time = self.orig_time
+
+    def run_updates(self, statuses):
+        conn = _TaskConnection({}, statuses)
+        updater = _OfflineLDAPUpdate(conn)
+        updater.sub_dict = {}
+        logged = []
+        updater.error = lambda *args: logged.append(args)
+
+        updates = {}
+        for attr in ('fqdn', 'ipauniqueid', 'memberof'):
+            dn = DN(('cn', attr), LDAPUpdate.index_dn)
+            updates[dn] = {'dn': dn,
+                           'default': ['objectclass:top',
+                                       'objectclass:nsIndex',
+                                       'cn:%s' % attr,
+                                       'nsindextype:eq']}
+        updater._run_updates(updates)
+        return (conn, logged)
+
+    def test_single_task(self):
+        (conn, logged) = self.run_updates([
+            {},
+            {'nstaskstatus': ['Indexing in progress']},
+            {'nstaskstatus': ['Indexing in progress']},
+            {'nstaskstatus': ['Finished indexing.'],
+             'nstaskexitcode': ['0']},
+        ])
+        self.assertEqual(len(conn.tasks), 1)
+        self.assertEqual(
+            sorted(conn.entries[conn.tasks[0]]['nsIndexAttribute']),
+            ['fqdn', 'ipauniqueid', 'memberof'])
+        self.assertEqual(logged, [])
+        # The task is polled with a growing interval
+        self.assertEqual(self.clock.sleeps, [5, 0.25, 0.5, 1, 2])
+        self.assertEqual(conn.statuses, [])
+
+    def test_failed_task(self):
+        (conn, logged) = self.run_updates([
+            {'nstaskstatus': ['Finished indexing.'],
+             'nstaskexitcode': ['68']},
+        ])
+        self.assertEqual(len(conn.tasks), 1)
+        self.assertEqual(logged,
+                         [('Indexing failed: %s', 'Finished indexing.')])
+
+
+class test_parse_cache_dir(unittest.TestCase):
+    """
+    Test which compiled update files are stored for later runs.
+    """
+
+    def setUp(self):
+        self.suffix = DN(('dc', 'example'), ('dc', 'com'))
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def parse(self, data, time):
+        updater = _OfflineLDAPUpdate(None)
+        updater.sub_dict = {'SUFFIX': self.suffix, 'TIME': time}
+        updater.parse_cache_dir = self.cache_dir
+        return updater.parse_update_file('test.update', data, {})
+
+    def test_time(self):
+        static = ['dn: cn=static, $SUFFIX\n',
+                  'add: description: static\n']
+        task = ['dn: cn=task $TIME, $SUFFIX\n',
+                'add: cn: task $TIME\n']
+
+        self.parse(static, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+        for time in (1, 2, 3):
+            updates = self.parse(task, time)
+            dn = DN(('cn', 'task %d' % time), self.suffix)
+            self.assertEqual(updates.keys(), [dn])
+            self.assertEqual(updates[dn]['updates'],
+                             ['add:cn:task %d' % time])
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
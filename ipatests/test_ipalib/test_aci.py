@@ -0,0 +1,100 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the `ipalib.aci` module.
+"""
+
+from ipatests.util import raises
+from ipalib.aci import ACI
+
+
+def check_aci_parsing(source, expected):
+    a = ACI(source)
+    print 'ACI was: ', a
+    print 'Expected:', expected
+    assert str(ACI(source)) == expected
+
+
+def test_aci_parsing_1():
+    check_aci_parsing('(targetattr="title")(targetfilter="(memberOf=cn=bar,cn=groups,cn=accounts ,dc=example,dc=com)")(version 3.0;acl "foobar";allow (write) groupdn="ldap:///cn=foo,cn=groups,cn=accounts,dc=example,dc=com";)',
+        '(targetattr = "title")(targetfilter = "(memberOf=cn=bar,cn=groups,cn=accounts ,dc=example,dc=com)")(version 3.0;acl "foobar";allow (write) groupdn = "ldap:///cn=foo,cn=groups,cn=accounts,dc=example,dc=com";)')
+
+
+def test_aci_parsing_2():
+    check_aci_parsing('(target="ldap:///uid=bjensen,dc=example,dc=com")(targetattr=*) (version 3.0;acl "aci1";allow (write) userdn="ldap:///self";)',
+        '(targetattr = "*")(target = "ldap:///uid=bjensen,dc=example,dc=com")(version 3.0;acl "aci1";allow (write) userdn = "ldap:///self";)')
+
+
+def test_aci_parsing_3():
+    check_aci_parsing(' (targetattr = "givenName || sn || cn || displayName || title || initials || loginShell || gecos || homePhone || mobile || pager || facsimileTelephoneNumber || telephoneNumber || street || roomNumber || l || st || postalCode || manager || secretary || description || carLicense || labeledURI || inetUserHTTPURL || seeAlso || employeeType  || businessCategory || ou")(version 3.0;acl "Self service";allow (write) userdn = "ldap:///self";)',
+        '(targetattr = "givenName || sn || cn || displayName || title || initials || loginShell || gecos || homePhone || mobile || pager || facsimileTelephoneNumber || telephoneNumber || street || roomNumber || l || st || postalCode || manager || secretary || description || carLicense || labeledURI || inetUserHTTPURL || seeAlso || employeeType || businessCategory || ou")(version 3.0;acl "Self service";allow (write) userdn = "ldap:///self";)')
+
+
+def test_aci_parsing_4():
+    check_aci_parsing('(target="ldap:///uid=*,cn=users,cn=accounts,dc=example,dc=com")(version 3.0;acl "add_user";allow (add) groupdn="ldap:///cn=add_user,cn=taskgroups,dc=example,dc=com";)',
+        '(target = "ldap:///uid=*,cn=users,cn=accounts,dc=example,dc=com")(version 3.0;acl "add_user";allow (add) groupdn = "ldap:///cn=add_user,cn=taskgroups,dc=example,dc=com";)')
+
+
+def test_aci_parsing_5():
+    check_aci_parsing('(targetattr = "userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(version 3.0; acl "change_password"; allow (write) groupdn = "ldap:///cn=change_password,cn=taskgroups,dc=example,dc=com";)',
+        '(targetattr = "userPassword || krbPrincipalKey || sambaLMPassword || sambaNTPassword || passwordHistory")(version 3.0;acl "change_password";allow (write) groupdn = "ldap:///cn=change_password,cn=taskgroups,dc=example,dc=com";)')
+
+
+def test_aci_parsing_6():
+    check_aci_parsing('(targetattr != "userPassword || krbPrincipalKey")(version 3.0; acl "Enable Anonymous access"; allow (read, search, compare) userdn = "ldap:///anyone";)',
+        '(targetattr != "userPassword || krbPrincipalKey")(version 3.0;acl "Enable Anonymous access";allow (read,search,compare) userdn = "ldap:///anyone";)')
+
+
+def test_aci_parsing_7():
+    # Comments are dropped, like shlex does
+    check_aci_parsing('(targetattr = "cn")# a comment\n(version 3.0;acl "x";allow (read) userdn = "ldap:///all";)',
+        '(targetattr = "cn")(version 3.0;acl "x";allow (read) userdn = "ldap:///all";)')
+
+
+def test_aci_parsing_8():
+    a = ACI(u'(targetattr != "userPassword || krbPrincipalKey")(version 3.0; acl "Enable Anonymous access"; allow (read, search, compare) userdn = "ldap:///anyone";)')
+    assert a.name == u'Enable Anonymous access'
+    assert a.target == {
+        'targetattr': {
+            'operator': '!=',
+            'expression': ['userPassword', 'krbPrincipalKey'],
+        },
+    }
+    assert a.action == u'allow'
+    assert a.permissions == [u'read', u'search', u'compare']
+    assert a.bindrule == {
+        'keyword': u'userdn',
+        'operator': u'=',
+        'expression': u'ldap:///anyone',
+    }
+
+
+def check_aci_rejected(exception, source):
+    raises(exception, ACI, source)
+
+
+def test_aci_rejected():
+    for (exception, source) in [
+        (SyntaxError, '(targetattr=a || b)(version 3.0;acl "x";allow (read) userdn="ldap:///all";)'),
+        (SyntaxError, '(targetattr ~ "a")(version 3.0;acl "x";allow (read) userdn="ldap:///all";)'),
+        (SyntaxError, '(targetattr="a")(acl "x";allow (read) userdn="ldap:///all";)'),
+        (SyntaxError, '(targetattr="a")(version 3.0;acl "x";allow (read);)'),
+        (SyntaxError, '(targetattr="a")(version 3.0;acl "x";allow (read) userdn = "ldap:///all")'),
+        (ValueError, '(targetattr="a)(version 3.0;acl "x";allow (read) userdn="ldap:///all";)'),
+        (StopIteration, '(targetattr="a" (version 3.0;acl "x";allow (read) userdn="ldap:///all";)'),
+    ]:
+        yield check_aci_rejected, exception, source
@@ -21,6 +21,7 @@
 Test the `ipalib.backend` module.
 """
 
+import os
 import threading
 from ipatests.util import ClassChecker, raises, create_test_api
 from ipatests.data import unicode_str
@@ -270,3 +271,56 @@ class test_Executioner(ClassChecker):
         expected = dict(result=u'TEST')
         assert expected == o.execute('with_name', name=u'test',
                                      version=API_VERSION)
+
+    def test_create_context(self):
+        """
+        Test that concurrent requests only see their own ccache.
+        """
+        (api, home) = create_test_api(in_server=True)
+
+        binds = []
+        class ldap2(backend.Backend):
+            def connect(self, ccache=None):
+                binds.append((ccache, context.ccache_name))
+        api.register(ldap2)
+
+        class whoami(Command):
+            def execute(self, **options):
+                return dict(result=context.ccache_name)
+        api.register(whoami)
+
+        api.finalize()
+        o = self.cls()
+        o.set_api(api)
+        o.finalize()
+
+        count = 8
+        krb5ccname = os.environ.get('KRB5CCNAME')
+        ready = threading.Semaphore(0)
+        go = threading.Event()
+        results = {}
+
+        def request(i):
+            try:
+                o.create_context(ccache='FILE:/tmp/krbcc_test_%d' % i)
+            finally:
+                ready.release()
+            go.wait()
+            results[i] = o.execute('whoami', version=API_VERSION)
+
+        threads = [threading.Thread(target=request, args=(i,))
+                   for i in xrange(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            ready.acquire()
+        go.set()
+        for t in threads:
+            t.join()
+
+        assert len(binds) == count
+        for (ccache, ccache_name) in binds:
+            assert ccache == ccache_name
+        for i in xrange(count):
+            assert results[i] == dict(result='FILE:/tmp/krbcc_test_%d' % i)
+        assert os.environ.get('KRB5CCNAME') == krb5ccname
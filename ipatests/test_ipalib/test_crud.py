@@ -189,6 +189,45 @@ class test_Search(CrudChecker):
                 assert param.required is False
 
 
+class test_ResultStream(ClassChecker):
+    """
+    Test the `ipalib.crud.ResultStream` class.
+    """
+
+    _cls = crud.ResultStream
+
+    def test_iter(self):
+        """
+        Test the `ipalib.crud.ResultStream.__iter__` method.
+        """
+        pages = [([u'a', u'b'], False), ([u'c'], False), ([], True)]
+        o = self.cls(iter(pages), u'%(count)d matched')
+        assert o.count == 0
+        assert o.summary is None
+        assert list(o) == [u'a', u'b', u'c']
+        assert o.count == 3
+        assert o.truncated is True
+        assert o.summary == u'3 matched'
+
+    def test_close(self):
+        """
+        Test the `ipalib.crud.ResultStream.close` method.
+        """
+        closed = []
+
+        def pages():
+            try:
+                yield ([u'a'], False)
+                yield ([u'b'], False)
+            finally:
+                closed.append(True)
+
+        o = self.cls(pages())
+        assert iter(o).next() == u'a'
+        o.close()
+        assert closed == [True]
+
+
 class test_CrudBackend(ClassChecker):
     """
     Test the `ipalib.crud.CrudBackend` class.
@@ -22,9 +22,13 @@ Test the `ipalib.plugable` module.
 """
 
 import inspect
+import json
+import os
+import sys
+from os import path
 from ipatests.util import raises, no_set, no_del, read_only
 from ipatests.util import getitem, setitem, delitem
-from ipatests.util import ClassChecker, create_test_api
+from ipatests.util import ClassChecker, create_test_api, TempDir
 from ipalib import plugable, errors, text
 
 
@@ -398,6 +402,30 @@ def test_Registrar():
             assert issubclass(klass, base)
 
 
+plugin_package = """
+from ipalib import plugable
+
+api = None
+
+class base(plugable.Plugin):
+    finalize_early = False
+
+class early(plugable.Plugin):
+    pass
+"""
+
+plugin_module = """
+from __future__ import absolute_import
+import %(package)s
+"""
+
+plugin_class = """
+class %(name)s(%(package)s.%(base)s):
+    pass
+%(package)s.api.register(%(name)s, override=%(override)s)
+"""
+
+
 class test_API(ClassChecker):
     """
     Test the `ipalib.plugable.API` class.
@@ -514,3 +542,198 @@ class test_API(ClassChecker):
         assert o.isdone('load_plugins') is True
         e = raises(StandardError, o.load_plugins)
         assert str(e) == 'API.load_plugins() already called'
+
+    def test_on_demand(self):
+        """
+        Test that plugins are instantiated when they are first accessed.
+        """
+        created = []
+
+        class base0(plugable.Plugin):
+            finalize_early = False
+
+            def __init__(self):
+                super(base0, self).__init__()
+                created.append(self.name)
+
+        class plugin0(base0):
+            pass
+
+        class plugin1(base0):
+            pass
+
+        api = plugable.API(base0)
+        api.env.mode = 'unit_test'
+        api.env.in_tree = True
+        api.env.plugins_on_demand = True
+        api.register(plugin0)
+        api.register(plugin1)
+        api.finalize()
+
+        assert created == []
+        assert list(api.base0) == ['plugin0', 'plugin1']
+        assert len(api.base0) == 2
+        assert 'plugin1' in api.base0
+        assert created == []
+
+        inst = api.base0.plugin1
+        assert isinstance(inst, plugin1)
+        assert inst.api is api
+        assert created == ['plugin1']
+        assert api.base0['plugin1'] is inst
+        assert created == ['plugin1']
+
+    def test_finalize(self):
+        """
+        Test that plugins can look each other up while being finalized.
+        """
+        class base0(plugable.Plugin):
+            finalize_early = False
+            value = plugable.Plugin.finalize_attr('value')
+
+        # Like an Object and its Method: the object looks up the method,
+        # which reads an attribute of the object
+        class plugin0(base0):
+            method = plugable.Plugin.finalize_attr('method')
+
+            def _on_finalize(self):
+                self.method = self.api.base0.plugin1
+                self.value = 'plugin0'
+                super(plugin0, self)._on_finalize()
+
+        class plugin1(base0):
+            def _on_finalize(self):
+                self.value = self.api.base0.plugin0.value
+                super(plugin1, self)._on_finalize()
+
+        for on_demand in (False, True):
+            api = plugable.API(base0)
+            api.env.mode = 'unit_test'
+            api.env.in_tree = True
+            api.env.plugins_on_demand = on_demand
+            api.register(plugin0)
+            api.register(plugin1)
+            api.finalize()
+            assert api.base0.plugin0.method is api.base0.plugin1
+            assert api.base0.plugin1.value == 'plugin0'
+
+    def test_import_plugins(self):
+        """
+        Test the `ipalib.plugable.API.import_plugins` method with an index.
+        """
+        tmp = TempDir()
+        package = 'ipa_test_plugins_%d' % os.getpid()
+        subpackage = '%s.plugins' % package
+
+        def write(module, *plugins):
+            content = plugin_module % dict(package=package)
+            content += ''.join(
+                plugin_class % dict(package=package, name=name, base=base,
+                                     override=override)
+                for (name, base, override) in plugins)
+            filename = tmp.join(package, 'plugins', '%s.py' % module)
+            open(filename, 'w').write(content)
+            if path.exists(filename + 'c'):
+                os.remove(filename + 'c')
+
+        def create_api():
+            for name in list(sys.modules):
+                if name.startswith(subpackage + '.'):
+                    del sys.modules[name]
+            pkg = __import__(package)
+            api = plugable.API(pkg.base, pkg.early)
+            api.env.mode = 'unit_test'
+            api.env.in_tree = True
+            api.bootstrap(dot_ipa=tmp.join('.ipa'), plugins_on_demand=True)
+            pkg.api = api
+            api.import_plugins(package)
+            api.finalize()
+            return api
+
+        def imported():
+            return sorted(name[len(subpackage) + 1:] for name in sys.modules
+                          if name.startswith(subpackage + '.'))
+
+        tmp.write(plugin_package, package, '__init__.py')
+        tmp.write('', package, 'plugins', '__init__.py')
+        write('alpha', ('plugin0', 'base', False), ('plugin1', 'base', False))
+        write('beta', ('plugin0', 'base', True))
+        write('gamma', ('early0', 'early', False))
+        sys.path.insert(0, tmp.path)
+        try:
+            # Without an index all modules are imported and indexed
+            api = create_api()
+            assert imported() == ['alpha', 'beta', 'gamma']
+            assert api.base.plugin0.module == subpackage + '.beta'
+            index = json.load(open(tmp.join('.ipa', 'plugin-index')))
+            index = index[subpackage]
+            assert index['early'] == [subpackage + '.gamma']
+            assert index['plugins']['base']['plugin0'] == [
+                subpackage + '.alpha', subpackage + '.beta']
+
+            # With the index only the modules of early plugins are imported,
+            # the others when one of their plugins is looked up
+            api = create_api()
+            assert imported() == ['gamma']
+            assert list(api.base) == ['plugin0', 'plugin1']
+            assert api.early.early0.module == subpackage + '.gamma'
+            assert imported() == ['gamma']
+            assert api.base.plugin1.module == subpackage + '.alpha'
+            assert imported() == ['alpha', 'gamma']
+            # The plugin registered with override=True by a later module
+            # wins
+            assert api.base.plugin0.module == subpackage + '.beta'
+            assert imported() == ['alpha', 'beta', 'gamma']
+
+            # A changed module makes the index stale, it is built again
+            write('alpha', ('plugin0', 'base', False),
+                  ('plugin1', 'base', False), ('plugin2', 'base', False))
+            api = create_api()
+            assert imported() == ['alpha', 'beta', 'gamma']
+            assert list(api.base) == ['plugin0', 'plugin1', 'plugin2']
+            index = json.load(open(tmp.join('.ipa', 'plugin-index')))
+            assert index[subpackage]['plugins']['base']['plugin2'] == [
+                subpackage + '.alpha']
+            api = create_api()
+            assert imported() == ['gamma']
+            assert api.base.plugin2.module == subpackage + '.alpha'
+        finally:
+            sys.path.remove(tmp.path)
+            for name in list(sys.modules):
+                if name == package or name.startswith(package + '.'):
+                    del sys.modules[name]
+
+    def test_plugins(self):
+        """
+        Test the `ipalib.plugable.API.plugins` property.
+        """
+        class base0(plugable.Plugin):
+            pass
+
+        class base1(plugable.Plugin):
+            pass
+
+        class plugin0(base0):
+            pass
+
+        class plugin1(base0, base1):
+            pass
+
+        class plugin2(base1):
+            pass
+
+        api = plugable.API(base0, base1)
+        api.env.mode = 'unit_test'
+        api.env.in_tree = True
+        api.env.plugins_on_demand = True
+        for klass in (plugin0, plugin1, plugin2):
+            api.register(klass)
+        api.finalize()
+
+        plugins = sorted((p.name, p.bases) for p in api.plugins)
+        assert plugins == [
+            ('plugin0', ('base0',)),
+            ('plugin1', ('base0', 'base1')),
+            ('plugin2', ('base1',)),
+        ]
+        assert api.base0.plugin1 is api.base1.plugin1
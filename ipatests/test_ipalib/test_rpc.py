@@ -22,6 +22,8 @@ Test the `ipalib.rpc` module.
 """
 
 from xmlrpclib import Binary, Fault, dumps, loads
+from decimal import Decimal
+import json
 
 import nose
 from ipatests.util import raises, assert_equal, PluginTester, DummyClass
@@ -29,6 +31,7 @@ from ipatests.data import binary_bytes, utf8_bytes, unicode_str
 from ipalib.frontend import Command
 from ipalib.request import context, Connection
 from ipalib import rpc, errors, api, request
+from ipapython.dn import DN
 
 
 std_compound = (binary_bytes, utf8_bytes, unicode_str)
@@ -181,6 +184,71 @@ def test_xml_loads():
         assert type(e.faultString) is unicode
 
 
+def test_json_dumps_binary():
+    """
+    Test the `ipalib.rpc.json_dumps_binary` function.
+    """
+    f = rpc.json_dumps_binary
+    value = dict(
+        result=[binary_bytes, utf8_bytes, unicode_str, None, True, False, 17,
+                1.5, Decimal('3.14'), DN(('cn', 'foo'), ('dc', 'example'))],
+        count=(1, 2),
+        nested={u'a': {'b': [unicode_str]}},
+    )
+    data = f(value)
+    assert '\n' not in data
+    assert_equal(json.loads(data),
+                 json.loads(json.dumps(rpc.json_encode_binary(value))))
+    raises(TypeError, f, object())
+
+
+def test_json_dumps_binary_size():
+    """
+    Test that the compact JSON response is smaller than the pretty one.
+    """
+    entry = {
+        'dn': DN(('uid', 'tuser'), ('cn', 'users'), ('cn', 'accounts'),
+                 ('dc', 'example'), ('dc', 'com')),
+        'uid': (u'tuser',),
+        'cn': (u'Test User',),
+        'memberof_group': (u'ipausers', u'editors'),
+        'krbprincipalkey': (binary_bytes,),
+        'uidnumber': (u'1000',),
+    }
+    response = dict(
+        result=dict(result=[entry] * 20, count=20, truncated=False,
+                    summary=u'20 users matched'),
+        error=None, id=0, principal=u'admin@EXAMPLE.COM', version=u'4.0',
+    )
+
+    pretty = json.dumps(rpc.json_encode_binary(response), sort_keys=True,
+                        indent=4)
+    compact = rpc.json_dumps_binary(response)
+    assert len(compact) < len(pretty)
+    assert_equal(json.loads(compact), json.loads(pretty))
+
+
+def test_iter_lines():
+    """
+    Test the `ipalib.rpc._iter_lines` function.
+    """
+    class response(object):
+        def __init__(self, data):
+            self.data = data
+
+        def read(self, size):
+            (data, self.data) = (self.data[:size], self.data[size:])
+            return data
+
+    data = '{"entry": 1}\n{"entry": 22}\n\n{"result": 333}'
+    expected = ['{"entry": 1}', '{"entry": 22}', '{"result": 333}']
+    for block_size in (1, 5, 8192):
+        assert_equal(list(rpc._iter_lines(response(data), block_size)),
+                     expected)
+        assert_equal(list(rpc._iter_lines(response(data + '\n'), block_size)),
+                     expected)
+
+
 class test_xmlclient(PluginTester):
     """
     Test the `ipalib.rpc.xmlclient` plugin.
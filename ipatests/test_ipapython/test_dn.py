@@ -1820,6 +1820,137 @@ class TestDN(unittest.TestCase):
         self.assertEqual(immutable_dn3, self.dn3)
         self.assertEqual(immutable_dn3, mutable_dn3)
 
+class TestCaching(unittest.TestCase):
+    def setUp(self):
+        self.base_dn = DN(('dc', 'example'), ('dc', 'com'))
+        self.container_dn = DN(('cn', 'users'), ('cn', 'accounts'))
+
+    def test_shared(self):
+        # Immutable components are shared, mutable ones are copied
+        dn = DN(('uid', 'bob'), self.container_dn, self.base_dn)
+        self.assertIs(dn[1], self.container_dn[0])
+        self.assertIs(dn[-1], self.base_dn[-1])
+
+        mutable_dn = EditableDN(dn)
+        self.assertIsNot(mutable_dn[1], dn[1])
+        self.assertIsInstance(mutable_dn[1], EditableRDN)
+        self.assertIsNot(DN(mutable_dn)[1], mutable_dn[1])
+
+        # DN's parsed from the same string share the parsed form
+        dn1 = DN('uid=bob,cn=users,cn=accounts,dc=example,dc=com')
+        dn2 = DN('uid=bob,cn=users,cn=accounts,dc=example,dc=com')
+        self.assertEqual(dn1, dn)
+        self.assertIs(dn1._parsed, dn2._parsed)
+        self.assertIsNot(dn1.rdns, dn2.rdns)
+
+    def test_mutable(self):
+        # Mutable objects must not cache their string or key
+        dn = EditableDN(('uid', 'bob'), self.base_dn)
+        self.assertEqual(str(dn), 'uid=bob,dc=example,dc=com')
+        self.assertEqual(dn, DN('uid=bob,dc=example,dc=com'))
+        dn[0] = ('uid', 'alice')
+        self.assertEqual(str(dn), 'uid=alice,dc=example,dc=com')
+        self.assertEqual(dn, DN('uid=alice,dc=example,dc=com'))
+        dn[0].value = 'carol'
+        self.assertEqual(str(dn), 'uid=carol,dc=example,dc=com')
+        self.assertEqual(dn, DN('uid=carol,dc=example,dc=com'))
+
+    def test_concat(self):
+        dn = DN(('uid', 'bob'))
+        self.assertEqual(str(dn), 'uid=bob')
+        dn2 = dn + self.base_dn
+        self.assertEqual(str(dn), 'uid=bob')
+        self.assertEqual(str(dn2), 'uid=bob,dc=example,dc=com')
+        self.assertEqual(hash(dn2), hash(DN('UID=Bob,DC=example,DC=com')))
+
+    def test_threads(self):
+        # A parsed DN can be used by several threads while its RDN's are
+        # created
+        import sys
+        import threading
+        dn_str = 'uid=bob,cn=users,cn=accounts,dc=example,dc=com'
+        dns = [DN(dn_str) for i in xrange(2000)]
+        errors = []
+
+        def use():
+            try:
+                for dn in dns:
+                    self.assertEqual(len(dn), 5)
+                    self.assertEqual(dn[0].value, 'bob')
+                    dn._get_key()
+                    str(dn)
+            except Exception, e:
+                errors.append(e)
+
+        interval = sys.getcheckinterval()
+        sys.setcheckinterval(1)
+        try:
+            threads = [threading.Thread(target=use) for i in xrange(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setcheckinterval(interval)
+        self.assertEqual(errors, [])
+        self.assertEqual(dns[0], DN(dn_str))
+
+class TestParser(unittest.TestCase):
+    def setUp(self):
+        base = 'dc=idm,dc=lab,dc=bos,dc=redhat,dc=com'
+        self.corpus = []
+        for i in xrange(2000):
+            self.corpus.extend([
+                'uid=user%d,cn=users,cn=accounts,%s' % (i, base),
+                'cn=group%d,cn=groups,cn=accounts,%s' % (i, base),
+                'fqdn=host%d.idm.lab.bos.redhat.com,cn=computers,'
+                'cn=accounts,%s' % (i, base),
+                'krbprincipalname=HTTP/host%d.idm.lab.bos.redhat.com@'
+                'IDM.LAB.BOS.REDHAT.COM,cn=services,cn=accounts,%s' % (
+                    i, base),
+                'ipaUniqueID=%08x-cafe-11e2-b3b9-001a4a0c2b%02x,cn=hbac,%s' % (
+                    i, i % 256, base),
+                'cn=System: Read Users %d,cn=permissions,cn=pbac,%s' % (
+                    i, base),
+            ])
+        self.corpus.extend([
+            '',
+            'CN=Mixed Case,DC=Example,DC=Com',
+            'cn=Bob+ou=people,dc=example,dc=com',
+            'ou=people+cn=Bob,dc=example,dc=com',
+            'cn=R\\,W privilege,cn=privileges,%s' % base,
+            'cn=R\\2cW privilege,cn=privileges,%s' % base,
+            'cn=Bob , dc=example, dc=com',
+            'cn=\\#hash\\ ,dc=example,dc=com',
+            'cn=a\\=b,dc=example,dc=com',
+            'cn=\xd9\x85\xd9\x83,dc=example,dc=com',
+            '2.5.4.3=oid,dc=example,dc=com',
+            'cn=,dc=x',
+            'cn=+sn=x,dc=example,dc=com',
+            'sn=x+cn=,dc=example,dc=com',
+        ])
+        self.corpus = [dn_str.decode('utf-8') for dn_str in self.corpus]
+
+    def test_corpus(self):
+        # Every DN must parse and serialize exactly as str2dn/dn2str do
+        from ldap.dn import str2dn, dn2str
+        for dn_str in self.corpus:
+            dn_list = str2dn(dn_str.encode('utf-8'))
+            dn = DN(dn_str)
+            self.assertEqual(str(dn), str(DN(*[RDN(*[(attr, value)
+                for (attr, value, flags) in rdn]) for rdn in dn_list])))
+            self.assertEqual(len(dn), len(dn_list))
+            for (rdn, rdn_list) in zip(dn, dn_list):
+                self.assertEqual(
+                    sorted((ava.attr, ava.value) for ava in rdn),
+                    sorted((attr.decode('utf-8'), value.decode('utf-8'))
+                           for (attr, value, flags) in rdn_list))
+            if len(dn_list) and all(len(rdn) == 1 for rdn in dn_list):
+                self.assertEqual(str(dn), dn2str(dn_list))
+            self.assertEqual(DN(dn_str), EditableDN(dn_str))
+            self.assertEqual(str(DN(dn_str)), str(EditableDN(dn_str)))
+            self.assertEqual(hash(DN(dn_str)), hash(DN(dn_str)))
+
 class TestEscapes(unittest.TestCase):
     def setUp(self):
         self.privilege = 'R,W privilege'
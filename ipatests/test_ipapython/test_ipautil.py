@@ -20,6 +20,10 @@
 Test the `ipapython/ipautil.py` module.
 """
 
+import os
+import threading
+import time
+
 import nose
 
 from ipapython import ipautil
@@ -406,3 +410,28 @@ class TestTimeParser(object):
         nose.tools.assert_equal(-30, time.tzinfo.minoffset)
         offset = time.tzinfo.utcoffset(time.tzinfo.dst())
         nose.tools.assert_equal(((24 - 9) * 60 * 60) - (30 * 60), offset.seconds)
+
+
+def test_krb5ccname():
+    krb5ccname = os.environ.get('KRB5CCNAME')
+    seen = {}
+
+    def request(i):
+        ccache = 'FILE:/tmp/krbcc_test_%d' % i
+        with ipautil.krb5ccname(ccache):
+            time.sleep(0.01)
+            seen[i] = os.environ['KRB5CCNAME']
+            with ipautil.krb5ccname(ccache + '_nested'):
+                assert os.environ['KRB5CCNAME'] == ccache + '_nested'
+            assert os.environ['KRB5CCNAME'] == ccache
+
+    threads = [threading.Thread(target=request, args=(i,))
+               for i in xrange(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in xrange(8):
+        nose.tools.assert_equal(seen[i], 'FILE:/tmp/krbcc_test_%d' % i)
+    nose.tools.assert_equal(os.environ.get('KRB5CCNAME'), krb5ccname)
@@ -0,0 +1,132 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the Kerberos credentials used by the `ipaserver.dcerpc` module.
+
+The Samba calls are replaced by fakes which record the ccache named by
+KRB5CCNAME when they are made.
+"""
+
+import os
+
+import nose
+
+from ipalib.request import context
+
+try:
+    from ipaserver import dcerpc
+except ImportError:
+    have_dcerpc = False
+else:
+    have_dcerpc = True
+
+ccache_name = 'FILE:/tmp/krbcc_test_dcerpc'
+
+seen = []
+
+
+def record(call):
+    seen.append((call, os.environ.get('KRB5CCNAME')))
+
+
+class FakeCredentials(object):
+    def set_kerberos_state(self, state):
+        pass
+
+    def guess(self, parm):
+        record('guess')
+
+    def set_workstation(self, workstation):
+        pass
+
+
+class FakeLoadParm(object):
+    def load(self, filename):
+        pass
+
+    def set(self, name, value):
+        pass
+
+
+class FakeNet(object):
+    def __init__(self, creds, lp):
+        pass
+
+    def finddc(self, domain, flags):
+        record('finddc')
+        return FakeDC(domain)
+
+
+class FakeDC(object):
+    def __init__(self, domain):
+        self.domain_name = u'AD'
+        self.dns_domain = domain
+        self.pdc_dns_name = u'dc.%s' % domain
+
+
+class FakeTrustDomainInstance(object):
+    def __init__(self, hostname):
+        self.parm = FakeLoadParm()
+        self.hostname = hostname
+
+    def retrieve(self, remote_host):
+        record('retrieve')
+
+
+class test_request_ccache(object):
+    """
+    Test that the Samba credentials use the ccache of the request.
+    """
+
+    def setUp(self):
+        if not have_dcerpc:
+            raise nose.SkipTest('Samba bindings are not available')
+        self.saved = dict((name, getattr(dcerpc, name)) for name in
+                          ('param', 'net', 'TrustDomainInstance'))
+        self.saved_credentials = dcerpc.credentials.Credentials
+        dcerpc.param = type('param', (), dict(LoadParm=FakeLoadParm))
+        dcerpc.net = type('net', (), dict(Net=FakeNet))
+        dcerpc.TrustDomainInstance = FakeTrustDomainInstance
+        dcerpc.credentials.Credentials = FakeCredentials
+        self.krb5ccname = os.environ.get('KRB5CCNAME')
+        context.ccache_name = ccache_name
+        del seen[:]
+
+    def tearDown(self):
+        for (name, value) in self.saved.iteritems():
+            setattr(dcerpc, name, value)
+        dcerpc.credentials.Credentials = self.saved_credentials
+        del context.ccache_name
+        assert os.environ.get('KRB5CCNAME') == self.krb5ccname
+
+    def test_local_domain(self):
+        joins = dcerpc.TrustDomainJoins.__new__(dcerpc.TrustDomainJoins)
+        joins.local_flatname = u'IPA'
+        joins._TrustDomainJoins__populate_local_domain()
+        assert seen == [('guess', ccache_name), ('retrieve', ccache_name)]
+
+    def test_trusted_domain_gc_list(self):
+        validator = dcerpc.DomainValidator.__new__(dcerpc.DomainValidator)
+        validator.flatname = u'IPA'
+        validator._info = {}
+        validator._creds = None
+        validator._parm = None
+        validator._domains = {u'ad.test': u'AD'}
+        info = validator._DomainValidator__retrieve_trusted_domain_gc_list(
+            u'ad.test')
+        assert info['gc'] == [(u'dc.ad.test', 3268)]
+        assert seen == [('guess', ccache_name), ('finddc', ccache_name)]
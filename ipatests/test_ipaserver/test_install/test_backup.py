@@ -0,0 +1,487 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests for the archive handling of the `ipaserver.install.ipa_backup` and
+`ipaserver.install.ipa_restore` modules.
+
+These tests do not need a server, the archives are written to and read
+from a temporary directory.
+"""
+
+import os
+import pwd
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import contextlib
+import subprocess
+from cStringIO import StringIO
+from ConfigParser import SafeConfigParser
+
+import ldap
+import ldif
+
+from ipalib import errors
+from ipapython import admintool
+from ipapython.dn import DN, RDN
+from ipapython.ipa_log_manager import root_logger
+from ipaserver.install import ipa_backup, ipa_restore
+from ipaserver.install.ipa_backup import Pipeline, HashedFile
+from ipatests.util import raises
+
+
+def test_hashed_file():
+    data = 'x' * 1000 + 'y' * 1000
+    hashed = HashedFile(StringIO(data))
+    chunks = []
+    while True:
+        chunk = hashed.read(300)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    assert ''.join(chunks) == data
+    assert hashed.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+class test_Pipeline(object):
+    """
+    Test the `ipaserver.install.ipa_backup.Pipeline` class.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, commands, data):
+        pipeline = Pipeline(commands, subprocess.PIPE,
+                            open(self.filename, 'wb'))
+        pipeline.stdin.write(data)
+        pipeline.close()
+
+    def read(self, commands):
+        pipeline = Pipeline(commands, open(self.filename, 'rb'),
+                            subprocess.PIPE)
+        data = pipeline.stdout.read()
+        pipeline.close()
+        return data
+
+    def test_no_commands(self):
+        self.write([], 'data')
+        with open(self.filename) as f:
+            assert f.read() == 'data'
+        assert self.read([]) == 'data'
+
+    def test_commands(self):
+        data = 'data\n' * 10000
+        self.write([ipa_backup.compression_args('gz'), ['/bin/cat']], data)
+        with open(self.filename) as f:
+            assert f.read() != data
+        assert self.read([
+            ['/bin/cat'],
+            ipa_backup.compression_args('gz', decompress=True)]) == data
+
+    def test_failure(self):
+        self.write([], 'data')
+        fail = ['/bin/sh', '-c', 'cat >/dev/null; echo broken >&2; exit 3']
+
+        pipeline = Pipeline([fail, ['/bin/cat']], open(self.filename, 'rb'),
+                            subprocess.PIPE)
+        e = raises(admintool.ScriptError, pipeline.close)
+        assert e.msg == '/bin/sh returned 3: broken\n'
+
+        # without check the failure is only logged
+        pipeline = Pipeline([fail], open(self.filename, 'rb'),
+                            subprocess.PIPE)
+        pipeline.close(check=False)
+
+
+class test_extract_backup(object):
+    """
+    Test the `ipaserver.install.ipa_restore.Restore.extract_backup` method.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.backup_dir = os.path.join(self.tmpdir, 'ipa-data-backup')
+        os.mkdir(self.backup_dir)
+        self.top_dir = os.path.join(self.tmpdir, 'restore')
+        os.mkdir(self.top_dir)
+        self.ds_user = ipa_restore.DS_USER
+        ipa_restore.DS_USER = pwd.getpwuid(os.getuid()).pw_name
+
+    def tearDown(self):
+        ipa_restore.DS_USER = self.ds_user
+        shutil.rmtree(self.tmpdir)
+
+    def write_backup(self, files, compression='gz', links=()):
+        """
+        Write the archive of a data backup the way ipa-backup does and
+        return its manifest.
+        """
+        commands = []
+        args = ipa_backup.compression_args(compression)
+        if args is not None:
+            commands.append(args)
+        filename = os.path.join(self.backup_dir, 'ipa-data.tar')
+        manifest = {}
+        pipeline = Pipeline(commands, subprocess.PIPE, open(filename, 'wb'))
+        try:
+            tar = tarfile.open(mode='w|', fileobj=pipeline.stdin)
+            for (name, target) in links:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.type = tarfile.SYMTYPE
+                tarinfo.linkname = target
+                tar.addfile(tarinfo)
+            for (name, data) in files:
+                tarinfo = tarfile.TarInfo(name)
+                if data is None:
+                    tarinfo.type = tarfile.DIRTYPE
+                    tar.addfile(tarinfo)
+                    continue
+                tarinfo.size = len(data)
+                hashed = HashedFile(StringIO(data))
+                tar.addfile(tarinfo, hashed)
+                manifest[name] = ('sha256', hashed.hexdigest(), len(data))
+            tar.close()
+        finally:
+            pipeline.close()
+        return manifest
+
+    def restore(self, manifest, compression='gz'):
+        restore = ipa_restore.Restore.__new__(ipa_restore.Restore)
+        restore.log = root_logger
+        restore.backup_dir = self.backup_dir
+        restore.backup_type = 'DATA'
+        restore.backup_compression = compression
+        restore.backup_manifest = manifest
+        restore.top_dir = self.top_dir
+        restore.dir = os.path.join(self.top_dir, 'ipa')
+        return restore
+
+    def extracted(self):
+        result = {}
+        for root, dirs, files in os.walk(os.path.join(self.top_dir, 'ipa')):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path) as f:
+                    result[os.path.relpath(path, self.top_dir)] = f.read()
+        return result
+
+    def test_extract(self):
+        files = [('userRoot.ldif', 'dn: dc=example\n'),
+                 ('files.tar', 'files'),
+                 ('ipaca', None),
+                 ('ipaca/ipaca.ldif', 'dn: o=ipaca\n')]
+        for compression in ('gz', 'none'):
+            manifest = self.write_backup(files, compression)
+            self.restore(manifest, compression).extract_backup()
+            assert self.extracted() == {
+                'ipa/userRoot.ldif': 'dn: dc=example\n',
+                'ipa/files.tar': 'files',
+                'ipa/ipaca/ipaca.ldif': 'dn: o=ipaca\n',
+            }
+            shutil.rmtree(os.path.join(self.top_dir, 'ipa'))
+
+        # backups without a manifest are extracted without verification
+        self.write_backup(files)
+        self.restore(None).extract_backup()
+        assert len(self.extracted()) == 3
+
+    def test_members(self):
+        files = [('userRoot.ldif', 'dn: dc=example\n'),
+                 ('files.tar', 'files')]
+        manifest = self.write_backup(files)
+        self.restore(manifest).extract_backup(
+            members=lambda name: name.endswith('.ldif'))
+        assert self.extracted() == {'ipa/userRoot.ldif': 'dn: dc=example\n'}
+
+    def test_manifest(self):
+        files = [('userRoot.ldif', 'dn: dc=example\n'),
+                 ('files.tar', 'files')]
+        manifest = self.write_backup(files)
+
+        modified = dict(manifest)
+        modified['files.tar'] = ('sha256', '0' * 64, 5)
+        e = raises(admintool.ScriptError,
+                   self.restore(modified).extract_backup)
+        assert e.msg == 'Checksum of files.tar does not match the backup manifest'
+
+        modified = dict(manifest)
+        del modified['userRoot.ldif']
+        e = raises(admintool.ScriptError,
+                   self.restore(modified).extract_backup)
+        assert e.msg == 'userRoot.ldif is not in the backup manifest'
+
+        modified = dict(manifest)
+        modified['ipaca.ldif'] = ('sha256', '0' * 64, 5)
+        e = raises(admintool.ScriptError,
+                   self.restore(modified).extract_backup)
+        assert e.msg.endswith('ipa-data.tar is missing ipaca.ldif')
+
+    def test_unsafe_members(self):
+        manifest = self.write_backup([('../userRoot.ldif', 'dn: dc=x\n')])
+        e = raises(admintool.ScriptError,
+                   self.restore(manifest).extract_backup)
+        assert e.msg == 'Invalid file name ../userRoot.ldif in backup'
+
+        # a link would let the next file be written outside of the
+        # restore directory
+        manifest = self.write_backup([('link/userRoot.ldif', 'dn: dc=x\n')],
+                                     links=[('link', self.tmpdir)])
+        e = raises(admintool.ScriptError,
+                   self.restore(manifest).extract_backup)
+        assert e.msg == 'Unsupported type of file link in backup'
+        assert not os.path.exists(os.path.join(self.tmpdir, 'userRoot.ldif'))
+
+
+class FakeEntry(object):
+    def __init__(self, dn, **attrs):
+        self.dn = dn
+        self.raw = dict((k, list(v)) for (k, v) in attrs.iteritems())
+
+    @property
+    def single_value(self):
+        return dict((k, v[0]) for (k, v) in self.raw.iteritems())
+
+
+class FakeConnection(object):
+    """
+    Directory the changes of incremental backups are replayed to, the
+    entries are kept in a dict by DN and the changes are recorded.
+    """
+    SCOPE_SUBTREE = 2
+
+    def __init__(self, entries=(), agreements=()):
+        self.entries = dict((e.dn, e) for e in entries)
+        self.agreements = agreements
+        self.changes = []
+        self.conn = self
+
+    def get_entries(self, base_dn, scope=None, filter=None, attrs_list=None):
+        if not self.agreements:
+            raise errors.NotFound(reason='no agreements')
+        return [FakeEntry(DN(('cn', host), base_dn), nsds5replicahost=[host])
+                for host in self.agreements]
+
+    def _copy(self, entry, attrs_list):
+        # nsUniqueId is an operational attribute
+        attrs = dict((k, v) for (k, v) in entry.raw.iteritems()
+                     if k != 'nsuniqueid' or k in attrs_list)
+        return FakeEntry(entry.dn, **attrs)
+
+    def get_entry(self, dn, attrs_list=None):
+        try:
+            return self._copy(self.entries[dn], attrs_list)
+        except KeyError:
+            raise errors.NotFound(reason='%s not found' % dn)
+
+    def find_entries(self, filter=None, attrs_list=None, base_dn=None):
+        for entry in self.entries.itervalues():
+            if filter == '(nsuniqueid=%s)' % entry.single_value['nsuniqueid']:
+                return ([self._copy(entry, attrs_list)], False)
+        raise errors.NotFound(reason='%s not found' % filter)
+
+    @contextlib.contextmanager
+    def error_handler(self):
+        yield
+
+    def delete_entry(self, dn):
+        self.changes.append(('delete', str(dn)))
+        del self.entries[dn]
+
+    def rename_s(self, dn, newrdn, newsuperior=None):
+        self.changes.append(('rename', str(dn), str(newrdn), newsuperior))
+        entry = self.entries.pop(dn)
+        entry.dn = DN(newrdn, newsuperior or DN(*dn[1:]))
+        self.entries[entry.dn] = entry
+
+    def add_s(self, dn, modlist):
+        self.changes.append(('add', str(dn), sorted(modlist)))
+
+    def modify_s(self, dn, modlist):
+        self.changes.append(('modify', str(dn), sorted(modlist)))
+
+
+suffix = DN(('dc', 'example'), ('dc', 'com'))
+users = DN(('cn', 'users'), suffix)
+groups = DN(('cn', 'groups'), suffix)
+
+
+def make_backup(conn):
+    backup = ipa_backup.Backup.__new__(ipa_backup.Backup)
+    backup.log = root_logger
+    backup._conn = conn
+    return backup
+
+
+def test_tombstone_target():
+    target = make_backup(None)._Backup__tombstone_target
+    uniqueid = '8f4a4d01-1dd211b2-a0b9e4f1-a8e10000'
+    assert target(FakeEntry(
+        DN(RDN(('nsuniqueid', uniqueid), ('uid', 'jdoe')), users),
+        nsuniqueid=[uniqueid])) == DN(('uid', 'jdoe'), users)
+    assert target(FakeEntry(
+        DN(('nsuniqueid', uniqueid), ('uid', 'jdoe'), users),
+        nsuniqueid=[uniqueid])) == DN(('uid', 'jdoe'), users)
+    # the replica update vector
+    assert target(FakeEntry(
+        DN(('nsuniqueid', 'ffffffff-ffffffff-ffffffff-ffffffff'), suffix),
+        nsuniqueid=['FFFFFFFF-FFFFFFFF-FFFFFFFF-FFFFFFFF'])) is None
+
+
+def test_check_replication_agreements():
+    make_backup(FakeConnection()).check_replication_agreements()
+
+    backup = make_backup(FakeConnection(
+        agreements=['replica2.example.com', 'replica1.example.com']))
+    e = raises(admintool.ScriptError, backup.check_replication_agreements)
+    assert e.msg == ('Incremental backups are not supported on servers with '
+                     'replication agreements (replica1.example.com, '
+                     'replica2.example.com), make a data backup instead')
+
+
+class test_get_backup_chain(object):
+    """
+    Test the `ipaserver.install.ipa_restore.Restore.get_backup_chain` method.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_header(self, name, parent=None):
+        os.mkdir(os.path.join(self.tmpdir, name))
+        config = SafeConfigParser()
+        config.add_section('ipa')
+        config.set('ipa', 'type', 'DATA')
+        if parent is not None:
+            config.set('ipa', 'incremental', parent)
+        with open(os.path.join(self.tmpdir, name, 'header'), 'w') as fd:
+            config.write(fd)
+
+    def get_backup_chain(self, name, parent):
+        restore = ipa_restore.Restore.__new__(ipa_restore.Restore)
+        restore.backup_dir = os.path.join(self.tmpdir, name)
+        restore.backup_incremental = parent
+        return [os.path.basename(path)
+                for path in restore.get_backup_chain()]
+
+    def test_chain(self):
+        self.write_header('ipa-data')
+        self.write_header('ipa-incr-1', 'ipa-data')
+        self.write_header('ipa-incr-2', 'ipa-incr-1')
+        assert self.get_backup_chain('ipa-data', None) == ['ipa-data']
+        assert self.get_backup_chain('ipa-incr-2', 'ipa-incr-1') == [
+            'ipa-data', 'ipa-incr-1', 'ipa-incr-2']
+
+    def test_broken_chain(self):
+        self.write_header('ipa-incr-1', 'ipa-data')
+        self.write_header('ipa-incr-2', 'ipa-incr-1')
+        e = raises(admintool.ScriptError,
+                   self.get_backup_chain, 'ipa-incr-2', 'ipa-incr-1')
+        assert e.msg == 'Unable to find backup ipa-data which ipa-incr-1 is based on'
+
+        # a backup based on itself
+        self.write_header('ipa-incr-3', 'ipa-incr-3')
+        e = raises(admintool.ScriptError,
+                   self.get_backup_chain, 'ipa-incr-3', 'ipa-incr-3')
+        assert e.msg == 'Unable to find backup ipa-incr-3 which ipa-incr-3 is based on'
+
+
+class test_replay(object):
+    """
+    Test the replay of the changes of an incremental backup by
+    `ipaserver.install.ipa_restore.Restore`.
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.restore = ipa_restore.Restore.__new__(ipa_restore.Restore)
+        self.restore.log = root_logger
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_ldif(self, records):
+        filename = os.path.join(self.tmpdir, 'changes.ldif')
+        with open(filename, 'w') as fd:
+            writer = ldif.LDIFWriter(fd)
+            for (dn, attrs) in records:
+                writer.unparse(str(dn), attrs)
+        return filename
+
+    def test_replay_deleted(self):
+        conn = FakeConnection([
+            FakeEntry(DN(('cn', 'sub'), users), nsuniqueid=['u1']),
+            FakeEntry(DN(('uid', 'child'), ('cn', 'sub'), users),
+                      nsuniqueid=['u2']),
+            FakeEntry(DN(('uid', 'recreated'), users), nsuniqueid=['u4']),
+        ])
+        filename = self.write_ldif([
+            (DN(('cn', 'sub'), users), {'nsUniqueId': ['U1']}),
+            (DN(('uid', 'child'), ('cn', 'sub'), users),
+             {'nsUniqueId': ['u2']}),
+            (DN(('uid', 'missing'), users), {'nsUniqueId': ['u3']}),
+            (DN(('uid', 'recreated'), users), {'nsUniqueId': ['u3']}),
+        ])
+        self.restore._Restore__replay_deleted(conn, filename)
+        # children first, re-created entries are kept
+        assert conn.changes == [
+            ('delete', str(DN(('uid', 'child'), ('cn', 'sub'), users))),
+            ('delete', str(DN(('cn', 'sub'), users))),
+        ]
+
+    def test_replay_changed(self):
+        conn = FakeConnection([
+            FakeEntry(DN(('uid', 'old'), users), nsuniqueid=['u2'],
+                      uid=['old']),
+            FakeEntry(DN(('uid', 'moved'), users), nsuniqueid=['u3'],
+                      uid=['moved']),
+            FakeEntry(DN(('uid', 'same'), users), nsuniqueid=['u4'],
+                      uid=['same'], description=['removed']),
+        ])
+        filename = self.write_ldif([
+            (DN(('uid', 'renamed'), users),
+             {'nsUniqueId': ['u2'], 'uid': ['renamed']}),
+            (DN(('uid', 'moved'), groups),
+             {'nsUniqueId': ['u3'], 'uid': ['moved']}),
+            (DN(('uid', 'same'), users),
+             {'nsUniqueId': ['u4'], 'uid': ['same']}),
+            (DN(('cn', 'new'), groups),
+             {'nsUniqueId': ['u1'], 'cn': ['new']}),
+        ])
+        self.restore._Restore__replay_changed(conn, filename, suffix)
+        # renamed entries are found by their nsUniqueId
+        assert conn.changes == [
+            ('rename', str(DN(('uid', 'old'), users)), 'uid=renamed', None),
+            ('modify', str(DN(('uid', 'renamed'), users)),
+             [(ldap.MOD_REPLACE, 'uid', ['renamed'])]),
+            ('rename', str(DN(('uid', 'moved'), users)), 'uid=moved',
+             str(groups)),
+            ('modify', str(DN(('uid', 'moved'), groups)),
+             [(ldap.MOD_REPLACE, 'uid', ['moved'])]),
+            ('modify', str(DN(('uid', 'same'), users)),
+             [(ldap.MOD_DELETE, 'description', None),
+              (ldap.MOD_REPLACE, 'uid', ['same'])]),
+            ('add', str(DN(('cn', 'new'), groups)), [('cn', ['new'])]),
+        ]
@@ -26,12 +26,16 @@
 # The DM password needs to be set in ~/.ipa/.dmpw
 
 import os
+import shutil
+import tempfile
 
 import nose
+import ldap.schema
 from nose.tools import assert_raises  # pylint: disable=E0611
 import nss.nss as nss
 
-from ipaserver.plugins.ldap2 import ldap2
+from ipaserver.plugins.ldap2 import ldap2, LDAPConnectionPool
+from ipapython.ipaldap import SchemaCache, IPASimpleLDAPObject
 from ipalib.plugins.service import service, service_show
 from ipalib.plugins.host import host
 from ipalib import api, x509, create_api, errors
@@ -305,3 +309,366 @@ class test_LDAPEntry(object):
 
         e.raw['test'].append('second')
         assert e['test'] == ['not list', u'second']
+
+
+class test_indirect_membership(object):
+    """
+    Compare the batched and per-entry indirect membership resolution
+    """
+    depth = 3
+    width = 3
+
+    def setUp(self):
+        self.conn = None
+        self.dns = []
+        pwfile = api.env.dot_ipa + os.sep + ".dmpw"
+        if ipautil.file_exists(pwfile):
+            fp = open(pwfile, "r")
+            dm_password = fp.read().rstrip()
+            fp.close()
+        else:
+            raise nose.SkipTest("No directory manager password in %s" % pwfile)
+        self.ldapuri = 'ldap://%s' % ipautil.format_netloc(api.env.host)
+        self.conn = ldap2(shared_instance=False, ldap_uri=self.ldapuri)
+        self.conn.connect(bind_dn=DN(('cn', 'directory manager')),
+                          bind_pw=dm_password)
+        self.container = DN(api.env.container_group, api.env.basedn)
+        self._add_tree(u'testnest', self.depth)
+
+    def tearDown(self):
+        if self.conn and self.conn.isconnected():
+            for dn in reversed(self.dns):
+                try:
+                    self.conn.delete_entry(dn)
+                except errors.NotFound:
+                    pass
+            self.conn.disconnect()
+
+    def _add_tree(self, name, depth):
+        members = []
+        if depth > 0:
+            for i in range(self.width):
+                members.append(self._add_tree(u'%s-%d' % (name, i), depth - 1))
+        dn = DN(('cn', name), self.container)
+        entry = self.conn.make_entry(
+            dn,
+            objectclass=['top', 'groupofnames', 'nestedgroup'],
+            cn=[name])
+        if members:
+            entry['member'] = members
+        self.conn.add_entry(entry)
+        self.dns.append(dn)
+        return dn
+
+    def _find(self, batch_size):
+        self.conn.indirect_batch_size = batch_size
+        entries, truncated = self.conn.find_entries(
+            filter='(cn=testnest*)',
+            attrs_list=['member', 'memberof',
+                        'memberindirect', 'memberofindirect'],
+            base_dn=self.container,
+            scope=self.conn.SCOPE_ONELEVEL,
+            size_limit=0)
+        result = {}
+        for entry in entries:
+            result[entry.dn] = dict(
+                (attr, set(entry.get(attr, [])))
+                for attr in ('member', 'memberof',
+                             'memberindirect', 'memberofindirect'))
+        return result
+
+    def test_batch(self):
+        per_entry = self._find(0)
+        batched = self._find(100)
+        assert len(per_entry) == len(self.dns)
+        assert batched == per_entry
+        root = per_entry[DN(('cn', u'testnest'), self.container)]
+        assert len(root['memberindirect']) == self.width ** 2 + self.width ** 3
+
+
+class test_entry_cache(object):
+    """
+    Test the request-scoped entry cache of ldap2
+    """
+
+    def setUp(self):
+        self.conn = None
+        pwfile = api.env.dot_ipa + os.sep + ".dmpw"
+        if ipautil.file_exists(pwfile):
+            fp = open(pwfile, "r")
+            dm_password = fp.read().rstrip()
+            fp.close()
+        else:
+            raise nose.SkipTest("No directory manager password in %s" % pwfile)
+        self.ldapuri = 'ldap://%s' % ipautil.format_netloc(api.env.host)
+        self.conn = ldap2(shared_instance=False, ldap_uri=self.ldapuri)
+        self.conn._use_entry_cache = lambda: True
+        self.conn.connect(bind_dn=DN(('cn', 'directory manager')),
+                          bind_pw=dm_password)
+        self.dn = DN(('cn', 'testcache'), api.env.container_group,
+                     api.env.basedn)
+        entry = self.conn.make_entry(
+            self.dn, objectclass=['top', 'groupofnames'], cn=[u'testcache'],
+            description=[u'before'])
+        self.conn.add_entry(entry)
+
+    def tearDown(self):
+        if self.conn and self.conn.isconnected():
+            try:
+                self.conn.delete_entry(self.dn)
+            except errors.NotFound:
+                pass
+            self.conn.disconnect()
+
+    def test_cache(self):
+        cache = self.conn._get_entry_cache()
+        entry = self.conn.get_entry(self.dn, ['description'])
+        assert cache.hits == 0
+
+        # The cached copy does not see changes made to the returned entry
+        entry['description'] = [u'changed']
+        entry = self.conn.get_entry(self.dn, ['Description'])
+        assert cache.hits == 1
+        assert entry['description'] == [u'before']
+        assert entry.generate_modlist() == []
+
+        # Writes invalidate the cache
+        entry['description'] = [u'after']
+        self.conn.update_entry(entry)
+        entry = self.conn.get_entry(self.dn, ['description'])
+        assert cache.hits == 1
+        assert entry['description'] == [u'after']
+
+
+class _FakeConnection(object):
+    def __init__(self):
+        self.unbound = False
+        self.options = {}
+
+    def set_option(self, option, value):
+        self.options[option] = value
+
+    def search_s(self, *args, **kwargs):
+        return []
+
+    def unbind_s(self):
+        self.unbound = True
+
+
+class test_LDAPConnectionPool(object):
+    """
+    Test the LDAPConnectionPool class
+    """
+    key1 = ('ldap://example.com', 'admin@EXAMPLE.COM')
+    key2 = ('ldap://example.com', 'user@EXAMPLE.COM')
+
+    def setUp(self):
+        self.pool = LDAPConnectionPool(max_size=2, idle_timeout=60)
+
+    def test_reuse(self):
+        pool = self.pool
+        assert pool.acquire(self.key1) is None
+        conn = _FakeConnection()
+        pool.register(self.key1, conn, bind_time=0.5)
+        assert pool.release(conn)
+        assert not conn.unbound
+
+        assert pool.acquire(self.key2) is None
+        assert pool.acquire(self.key1) is conn
+        assert pool.acquire(self.key1) is None
+
+        stats = pool.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 3
+        assert stats['binds'] == 1
+        assert stats['bind_time_avg'] == 0.5
+        assert stats['borrowed'] == 1
+
+    def test_not_pooled(self):
+        assert not self.pool.release(_FakeConnection())
+
+    def test_idle_timeout(self):
+        pool = self.pool
+        conn = _FakeConnection()
+        pool.register(self.key1, conn)
+        pool.release(conn)
+        pool.idle_timeout = -1
+        assert pool.acquire(self.key1) is None
+        assert conn.unbound
+        assert pool.stats()['evictions'] == 1
+
+    def test_ticket_expiration(self):
+        pool = self.pool
+        conn = _FakeConnection()
+        pool.register(self.key1, conn, expiration=1)
+        pool.release(conn)
+        assert conn.unbound
+        assert pool.stats()['idle'] == 0
+
+    def test_bounded(self):
+        pool = self.pool
+        conns = [_FakeConnection() for i in range(3)]
+        for conn in conns:
+            pool.register(self.key1, conn)
+        for conn in conns:
+            pool.release(conn)
+        assert conns[0].unbound
+        assert not conns[1].unbound
+        assert not conns[2].unbound
+        assert pool.stats()['idle'] == 2
+
+    def test_disabled(self):
+        pool = self.pool
+        conn = _FakeConnection()
+        pool.register(self.key1, conn)
+        pool.configure(max_size=0)
+        assert pool.release(conn)
+        assert conn.unbound
+
+
+class _FakeSchemaConnection(object):
+    def __init__(self):
+        self.searches = []
+        self.entry = {
+            'attributeTypes': [
+                "( 2.5.4.3 NAME 'cn' "
+                "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )"],
+            'objectClasses': [
+                "( 2.5.6.0 NAME 'top' ABSTRACT MUST objectClass )"],
+            'modifyTimestamp': ['20140101000000Z'],
+            'nsSchemaCSN': ['52c35a4d000000000000'],
+        }
+
+    def search_s(self, base, scope, attrlist=None):
+        self.searches.append(sorted(attrlist))
+        return [(base, dict((k, v) for (k, v) in self.entry.items()
+                            if k.lower() in attrlist))]
+
+
+class test_SchemaCache(object):
+    """
+    Test the SchemaCache class
+    """
+    url = 'ldap://example.com'
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_memory(self):
+        cache = SchemaCache()
+        conn = _FakeSchemaConnection()
+        schema = cache.get_schema(self.url, conn)
+        assert schema.get_obj(ldap.schema.AttributeType, 'cn') is not None
+        assert cache.get_schema(self.url, conn) is schema
+        assert len(conn.searches) == 1
+        assert os.listdir(self.cache_dir) == []
+
+    def test_disk(self):
+        conn = _FakeSchemaConnection()
+        SchemaCache(self.cache_dir).get_schema(self.url, conn)
+        assert len(os.listdir(self.cache_dir)) == 1
+
+        # Another process only checks whether the schema changed
+        conn.searches = []
+        schema = SchemaCache(self.cache_dir).get_schema(self.url, conn)
+        assert schema.get_obj(ldap.schema.AttributeType, 'cn') is not None
+        assert conn.searches == [['modifytimestamp', 'nsschemacsn']]
+
+        # The schema is downloaded again when it changes
+        conn.searches = []
+        conn.entry['nsSchemaCSN'] = ['52c35a4e000000000000']
+        SchemaCache(self.cache_dir).get_schema(self.url, conn)
+        assert len(conn.searches) == 2
+
+        # and when an update is forced
+        conn.searches = []
+        SchemaCache(self.cache_dir).get_schema(self.url, conn,
+                                               force_update=True)
+        assert len(conn.searches) == 1
+        assert 'objectclasses' in conn.searches[0]
+
+
+class test_attribute_table(object):
+    """
+    Test the compiled attribute table of IPASimpleLDAPObject
+    """
+    schema_entry = {
+        'attributeTypes': [
+            "( 2.5.4.3 NAME ( 'cn' 'commonName' ) "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.15 )",
+            "( 2.5.4.31 NAME 'member' "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )",
+            "( 1.3.6.1.1.1.1.0 NAME 'uidNumber' "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.27 SINGLE-VALUE )",
+            "( 2.5.4.36 NAME 'userCertificate' "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.8 )",
+            "( 2.16.840.1.113730.3.1.217 NAME 'memberOf' "
+            "SYNTAX 1.3.6.1.4.1.1466.115.121.1.12 )",
+        ],
+        'objectClasses': [
+            "( 2.5.6.0 NAME 'top' ABSTRACT MUST objectClass )"],
+    }
+
+    def setUp(self):
+        self.conn = IPASimpleLDAPObject('ldap://example.com', False)
+        self.conn._schema = ldap.schema.SubSchema(self.schema_entry)
+        self.conn._has_schema = True
+
+    def test_lookup(self):
+        conn = self.conn
+        for attr in ('cn', 'CN', u'commonName', '2.5.4.3', 'cn;lang-en'):
+            assert conn.get_syntax(attr) == '1.3.6.1.4.1.1466.115.121.1.15'
+            assert conn.has_dn_syntax(attr) is False
+            assert conn.get_single_value(attr) is False
+        assert conn.has_dn_syntax('member') is True
+        assert conn.get_single_value('uidnumber') is True
+
+        # Special case attributes
+        assert conn.has_dn_syntax('managedTemplate') is True
+        assert conn.get_single_value('nsslapd-lookthroughlimit') is True
+
+        # Unknown attributes
+        assert conn.get_syntax('foo') is None
+        assert conn.has_dn_syntax('foo') is False
+        assert conn.get_single_value('foo') is None
+
+    def test_decode(self):
+        conn = self.conn
+        assert conn.decode(['foo'], 'cn') == [u'foo']
+        assert conn.decode(('cn=foo',), 'member') == (DN(('cn', 'foo')),)
+        assert conn.decode(['\x00\x01'], 'usercertificate') == ['\x00\x01']
+        assert conn.decode({'memberOf': ['cn=foo']}, None) == {
+            u'memberOf': [DN(('cn', 'foo'))]}
+
+    def test_lazy_decode(self):
+        """
+        Test that entries decode only the attributes which are accessed
+        """
+        conn = self.conn
+        decoded = []
+        decode = conn.decode
+
+        def counting_decode(val, attr):
+            decoded.append(attr)
+            return decode(val, attr)
+        conn.decode = counting_decode
+
+        result = [('cn=foo,dc=example,dc=com', {
+            'cn': ['foo'],
+            'memberOf': ['cn=bar,dc=example,dc=com'],
+        })]
+        [entry] = conn.convert_result(result)
+        assert decoded == []
+        assert entry.generate_modlist() == []
+
+        assert entry['commonName'] == [u'foo']
+        assert decoded == ['cn']
+        assert entry.raw['memberOf'] == ['cn=bar,dc=example,dc=com']
+        assert decoded == ['cn']
+
+        entry['cn'].append(u'baz')
+        assert entry.generate_modlist() == [
+            (ldap.MOD_ADD, 'cn', ['baz'])]
@@ -22,13 +22,23 @@ Test the `ipaserver.rpc` module.
 """
 
 import json
+from cStringIO import StringIO
 
 from ipatests.util import create_test_api, assert_equal, raises, PluginTester
 from ipatests.data import unicode_str
-from ipalib import errors, Command
+from ipalib import errors, Command, backend
+from ipalib.parameters import Str
+from ipalib.plugins.baseldap import LDAPObject, LDAPSearch
+from ipapython.dn import DN
 from ipaserver import rpcserver
 
 
+class FakeEntry(dict):
+    def __init__(self, dn, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = dn
+
+
 class StartResponse(object):
     def __init__(self):
         self.reset()
@@ -245,3 +255,145 @@ class test_jsonserver(PluginTester):
         options = dict(givenname=u'John', sn='Doe')
         d = dict(method=u'user_add', params=(args, options), id=18)
         assert o.unmarshal(json.dumps(d)) == (u'user_add', args, options, 18)
+
+        # Test with invalid format:
+        d = dict(method=u'user_add', params=(args, options), id=18,
+                 format=u'tiny')
+        e = raises(errors.JSONError, o.unmarshal, json.dumps(d))
+        assert unicode(e.error) == 'format must be one of pretty, compact'
+
+    def test_marshal(self):
+        """
+        Test the `ipaserver.rpcserver.jsonserver.marshal` method.
+        """
+        (o, api, home) = self.instance('Backend', in_server=True)
+        result = dict(count=1, result=[dict(cn=(unicode_str,))])
+
+        pretty = o.marshal(result, None, 18)
+        assert '\n' in pretty
+
+        # Test with the compact format requested:
+        d = dict(method=u'user_find', params=((), {}), id=18,
+                 format=u'compact')
+        try:
+            o.unmarshal(json.dumps(d))
+            compact = o.marshal(result, None, 18)
+        finally:
+            rpcserver.context.__dict__.pop('json_format', None)
+        assert '\n' not in compact
+        assert len(compact) < len(pretty)
+        assert_equal(json.loads(compact), json.loads(pretty))
+
+    def test_get_accept_format(self):
+        """
+        Test the `ipaserver.rpcserver.jsonserver.get_accept_format` method.
+        """
+        (o, api, home) = self.instance('Backend', in_server=True)
+        f = o.get_accept_format
+        assert f({}) is None
+        assert f(dict(HTTP_ACCEPT='application/json')) is None
+        assert f(dict(HTTP_ACCEPT='text/html, application/json; format=compact')) == 'compact'
+        assert f(dict(HTTP_ACCEPT='text/html; format=compact')) is None
+        assert f(dict(HTTP_ACCEPT='application/json; format=tiny')) is None
+
+    def test_stream(self):
+        """
+        Test streaming a search with ``Accept: application/x-ndjson``.
+        """
+        pages = [
+            [u'c', u'a'],
+            [u'b'],
+            [u'd', u'e', u'f'],
+        ]
+        post_calls = []
+
+        class ldap2(backend.Backend):
+            SCOPE_ONELEVEL = 1
+            MATCH_ALL = '&'
+
+            def make_filter(self, entry_attrs, exact=True, rules='|'):
+                return u''
+
+            def combine_filters(self, filters, rules='|'):
+                return u''
+
+            def find_entries_paged(self, filter=None, attrs_list=None,
+                                   base_dn=None, scope=None,
+                                   time_limit=None, size_limit=None):
+                for (i, page) in enumerate(pages):
+                    entries = [FakeEntry(DN(('cn', cn), base_dn), cn=[cn])
+                               for cn in page]
+                    yield (entries, i == len(pages) - 1)
+
+        class fake(LDAPObject):
+            container_dn = DN(('cn', 'fake'))
+            object_class = ['fake']
+            default_attributes = ['cn']
+            takes_params = (Str('cn', primary_key=True),)
+
+        class fake_find(LDAPSearch):
+            msg_summary = u'%(count)d fakes matched'
+
+            def post_callback(self, ldap, entries, truncated, *args,
+                              **options):
+                post_calls.append([e['cn'][0] for e in entries])
+                return truncated
+
+        class fake_list(LDAPSearch):
+            def execute(self, *args, **options):
+                return dict(result=[dict(cn=(u'x',)), dict(cn=(u'y',))],
+                            count=2, truncated=False)
+
+        (o, api, home) = self.instance('Backend', ldap2, fake, fake_find,
+                                       fake_list, in_server=True)
+
+        def call(name):
+            data = json.dumps(dict(method=name, params=[[], {}], id=18))
+            environ = {
+                'HTTP_REFERER': 'https://%s/ipa/ui' % api.env.host,
+                'HTTP_ACCEPT': rpcserver.NDJSON_CONTENT_TYPE,
+                'CONTENT_TYPE': 'application/json',
+                'CONTENT_LENGTH': str(len(data)),
+                'REQUEST_METHOD': 'POST',
+                'wsgi.input': StringIO(data),
+            }
+            start_response = StartResponse()
+            body = ''.join(o(environ, start_response))
+            assert start_response.status == '200 Success'
+            return (start_response.headers[0], body)
+
+        def stream(name):
+            (header, body) = call(name)
+            assert header == (
+                'Content-Type',
+                rpcserver.NDJSON_CONTENT_TYPE + '; charset=utf-8')
+            lines = [json.loads(line) for line in body.splitlines()]
+            for line in lines[:-1]:
+                assert line.keys() == [u'entry']
+            return ([line['entry'] for line in lines[:-1]], lines[-1])
+
+        # The post callback runs once per page, entries are sorted within
+        # their page only
+        (entries, last) = stream(u'fake_find')
+        assert post_calls == pages
+        assert [e['cn'] for e in entries] == \
+            [[u'a'], [u'c'], [u'b'], [u'd'], [u'e'], [u'f']]
+        assert last['error'] is None
+        assert last['id'] == 18
+        assert_equal(last['result'], dict(
+            count=6, truncated=True, summary=u'6 fakes matched'))
+
+        # A command which overrides execute is streamed as a single page
+        del post_calls[:]
+        (entries, last) = stream(u'fake_list')
+        assert post_calls == []
+        assert entries == [dict(cn=[u'x']), dict(cn=[u'y'])]
+        assert_equal(last['result'], dict(
+            count=2, truncated=False, summary=None))
+
+        # Requests failing before the search starts get a regular response
+        (header, body) = call(u'fake_missing')
+        assert header == ('Content-Type', 'application/json; charset=utf-8')
+        response = json.loads(body)
+        assert response['result'] is None
+        assert response['error']['name'] == u'CommandError'
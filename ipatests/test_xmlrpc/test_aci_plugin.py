@@ -0,0 +1,272 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the ACI index of the `ipalib.plugins.aci` module.
+
+These tests do not need a server, the ACIs are read from a fake ldap2
+backend.
+"""
+
+from ipalib import api, errors, backend, Command
+from ipalib.aci import ACI
+from ipalib.plugins import aci as aci_plugin
+from ipalib.plugins import permission as permission_plugin
+from ipapython.dn import DN
+from ipatests.util import create_test_api, assert_equal
+
+basedn = api.env.basedn
+users_dn = DN(api.env.container_user, basedn)
+groups_dn = DN(api.env.container_group, basedn)
+hosts_dn = DN(api.env.container_host, basedn)
+pbac_dn = DN(api.env.container_permission, basedn)
+
+add_users = (
+    '(target = "ldap:///uid=*,%s")(version 3.0;acl "permission:Add Users";'
+    'allow (add) groupdn = "ldap:///cn=Add Users,%s";)' % (users_dn, pbac_dn))
+modify_users = (
+    '(targetattr = "givenname || sn || cn")'
+    '(target = "ldap:///uid=*,%s")(version 3.0;acl "permission:Modify Users";'
+    'allow (write) groupdn = "ldap:///cn=Modify Users,%s";)' %
+    (users_dn, pbac_dn))
+modify_membership = (
+    '(targetattr = "member")(targetfilter = "(!(cn=admins))")'
+    '(target = "ldap:///cn=*,%s")'
+    '(version 3.0;acl "permission:Modify Group membership";'
+    'allow (write) groupdn = "ldap:///cn=Modify Group membership,%s";)' %
+    (groups_dn, pbac_dn))
+self_password = (
+    '(targetattr = "userpassword || krbprincipalkey")'
+    '(version 3.0;acl "selfservice:Self can write own password";'
+    'allow (write) userdn = "ldap:///self";)')
+editors = (
+    '(targetattr = "mail || telephonenumber")'
+    '(targetfilter = "(memberOf=cn=admins,%s)")'
+    '(version 3.0;acl "delegation:editors";'
+    'allow (write) groupdn = "ldap:///cn=editors,%s";)' %
+    (groups_dn, groups_dn))
+group_description = (
+    '(targetattr = "description")(target = "ldap:///cn=ipausers,%s")'
+    '(version 3.0;acl "Group description";'
+    'allow (read, write) groupdn = "ldap:///cn=editors,%s";)' %
+    (groups_dn, groups_dn))
+read_hosts = (
+    '(targetattr = "cn")(target = "ldap:///fqdn=*,%s")'
+    '(version 3.0;acl "permission:Read Hosts";'
+    'allow (read) groupdn = "ldap:///%s";)' % (hosts_dn, basedn))
+
+corpus = [add_users, modify_users, modify_membership, self_password, editors,
+          group_description, read_hosts, self_password]
+
+# The ACIs each aci_find option finds in the corpus, as found by aci_find
+# before the ACIs were indexed
+find_results = [
+    ((u'users',), {},
+     ['permission:Add Users', 'permission:Modify Users']),
+    ((u'PASSWORD',), {},
+     ['selfservice:Self can write own password',
+      'selfservice:Self can write own password']),
+    ((None,), dict(aciname=u'editors'),
+     ['delegation:editors']),
+    ((None,), dict(aciprefix=u'permission'),
+     ['permission:Add Users', 'permission:Modify Users',
+      'permission:Modify Group membership', 'permission:Read Hosts']),
+    ((None,), dict(aciprefix=u'none'),
+     ['Group description']),
+    ((None,), dict(attrs=(u'CN',)),
+     ['permission:Modify Users', 'permission:Read Hosts']),
+    ((None,), dict(attrs=(u'sn', u'givenname')),
+     ['permission:Modify Users']),
+    ((None,), dict(permission=u'Read Hosts'),
+     ['permission:Read Hosts']),
+    ((None,), dict(permission=u'missing'),
+     ['permission:Add Users', 'permission:Modify Users',
+      'permission:Modify Group membership',
+      'selfservice:Self can write own password', 'delegation:editors',
+      'Group description', 'permission:Read Hosts',
+      'selfservice:Self can write own password']),
+    ((None,), dict(permissions=(u'write',)),
+     ['permission:Modify Users', 'permission:Modify Group membership',
+      'selfservice:Self can write own password', 'delegation:editors',
+      'Group description', 'selfservice:Self can write own password']),
+    ((None,), dict(permissions=(u'read', u'write')),
+     ['Group description']),
+    ((None,), dict(memberof=u'(memberOf=cn=admins,%s)' % groups_dn),
+     ['delegation:editors']),
+    ((None,), dict(type=u'user'),
+     ['permission:Add Users', 'permission:Modify Users']),
+    ((None,), dict(type=u'host'),
+     ['permission:Read Hosts']),
+    ((None,), dict(selfaci=True),
+     ['selfservice:Self can write own password',
+      'selfservice:Self can write own password']),
+    ((None,), dict(aciprefix=u'delegation', group=u'editors'),
+     ['delegation:editors']),
+    ((None,), dict(targetgroup=u'ipausers'),
+     ['Group description']),
+    ((None,), dict(filter=u'!(cn=admins)'),
+     ['permission:Modify Group membership']),
+    ((None,), dict(subtree=unicode('LDAP:///UID=*,%s' % users_dn)),
+     ['permission:Add Users', 'permission:Modify Users']),
+    ((u'modify',), dict(aciprefix=u'permission', attrs=(u'member',)),
+     ['permission:Modify Group membership']),
+]
+
+
+class FakeEntry(dict):
+    def __init__(self, dn, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = dn
+
+    @property
+    def single_value(self):
+        return SingleValue(self)
+
+
+class SingleValue(object):
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __getitem__(self, name):
+        return self.entry[name][0]
+
+    def __setitem__(self, name, value):
+        self.entry[name] = [value]
+
+    def get(self, name, default=None):
+        if name in self.entry:
+            return self[name]
+        return default
+
+
+def create_aci_api(acistrs):
+    """
+    Return an API with the aci commands reading ``acistrs`` from a fake
+    ldap2 backend.
+    """
+    (api2, home) = create_test_api(in_server=True, basedn=basedn)
+
+    class ldap2(backend.Backend):
+        acis = list(acistrs)
+        updates = []
+
+        def get_entry(self, dn, attrs_list=None):
+            return FakeEntry(dn, aci=list(self.acis))
+
+        def update_entry(self, entry):
+            self.updates.append(entry)
+            ldap2.acis = list(entry['aci'])
+
+    class permission_show(Command):
+        takes_args = ('cn',)
+
+        def execute(self, cn, **options):
+            if cn != u'Read Hosts':
+                raise errors.NotFound(reason=u'%s: permission not found' % cn)
+            return dict(result={})
+
+    for klass in (aci_plugin.aci, aci_plugin.aci_find, aci_plugin.aci_show,
+                  aci_plugin.aci_del, ldap2, permission_show):
+        api2.register(klass)
+    api2.finalize()
+    return api2
+
+
+def test_aci_find():
+    """
+    Test that each aci_find option finds what it found without the index.
+    """
+    api2 = create_aci_api(corpus)
+    for (args, options, expected) in find_results:
+        result = api2.Command.aci_find.execute(*args, raw=True, **options)
+        names = [ACI(r['aci']).name for r in result['result']]
+        assert_equal((args, options, names), (args, options, expected))
+        assert result['count'] == len(expected)
+
+
+def test_get_aci_index():
+    """
+    Test that the parsed ACIs are reused and old lists are evicted.
+    """
+    index = aci_plugin.get_aci_index(corpus)
+    assert aci_plugin.get_aci_index(list(corpus)) is index
+    assert [a.name for a in index.acis] == [ACI(s).name for s in corpus]
+
+    # Only the new ACI is parsed when an ACI is added
+    added = corpus + [group_description.replace('Group description', 'x')]
+    changed = aci_plugin.get_aci_index(added)
+    assert changed is not index
+    for acistr in corpus:
+        assert changed.by_string[acistr] is index.by_string[acistr]
+    assert changed.acis[-1].name == u'x'
+
+    # The least recently used lists are evicted
+    for i in xrange(aci_plugin._ACI_INDEX_CACHE_SIZE):
+        aci_plugin.get_aci_index(corpus[:i])
+    assert len(aci_plugin._aci_index_cache) == \
+        aci_plugin._ACI_INDEX_CACHE_SIZE
+    assert tuple(added) not in aci_plugin._aci_index_cache
+    assert aci_plugin.get_aci_index(added) is not changed
+
+
+def test_aci_del():
+    """
+    Test that aci_del removes the string of the ACI it found.
+    """
+    spaced = self_password.replace('(write)', '(write)  ')
+    assert ACI(spaced).isequal(ACI(self_password))
+    api2 = create_aci_api([editors, self_password, spaced])
+
+    api2.Command.aci_del.execute(u'Self can write own password',
+                                 aciprefix=u'selfservice')
+    assert api2.Backend.ldap2.acis == [editors, spaced]
+    api2.Command.aci_del.execute(u'Self can write own password',
+                                 aciprefix=u'selfservice')
+    assert api2.Backend.ldap2.acis == [editors]
+
+
+def test_upgrade_permission():
+    """
+    Test that upgrading a permission does not change the cached ACI.
+    """
+    (api2, home) = create_test_api(in_server=True, basedn=basedn)
+
+    class ldap2(backend.Backend):
+        def get_entry(self, dn, attrs_list=None):
+            return FakeEntry(dn, aci=[modify_users])
+
+    api2.register(ldap2)
+    api2.register(permission_plugin.permission)
+    api2.finalize()
+
+    aci = aci_plugin.get_aci_index([modify_users]).by_string[modify_users]
+    orig = repr(aci)
+    permissions = list(aci.permissions)
+    attrs = list(aci.target['targetattr']['expression'])
+
+    entry = FakeEntry(DN(('cn', u'Modify Users'), pbac_dn),
+                      cn=[u'Modify Users'],
+                      objectclass=[u'top', u'groupofnames',
+                                   u'ipapermission'])
+    api2.Object.permission.upgrade_permission(entry)
+    entry['ipapermright'].append(u'delete')
+    entry['ipapermincludedattr'].append(u'mail')
+
+    assert repr(aci) == orig
+    assert aci.permissions == permissions
+    assert aci.target['targetattr']['expression'] == attrs
+    assert aci_plugin.get_aci_index([modify_users]).by_string[modify_users] \
+        is aci
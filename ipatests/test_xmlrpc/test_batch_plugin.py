@@ -229,4 +229,98 @@ class test_batch(Declarative):
             ),
         ),
 
+        dict(
+            desc='Run reads in parallel around writes',
+            command=('batch', [
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_add',
+                    params=([group1], dict(description=u'Test desc 1',
+                                           nonposix=True))),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='ping', params=([], dict()), parallel=True),
+                dict(method='group_show', params=([group1], dict())),
+                dict(method='group_del', params=([group1], dict())),
+                dict(method='group_show', params=([group1], dict())),
+            ], dict(parallel=True)),
+            expected=dict(
+                count=7,
+                results=deepequal_list(
+                    dict(
+                        error=u'%s: group not found' % group1,
+                        error_name=u'NotFound',
+                        error_code=4001,
+                    ),
+                    dict(
+                        value=group1,
+                        summary=u'Added group "testgroup1"',
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            objectclass=objectclasses.group,
+                            ipauniqueid=[fuzzy_uuid],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(summary=Fuzzy('IPA server version .*'), error=None),
+                    dict(
+                        value=group1,
+                        summary=None,
+                        result=dict(
+                            cn=[group1],
+                            description=[u'Test desc 1'],
+                            dn=DN(('cn', 'testgroup1'),
+                                  ('cn', 'groups'),
+                                  ('cn', 'accounts'),
+                                  api.env.basedn),
+                            ),
+                        error=None),
+                    dict(
+                        summary=u'Deleted group "%s"' % group1,
+                        result=dict(failed=u''),
+                        value=group1,
+                        error=None),
+                    dict(
+                        error=u'%s: group not found' % group1,
+                        error_name=u'NotFound',
+                        error_code=4001,
+                    ),
+                ),
+            ),
+        ),
+
     ]
+
+
+def test_parallel_methods():
+    """
+    Test which methods batch --parallel runs concurrently
+    """
+    batch = api.Command['batch']
+    for (method, parallel) in [
+            (dict(method='group_show'), True),
+            (dict(method='group_find'), True),
+            (dict(method='aci_show'), True),
+            (dict(method='group_add'), False),
+            (dict(method='group_add', parallel=True), True),
+            (dict(method='ping'), False),
+            # retrieves the trust, but writes its domains
+            (dict(method='trust_fetch_domains'), False),
+            (dict(method='no_such_command', parallel=True), False),
+            (dict(), False),
+        ]:
+        assert_equal(batch._is_parallel(method), parallel)
@@ -27,6 +27,7 @@ from xmlrpc_test import Declarative, fuzzy_digits, fuzzy_uuid
 class test_config(Declarative):
 
     cleanup_commands = [
+        ('config_mod', [], dict(ipasearchrecordslimit=100)),
     ]
 
     tests = [
@@ -148,4 +149,46 @@ class test_config(Declarative):
                 ),
         ),
 
+        dict(
+            desc='Set search records limit to 1',
+            command=('config_mod', [], dict(ipasearchrecordslimit=1)),
+            expected=dict(
+                    result=lambda d: d['ipasearchrecordslimit'] == (u'1',),
+                    value=u'',
+                    summary=None,
+                ),
+        ),
+
+        dict(
+            desc='Check the new search records limit is used immediately',
+            command=('group_find', [], {}),
+            expected=dict(
+                    count=1,
+                    truncated=True,
+                    summary=u'1 group matched',
+                    result=lambda r: len(r) == 1,
+                ),
+        ),
+
+        dict(
+            desc='Set search records limit back to 100',
+            command=('config_mod', [], dict(ipasearchrecordslimit=100)),
+            expected=dict(
+                    result=lambda d: d['ipasearchrecordslimit'] == (u'100',),
+                    value=u'',
+                    summary=None,
+                ),
+        ),
+
+        dict(
+            desc='Check the restored search records limit is used immediately',
+            command=('group_find', [], {}),
+            expected=dict(
+                    count=lambda c: c > 1,
+                    truncated=False,
+                    summary=lambda s: s.endswith(u'groups matched'),
+                    result=lambda r: len(r) > 1,
+                ),
+        ),
+
     ]
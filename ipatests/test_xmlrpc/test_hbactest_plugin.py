@@ -198,6 +198,52 @@ class test_hbactest(XMLRPC_test):
             nodetail=True
         )
 
+    def test_f_hbactest_bulk(self):
+        """
+        Test 'ipa hbactest-bulk --rules' (explicit IPA rules, many accesses)
+        """
+        ret = api.Command['hbactest_bulk'](
+            access=[u'%s,%s,%s' % (self.test_user, self.test_host,
+                                   self.test_service),
+                    u'%s,%s,%s' % (self.test_user, self.test_sourcehost,
+                                   self.test_service)],
+            rules=self.rule_names
+        )
+        assert ret['value'] == False
+        assert ret['error'] == None
+        assert len(ret['result']) == 2
+        assert ret['result'][0]['user'] == self.test_user
+        assert ret['result'][0]['targethost'] == self.test_host
+        assert ret['result'][0]['value'] == True
+        assert ret['result'][1]['value'] == False
+        for i in [0,1,2,3]:
+            assert self.rule_names[i] in ret['result'][0]['matched']
+            assert self.rule_names[i] in ret['result'][1]['notmatched']
+
+    def test_f_hbactest_bulk_non_existing_rule(self):
+        """
+        Test running 'ipa hbactest-bulk' with non-existing rule in --rules
+        """
+        ret = api.Command['hbactest_bulk'](
+            access=[u'%s,%s,%s' % (self.test_user, self.test_host,
+                                   self.test_service)],
+            rules=[u'%s_1x1' % (rule) for rule in self.rule_names],
+        )
+
+        assert ret['value'] == False
+        assert ret['result'] == ()
+        for rule in self.rule_names:
+            assert u'%s_1x1' % (rule) in ret['error']
+
+    @raises(errors.ValidationError)
+    def test_f_hbactest_bulk_invalid_access(self):
+        """
+        Test running 'ipa hbactest-bulk' with an incomplete access
+        """
+        api.Command['hbactest_bulk'](
+            access=[u'%s,%s' % (self.test_user, self.test_host)],
+        )
+
     def test_g_hbactest_clear_testing_data(self):
         """
         Clear data for HBAC test plugin testing.
@@ -31,7 +31,7 @@ from nose.tools import raises, assert_raises
 from nose.plugins.skip import SkipTest
 from ipatests.test_xmlrpc.xmlrpc_test import (Declarative, XMLRPC_test,
     fuzzy_uuid, fuzzy_digits, fuzzy_hash, fuzzy_date, fuzzy_issuer,
-    fuzzy_hex)
+    fuzzy_hex, FakeEntry, count_post_callback_searches)
 from ipatests.test_xmlrpc import objectclasses
 from ipatests.test_xmlrpc.testcert import get_testcert
 import base64
@@ -958,3 +958,27 @@ class test_host_false_pwd_change(XMLRPC_test):
         # verify that it's gone
         with assert_raises(errors.NotFound):
             api.Command['host_show'](self.fqdn1)
+
+
+class test_host_find_searches(object):
+    """
+    Test that host_find does not search LDAP for every host it returns
+    """
+
+    def get_entries(self, count):
+        netgroup = DN(('cn', u'testnetgroup'), api.env.container_netgroup,
+                      api.env.basedn)
+        return [
+            FakeEntry(DN(('fqdn', u'testhost%d.%s' % (i, api.env.domain)),
+                         api.env.container_host, api.env.basedn),
+                      memberofindirect=[netgroup])
+            for i in xrange(count)
+        ]
+
+    def test_searches(self):
+        for options in ({}, {'all': True}):
+            one = count_post_callback_searches(
+                'host_find', self.get_entries(1), **options)
+            many = count_post_callback_searches(
+                'host_find', self.get_entries(50), **options)
+            assert one == many, (options, one, many)
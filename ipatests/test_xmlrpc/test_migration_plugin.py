@@ -0,0 +1,210 @@
+# Copyright (C) 2014  Red Hat
+# see file 'COPYING' for use and warranty information
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Test the paging and checkpoints of the `ipalib.plugins.migration` module.
+
+These tests do not need a server, the objects are read from a fake DS and
+written to a fake ldap2 backend.
+"""
+
+import os
+import shutil
+import tempfile
+
+from ipalib import api, errors, backend
+from ipalib.parameters import Str
+from ipalib.plugins import migration
+from ipalib.plugins.baseldap import LDAPObject
+from ipapython.dn import DN
+from ipatests.util import create_test_api, assert_equal, raises
+
+ds_base_dn = DN(('dc', 'ds'), ('dc', 'example'), ('dc', 'com'))
+ds_uri = 'ldap://ds.example.com'
+
+
+class FakeEntry(dict):
+    def __init__(self, dn, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = dn
+
+
+class FakeDS(object):
+    """
+    Directory to migrate from, returning the groups cn in pages.
+    """
+    ldap_uri = ds_uri
+    SCOPE_ONELEVEL = 1
+
+    def __init__(self, pages):
+        self.pages = pages
+
+    def find_entries_paged(self, filter=None, attrs_list=None, base_dn=None,
+                           scope=None, time_limit=None, size_limit=None,
+                           search_refs=False):
+        for page in self.pages:
+            yield ([FakeEntry(DN(('cn', cn), base_dn), cn=[cn],
+                              objectclass=['groupOfNames'])
+                    for cn in page], False)
+
+
+class ldap2(backend.Backend):
+    SCOPE_SUBTREE = 2
+
+    # Plugins are locked, the tests change these on the class
+    added = []
+    fail_on = None
+
+    def make_dn_from_attr(self, attr, value, parent_dn=None):
+        return DN((attr, value), parent_dn)
+
+    def get_entry(self, dn, attrs_list=None):
+        return FakeEntry(dn, gidnumber=['1000'])
+
+    def has_upg(self):
+        return False
+
+    def add_entry(self, entry):
+        if entry['cn'][0] == self.fail_on:
+            raise KeyboardInterrupt()
+        self.added.append(entry['cn'][0])
+
+    def find_entries(self, *args, **kw):
+        raise errors.NotFound(reason='no users')
+
+
+class group(LDAPObject):
+    container_dn = DN(('cn', 'groups'), ('cn', 'accounts'))
+    object_name = 'group'
+    object_name_plural = 'groups'
+    object_class = ['ipausergroup']
+    takes_params = (Str('cn', primary_key=True),)
+
+
+class migrate_ds(migration.migrate_ds):
+    migrate_objects = {
+        'group': {
+            'filter_template': '(&(|%s)(cn=*))',
+            'oc_option': 'groupobjectclass',
+            'oc_blacklist_option': None,
+            'attr_blacklist_option': None,
+            'pre_callback': None,
+            'post_callback': None,
+            'exc_callback': None,
+            'pre_page_callback': None,
+            'post_page_callback': None,
+        },
+    }
+    migrate_order = ('group',)
+
+
+class test_migrate(object):
+    """
+    Test the `ipalib.plugins.migration.migrate_ds.migrate` method.
+    """
+
+    def setUp(self):
+        self.checkpoint_dir = tempfile.mkdtemp()
+        (self.api, home) = create_test_api(
+            in_server=True, basedn=api.env.basedn,
+            migration_checkpoint_dir=self.checkpoint_dir)
+        for klass in (ldap2, group, migrate_ds):
+            self.api.register(klass)
+        self.api.finalize()
+        self.ldap = self.api.Backend.ldap2
+        ldap2.added = []
+        ldap2.fail_on = None
+        self.page_keys = []
+
+    def tearDown(self):
+        shutil.rmtree(self.checkpoint_dir)
+
+    def migrate(self, pages, **options):
+        def page_callback(ldap, pkeys, config, ctx):
+            self.page_keys.append(pkeys)
+
+        options.setdefault('groupobjectclass', (u'groupofnames',))
+        options.setdefault('exclude_groups', ())
+        options.setdefault('schema', u'RFC2307bis')
+        cmd = self.api.Command.migrate_ds
+        cmd.migrate_objects['group']['pre_page_callback'] = page_callback
+        try:
+            return cmd.migrate(
+                self.ldap, {'ipadefaultprimarygroup': u'ipausers'},
+                FakeDS(pages), ds_base_dn, options)
+        finally:
+            cmd.migrate_objects['group']['pre_page_callback'] = None
+
+    def checkpoint(self):
+        names = os.listdir(self.checkpoint_dir)
+        if not names:
+            return None
+        assert len(names) == 1
+        assert names[0].endswith('-group')
+        with open(os.path.join(self.checkpoint_dir, names[0])) as f:
+            return f.read().splitlines()
+
+    def test_pages(self):
+        """
+        Test that the objects are migrated page by page.
+        """
+        pages = [[u'G1', u'g2'], [u'g3'], [u'g4', u'g5', u'G6']]
+        (migrated, failed, stats) = self.migrate(
+            pages, exclude_groups=(u'g5',))
+
+        assert self.page_keys == [[u'g1', u'g2'], [u'g3'], [u'g4', u'g6']]
+        assert self.ldap.added == [u'g1', u'g2', u'g3', u'g4', u'g6']
+        assert migrated == dict(group=[u'g1', u'g2', u'g3', u'g4', u'g6'])
+        assert failed == dict(group={})
+        counts = dict((k, v) for (k, v) in stats['group'].iteritems()
+                      if not k.endswith('_rate'))
+        assert_equal(counts, dict(read=6, converted=5, written=5, skipped=0))
+        # A complete migration leaves nothing to resume
+        assert self.checkpoint() is None
+
+    def test_resume(self):
+        """
+        Test that --resume skips the objects migrated before an interruption.
+        """
+        pages = [[u'g1', u'g2'], [u'g3', u'g4'], [u'g5']]
+
+        # Interrupted in the middle of the second page, the checkpoint is
+        # complete while the traceback still refers to it
+        ldap2.fail_on = u'g4'
+        try:
+            self.migrate(pages)
+        except KeyboardInterrupt:
+            assert self.checkpoint() == ['g1', 'g2', 'g3']
+        else:
+            raise AssertionError('migration not interrupted')
+        assert self.ldap.added == [u'g1', u'g2', u'g3']
+
+        # Without --resume everything is migrated again
+        ldap2.fail_on = u'g1'
+        raises(KeyboardInterrupt, self.migrate, pages)
+        assert self.checkpoint() == []
+
+        ldap2.fail_on = u'g4'
+        raises(KeyboardInterrupt, self.migrate, pages)
+        ldap2.fail_on = None
+        del ldap2.added[:]
+        del self.page_keys[:]
+        (migrated, failed, stats) = self.migrate(pages, resume=True)
+        assert self.page_keys == [[u'g4'], [u'g5']]
+        assert self.ldap.added == [u'g4', u'g5']
+        assert migrated == dict(group=[u'g4', u'g5'])
+        assert stats['group']['skipped'] == 3
+        assert self.checkpoint() is None
@@ -22,6 +22,7 @@ Test the `ipalib/plugins/service.py` module.
 """
 
 from ipalib import api, errors, x509
+from ipalib.plugins import service
 from ipatests.test_xmlrpc.xmlrpc_test import Declarative, fuzzy_uuid, fuzzy_hash
 from ipatests.test_xmlrpc.xmlrpc_test import fuzzy_digits, fuzzy_date, fuzzy_issuer
 from ipatests.test_xmlrpc.xmlrpc_test import fuzzy_hex
@@ -626,3 +627,24 @@ class test_service(Declarative):
 
 
     ]
+
+
+class test_certificate_attrs_cache(object):
+    """
+    Test that set_certificate_attrs parses a certificate only once
+    """
+
+    def test_cache(self):
+        cert = base64.b64decode(badservercert)
+        first = dict(usercertificate=[cert])
+        service.set_certificate_attrs(first)
+        before = service.get_certificate_attrs_cache_stats()
+
+        second = dict(usercertificate=[cert])
+        service.set_certificate_attrs(second)
+        after = service.get_certificate_attrs_cache_stats()
+
+        assert second == first
+        assert u'puma.greyoak.com' in first['subject']
+        assert after['hits'] == before['hits'] + 1
+        assert after['misses'] == before['misses']
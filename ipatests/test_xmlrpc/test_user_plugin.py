@@ -30,7 +30,7 @@ from ipatests.test_xmlrpc import objectclasses
 from ipatests.util import assert_equal, assert_not_equal
 from xmlrpc_test import (Declarative, fuzzy_digits, fuzzy_uuid, fuzzy_password,
                          fuzzy_string, fuzzy_dergeneralizedtime, add_sid,
-                         add_oc)
+                         add_oc, FakeEntry, count_post_callback_searches)
 from ipapython.dn import DN
 
 user1=u'tuser1'
@@ -1471,3 +1471,24 @@ class test_user(Declarative):
         ),
 
     ]
+
+
+class test_user_find_searches(object):
+    """
+    Test that user_find does not search LDAP for every user it returns
+    """
+
+    def get_entries(self, count):
+        return [
+            FakeEntry(DN(('uid', u'tuser%d' % i), api.env.container_user,
+                         api.env.basedn))
+            for i in xrange(count)
+        ]
+
+    def test_searches(self):
+        for options in ({}, {'all': True}):
+            one = count_post_callback_searches(
+                'user_find', self.get_entries(1), **options)
+            many = count_post_callback_searches(
+                'user_find', self.get_entries(50), **options)
+            assert one == many, (options, one, many)
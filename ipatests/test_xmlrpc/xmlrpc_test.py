@@ -26,6 +26,7 @@ from ipatests.util import assert_deepequal, Fuzzy
 from ipalib import api, request, errors
 from ipalib.x509 import valid_issuer
 from ipapython.version import API_VERSION
+from ipapython import ipaldap
 
 
 # Matches a gidnumber like '1391016742'
@@ -146,6 +147,45 @@ def assert_is_member(entry, value, key='member'):
     )
 
 
+class SearchCountingLDAP(ipaldap.LDAPClient):
+    """
+    LDAP backend which finds no entries and counts the searches made.
+    """
+
+    def __init__(self):
+        super(SearchCountingLDAP, self).__init__('ldap://localhost')
+        self.searches = 0
+
+    def find_entries(self, *args, **kwargs):
+        self.searches += 1
+        raise errors.NotFound(reason='no entries')
+
+    def get_entry(self, *args, **kwargs):
+        self.searches += 1
+        raise errors.NotFound(reason='no entry')
+
+
+class FakeEntry(dict):
+    """
+    Search result entry for post callbacks called with SearchCountingLDAP.
+    """
+
+    def __init__(self, dn, **attrs):
+        super(FakeEntry, self).__init__(attrs)
+        self.dn = dn
+        self.single_value = {}
+
+
+def count_post_callback_searches(command, entries, **options):
+    """
+    Return the number of searches made by the post callback of search
+    ``command`` on ``entries``.
+    """
+    ldap = SearchCountingLDAP()
+    api.Command[command].post_callback(ldap, entries, False, u'', **options)
+    return ldap.searches
+
+
 # Initialize the API. We do this here so that one can run the tests
 # individually instead of at the top-level. If API.bootstrap()
 # has already been called we continue gracefully. Other errors will be